@@ -0,0 +1,65 @@
+"""
+Short-lived cache of token -> user resolution.
+
+Shared by the DRF authentication class and the Channels middleware so that
+REST calls and WebSocket (re)connections don't query the authtoken table
+every time. Entries must be invalidated when a token is deleted or its user
+changes.
+
+Only the id and the active flag of the user are cached, not the user itself
+(and its password hash): the tokens and users returned on a hit are rebuilt
+from them, the other fields of the user are loaded when first accessed.
+"""
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import router
+from rest_framework.authtoken.models import Token
+
+
+def _cache_key(key):
+    return f'auth:token-user:{key}'
+
+
+def _entry(token):
+    return {'user_id': token.user_id, 'is_active': token.user.is_active}
+
+
+def _rebuild(key, entry):
+    db = router.db_for_read(Token)
+    user = User.from_db(db, ['id', 'is_active'], [entry['user_id'], entry['is_active']])
+    token = Token.from_db(db, ['key', 'user_id'], [key, entry['user_id']])
+    token.user = user
+    return token
+
+
+def load_token(key):
+    return Token.objects.select_related('user').filter(key=key).first()
+
+
+def get_token(key):
+    """Return the Token (with its user) for ``key``, or None."""
+    entry = cache.get(_cache_key(key))
+    if entry is not None:
+        return _rebuild(key, entry)
+    token = load_token(key)
+    if token is not None:
+        cache.set(_cache_key(key), _entry(token), settings.AUTH_TOKEN_CACHE_TTL)
+    return token
+
+
+async def aget_token(key):
+    """Async version of ``get_token``."""
+    entry = await cache.aget(_cache_key(key))
+    if entry is not None:
+        return _rebuild(key, entry)
+    # Not the bare async ORM: database_sync_to_async gives the connection back to the pool
+    token = await database_sync_to_async(load_token)(key)
+    if token is not None:
+        await cache.aset(_cache_key(key), _entry(token), settings.AUTH_TOKEN_CACHE_TTL)
+    return token
+
+
+def invalidate_token(key):
+    cache.delete(_cache_key(key))
@@ -0,0 +1,21 @@
+from urllib.parse import parse_qs
+
+from channels.middleware import BaseMiddleware
+from django.contrib.auth.models import AnonymousUser
+
+from .cache import aget_token
+
+
+class TokenAuthMiddleware(BaseMiddleware):
+    """Authenticate WebSocket connections with the ``token`` query string parameter."""
+
+    async def __call__(self, scope, receive, send):
+        query_params = parse_qs(scope["query_string"].decode())
+        key = query_params.get('token', [None])[0]
+        token = await aget_token(key) if key else None
+        scope = dict(scope)
+        if token is not None and token.user.is_active:
+            scope['user'] = token.user
+        else:
+            scope['user'] = AnonymousUser()
+        return await super().__call__(scope, receive, send)
@@ -1,3 +1,121 @@
-from django.test import TestCase
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import TransactionTestCase
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APITestCase
 
-# Create your tests here.
+from .cache import _cache_key, aget_token, get_token, invalidate_token
+from .middleware import TokenAuthMiddleware
+from .models import Profile
+
+
+class TokenCacheTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('alice', password='password123')
+        Profile.objects.create(user=self.user)
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def test_miss_then_hit(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(get_token(self.token.key).user, self.user)
+        with self.assertNumQueries(0):
+            token = get_token(self.token.key)
+            self.assertEqual((token.key, token.user.id, token.user.is_active), (self.token.key, self.user.id, True))
+        # Loaded on access
+        with self.assertNumQueries(1):
+            self.assertEqual(token.user.username, 'alice')
+
+    def test_user_not_cached(self):
+        get_token(self.token.key)
+        self.assertEqual(cache.get(_cache_key(self.token.key)), {'user_id': self.user.id, 'is_active': True})
+
+    def test_unknown_token(self):
+        self.assertIsNone(get_token('unknown'))
+        self.assertIsNone(cache.get(_cache_key('unknown')))
+
+    def get_user(self):
+        return self.client.get('/api/auth/get_user/')
+
+    def test_cached_user_served(self):
+        self.get_user()
+        response = self.get_user()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['user']['username'], 'alice')
+
+    def test_logout_invalidates(self):
+        self.get_user()
+        self.assertEqual(self.client.post('/api/auth/logout/').status_code, 200)
+        self.assertIsNone(cache.get(_cache_key(self.token.key)))
+        self.assertEqual(self.get_user().status_code, 401)
+
+    def test_delete_user_invalidates(self):
+        self.get_user()
+        self.assertEqual(self.client.delete('/api/auth/delete_user/').status_code, 200)
+        self.assertIsNone(cache.get(_cache_key(self.token.key)))
+        self.assertEqual(self.get_user().status_code, 401)
+
+    def test_update_user_invalidates(self):
+        self.get_user()
+        response = self.client.patch('/api/auth/update_user/', {'username': 'bob'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(cache.get(_cache_key(self.token.key)))
+        self.assertEqual(self.get_user().data['user']['username'], 'bob')
+
+    def test_update_avatar_type_invalidates(self):
+        self.get_user()
+        response = self.client.patch('/api/auth/update_avatar_type/', {'profile_picture_type': 2}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(cache.get(_cache_key(self.token.key)))
+        self.assertEqual(response.data['user']['avatar_url'], 'https://robohash.org/alice?set=set2')
+
+    def test_inactive_user_refused_after_invalidation(self):
+        self.get_user()
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        invalidate_token(self.token.key)
+        self.assertEqual(self.get_user().status_code, 401)
+
+
+class TokenAuthMiddlewareTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('alice')
+        self.token = Token.objects.create(user=self.user)
+
+    async def authenticate(self, key):
+        """User of the scope the middleware hands to the application."""
+        scopes = []
+
+        async def application(scope, receive, send):
+            scopes.append(scope)
+
+        query_string = f'token={key}'.encode() if key else b''
+        await TokenAuthMiddleware(application)({'type': 'websocket', 'query_string': query_string}, None, None)
+        return scopes[0]['user']
+
+    async def test_token(self):
+        for _ in range(2):
+            user = await self.authenticate(self.token.key)
+            self.assertEqual((user.is_authenticated, user.id), (True, self.user.id))
+        self.assertIsNotNone(await cache.aget(_cache_key(self.token.key)))
+
+    async def test_bad_token(self):
+        for key in (None, '', 'unknown'):
+            self.assertFalse((await self.authenticate(key)).is_authenticated)
+
+    async def test_deleted_token(self):
+        await self.authenticate(self.token.key)
+        await self.token.adelete()
+        invalidate_token(self.token.key)
+        self.assertFalse((await self.authenticate(self.token.key)).is_authenticated)
+        self.assertIsNone(await aget_token(self.token.key))
+
+    async def test_inactive_user(self):
+        await self.authenticate(self.token.key)
+        await sync_to_async(User.objects.filter(pk=self.user.pk).update)(is_active=False)
+        # Still cached until invalidated
+        self.assertTrue((await self.authenticate(self.token.key)).is_authenticated)
+        invalidate_token(self.token.key)
+        self.assertFalse((await self.authenticate(self.token.key)).is_authenticated)
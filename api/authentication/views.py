@@ -2,11 +2,13 @@ from rest_framework import viewsets
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import AllowAny, IsAuthenticated
-from rest_framework.authentication import TokenAuthentication
 from rest_framework import status
 from django.contrib.auth.models import User
 from rest_framework.authtoken.models import Token
 from django.shortcuts import get_object_or_404
+from .authentication import CachedTokenAuthentication
+from .cache import invalidate_token
+from .models import Profile
 from .serializers import UserSerializer
 
 class AuthenticationViewSet(viewsets.ViewSet):
@@ -37,26 +39,28 @@ class AuthenticationViewSet(viewsets.ViewSet):
             }, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-    @action(detail=False, methods=['get'], authentication_classes=[TokenAuthentication], permission_classes=[IsAuthenticated])
+    @action(detail=False, methods=['get'], authentication_classes=[CachedTokenAuthentication], permission_classes=[IsAuthenticated])
     def get_user(self, request):
         user = request.user
         serializer = UserSerializer(user)
         return Response({'user': serializer.data}, status=status.HTTP_200_OK)
 
-    @action(detail=False, methods=['post'], authentication_classes=[TokenAuthentication], permission_classes=[IsAuthenticated])
+    @action(detail=False, methods=['post'], authentication_classes=[CachedTokenAuthentication], permission_classes=[IsAuthenticated])
     def logout(self, request):
+        invalidate_token(request.user.auth_token.key)
         request.user.auth_token.delete()
         return Response({'message': 'User logged out successfully'}, status=status.HTTP_200_OK)
 
-    @action(detail=False, methods=['delete'], authentication_classes=[TokenAuthentication], permission_classes=[IsAuthenticated])
+    @action(detail=False, methods=['delete'], authentication_classes=[CachedTokenAuthentication], permission_classes=[IsAuthenticated])
     def delete_user(self, request):
         user = request.user
         if hasattr(user, 'auth_token'):
+            invalidate_token(user.auth_token.key)
             user.auth_token.delete()
         user.delete()
         return Response({'message': 'User deleted successfully'}, status=status.HTTP_200_OK)
 
-    @action(detail=False, methods=['patch'], authentication_classes=[TokenAuthentication], permission_classes=[IsAuthenticated])
+    @action(detail=False, methods=['patch'], authentication_classes=[CachedTokenAuthentication], permission_classes=[IsAuthenticated])
     def update_user(self, request):
         user = request.user
         data = request.data.copy()
@@ -70,19 +74,22 @@ class AuthenticationViewSet(viewsets.ViewSet):
                 user.save()
             else:
                 serializer.save()
+            # The cached token holds the active flag of the user
+            invalidate_token(request.auth.key)
             return Response({'message': 'User updated successfully', 'user': serializer.data}, status=status.HTTP_200_OK)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-    @action(detail=False, methods=['patch'], authentication_classes=[TokenAuthentication], permission_classes=[IsAuthenticated])
+    @action(detail=False, methods=['patch'], authentication_classes=[CachedTokenAuthentication], permission_classes=[IsAuthenticated])
     def update_avatar_type(self, request):
         if 'profile_picture_type' not in request.data:
             return Response({'error': 'profile_picture_type is required'}, status=status.HTTP_400_BAD_REQUEST)
         picture_type = int(request.data['profile_picture_type'])
         if not (1 <= picture_type <= 4):
             return Response({'error': 'profile_picture_type must be between 1 and 4'}, status=status.HTTP_400_BAD_REQUEST)
-        profile = request.user.profile
+        profile, _ = Profile.objects.get_or_create(user=request.user)
         profile.profile_picture_type = picture_type
         profile.save()
+        invalidate_token(request.auth.key)
         serializer = UserSerializer(request.user)
         return Response({'message': 'Avatar type updated successfully', 'user': serializer.data}, status=status.HTTP_200_OK)
 
@@ -0,0 +1,19 @@
+# Generated by Django 5.1.5 on 2026-10-18 15:42
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('groups', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='group',
+            index=models.Index(fields=['-created_at', '-id'], name='group_created_idx'),
+        ),
+    ]
@@ -10,6 +10,12 @@ class Group(models.Model):
     )
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        # Keyset pagination of the listing, see mindvswild.pagination
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='group_created_idx'),
+        ]
+
     def __str__(self):
         return self.name
 
@@ -31,4 +31,16 @@ class GroupSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Group
-        fields = ['id', 'name', 'description', 'created_by', 'created_at', 'members']
\ No newline at end of file
+        fields = ['id', 'name', 'description', 'created_by', 'created_at', 'members']
+
+
+class GroupListSerializer(serializers.ModelSerializer):
+    """Group listing: the number of members instead of the nested members."""
+    created_by = UserSerializer(read_only=True)
+    # Annotated by the queryset
+    member_count = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = Group
+        fields = ['id', 'name', 'description', 'created_by', 'created_at', 'member_count']
+        read_only_fields = fields
@@ -1,3 +1,52 @@
-from django.test import TestCase
+from django.contrib.auth.models import User
+from rest_framework.test import APITestCase
 
-# Create your tests here.
+from authentication.models import Profile
+from .models import Group, GroupUser
+
+
+class GroupQueryCountTests(APITestCase):
+    """The group endpoints run a constant number of queries, whatever the number of groups and members."""
+
+    def setUp(self):
+        self.user = User.objects.create_user('owner', password='x')
+        Profile.objects.create(user=self.user, profile_picture_type=2)
+        self.client.force_authenticate(self.user)
+
+    def add_groups(self, count, members):
+        groups = []
+        for i in range(count):
+            group = Group.objects.create(name=f'group {i}', created_by=self.user)
+            GroupUser.objects.create(group=group, user=self.user, is_admin=True)
+            for j in range(members):
+                user = User.objects.create_user(f'member {group.id}-{j}')
+                Profile.objects.create(user=user)
+                GroupUser.objects.create(group=group, user=user)
+            groups.append(group)
+        return groups
+
+    def test_list(self):
+        self.add_groups(2, 1)
+        with self.assertNumQueries(1):
+            self.client.get('/api/groups/')
+        self.add_groups(10, 5)
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/groups/')
+        self.assertEqual(len(response.data['results']), 12)
+        self.assertEqual({group['member_count'] for group in response.data['results']}, {2, 6})
+
+    def test_cursor_pages(self):
+        groups = self.add_groups(7, 0)
+        first = self.client.get('/api/groups/?page_size=4')
+        second = self.client.get(first.data['next'])
+        self.assertIsNone(second.data['next'])
+        ids = [group['id'] for group in first.data['results'] + second.data['results']]
+        self.assertEqual(ids, [group.id for group in reversed(groups)])
+
+    def test_retrieve(self):
+        small, large = self.add_groups(1, 1) + self.add_groups(1, 20)
+        with self.assertNumQueries(2):
+            self.client.get(f'/api/groups/{small.id}/')
+        with self.assertNumQueries(2):
+            response = self.client.get(f'/api/groups/{large.id}/')
+        self.assertEqual(len(response.data['members']), 21)
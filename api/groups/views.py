@@ -7,11 +7,14 @@ from datetime import timedelta
 import secrets
 from django.contrib.auth.models import User
 from django.db import transaction
+from django.db.models import Count, OuterRef, Prefetch, Subquery
+from django.db.models.functions import Coalesce
 import environ
 
 from .models import Group, GroupUser
 from invite.models import GroupInvitation
-from .serializers import GroupSerializer
+from .serializers import GroupListSerializer, GroupSerializer
+from mindvswild.pagination import CreatedAtCursorPagination
 
 env = environ.Env()
 
@@ -19,12 +22,30 @@ class GroupViewSet(viewsets.ModelViewSet):
     queryset = Group.objects.all()
     serializer_class = GroupSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = CreatedAtCursorPagination
 
     # Return the groups where the user is a member
     def get_queryset(self):
         """Limit the display to groups where the user is a member"""
         user = self.request.user
-        return Group.objects.filter(memberships__user=user).distinct()
+        # Subquery rather than a join on the memberships, which would skew the counts
+        queryset = Group.objects.filter(
+            pk__in=GroupUser.objects.filter(user=user).values('group')
+        ).select_related('created_by__auth_profile')
+        if self.action == 'list':
+            # Correlated subquery: only computed for the rows of the page
+            return queryset.annotate(member_count=Coalesce(Subquery(
+                GroupUser.objects.filter(group=OuterRef('pk')).order_by().values('group')
+                .annotate(count=Count('pk')).values('count')
+            ), 0))
+        return queryset.prefetch_related(
+            Prefetch('memberships', queryset=GroupUser.objects.select_related('user__auth_profile'))
+        )
+
+    def get_serializer_class(self):
+        if self.action == 'list':
+            return GroupListSerializer
+        return GroupSerializer
 
     # Save the group creator as admin
     def perform_create(self, serializer):
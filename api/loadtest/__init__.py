@@ -0,0 +1,19 @@
+"""
+Load generator of the quiz WebSocket.
+
+Bots register through the auth API, create and join rooms through the rooms
+API, open the room WebSocket, start the games and answer the questions after
+a delay drawn from a configurable distribution. The run reports the connect
+latency, the fan-out latency of the question broadcasts (from the server time
+of ``new_question`` to its reception by each bot), the messages received per
+second and the CPU used by the server.
+
+By default the harness starts everything on this machine: a stub of the quiz
+API, then a Daphne server with ``loadtest.settings`` (SQLite, in-memory
+channel layer and stores), and stops them at the end::
+
+    python -m loadtest --bots 1000 --room-size 50 --questions 5
+
+``--url`` runs the bots against a server started separately instead, whose
+CPU is reported when ``--server-pid`` is given.
+"""
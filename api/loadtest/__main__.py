@@ -0,0 +1,162 @@
+import argparse
+import asyncio
+import os
+import resource
+import socket
+import subprocess
+import sys
+import time
+import uuid
+from pathlib import Path
+
+import aiohttp
+
+from . import __doc__ as usage
+from . import stub_api
+from .bots import LATENCIES, Bot, Metrics, percentile, play_room
+
+API_DIR = Path(__file__).resolve().parent.parent
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        prog='python -m loadtest', description=usage, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument('--bots', type=int, default=200)
+    parser.add_argument('--room-size', type=int, default=20, help="Players per room, its creator included")
+    parser.add_argument('--questions', type=int, default=3)
+    parser.add_argument('--question-time', type=int, default=10, help="Seconds per question (at least 10)")
+    parser.add_argument('--latency', choices=sorted(LATENCIES), default='lognormal',
+                        help="Distribution of the answer delays")
+    parser.add_argument('--latency-mean', type=float, default=2.0, help="Mean answer delay (seconds)")
+    parser.add_argument('--latency-spread', type=float, default=0.5,
+                        help="Standard deviation, half width or shape of the distribution")
+    parser.add_argument('--accuracy', type=float, default=0.6, help="Share of right answers")
+    parser.add_argument('--protocol', choices=['json', 'compact', 'deflate'], default='json')
+    parser.add_argument('--http-concurrency', type=int, default=20, help="HTTP requests in flight at once")
+    parser.add_argument('--game-timeout', type=float, default=300)
+    parser.add_argument('--url', help="Server to load instead of starting a local one, e.g. http://127.0.0.1:8000")
+    parser.add_argument('--server-pid', type=int, help="Process of the --url server, to report its CPU")
+    parser.add_argument('--port', type=int, default=8765, help="Port of the local Daphne")
+    parser.add_argument('--stub-port', type=int, default=8900, help="Port of the local quiz API stub")
+    return parser.parse_args()
+
+
+def process_cpu(pid):
+    """User + system CPU seconds of a process, from /proc (None elsewhere than Linux)."""
+    try:
+        fields = Path(f'/proc/{pid}/stat').read_text().rsplit(')', 1)[1].split()
+    except OSError:
+        return None
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+
+def raise_open_files_limit():
+    # One socket per bot on both sides, Daphne inherits the limit
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft != hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+def start_server(options):
+    """Migrate a fresh SQLite database and start Daphne with the load test settings."""
+    env = {
+        **os.environ,
+        'DJANGO_SETTINGS_MODULE': 'loadtest.settings',
+        'LOADTEST_QUIZ_API_URL': f'http://127.0.0.1:{options.stub_port}/quiz',
+    }
+    database = Path(env.setdefault('LOADTEST_DB', '/tmp/mindvswild-loadtest.sqlite3'))
+    for path in (database, database.with_name(database.name + '-wal'), database.with_name(database.name + '-shm')):
+        path.unlink(missing_ok=True)
+    subprocess.run([sys.executable, 'manage.py', 'migrate', '-v', '0'], cwd=API_DIR, env=env, check=True)
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'daphne', '-v', '0', '-b', '127.0.0.1', '-p', str(options.port),
+         'mindvswild.asgi:application'],
+        cwd=API_DIR, env=env,
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise SystemExit("Daphne exited")
+        try:
+            socket.create_connection(('127.0.0.1', options.port), timeout=1).close()
+            return server
+        except OSError:
+            time.sleep(0.2)
+    server.terminate()
+    raise SystemExit("Daphne did not start")
+
+
+async def run(options, server_pid):
+    metrics = Metrics()
+    options.http_slots = asyncio.Semaphore(options.http_concurrency)
+    run_id = uuid.uuid4().hex[:6]
+    # WebSockets hold their connection: no limit on the pool, requests are bounded by http_slots
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0)) as http:
+        bots = [Bot(f'lt{run_id}{index}', http, metrics, options) for index in range(options.bots)]
+
+        print(f"Registering {len(bots)} bots...")
+        start = time.perf_counter()
+        results = await asyncio.gather(*(bot.register() for bot in bots), return_exceptions=True)
+        bots = [bot for bot, result in zip(bots, results) if not isinstance(result, Exception)]
+        register_time = time.perf_counter() - start
+        rooms = [bots[index:index + options.room_size] for index in range(0, len(bots), options.room_size)]
+
+        print(f"Playing {len(rooms)} games...")
+        cpu_before = process_cpu(server_pid) if server_pid else None
+        own_cpu_before = time.process_time()
+        start = time.perf_counter()
+        await asyncio.gather(*(play_room(room, options, metrics) for room in rooms))
+        elapsed = time.perf_counter() - start
+        cpu_after = process_cpu(server_pid) if server_pid else None
+        own_cpu = time.process_time() - own_cpu_before
+
+    report(metrics, options, len(bots), register_time, elapsed, cpu_before, cpu_after, own_cpu)
+
+
+def ms(seconds):
+    return '-' if seconds is None else f'{seconds * 1000:.1f} ms'
+
+
+def report(metrics, options, bots, register_time, elapsed, cpu_before, cpu_after, own_cpu):
+    print()
+    print(f"bots registered       {bots}/{options.bots} in {register_time:.1f} s "
+          f"(p50 {ms(percentile(metrics.register, 0.5))}, p99 {ms(percentile(metrics.register, 0.99))})")
+    print(f"games finished        {metrics.games // max(1, options.room_size)} "
+          f"({metrics.games} players) in {elapsed:.1f} s")
+    print(f"connect latency       p50 {ms(percentile(metrics.connect, 0.5))}, "
+          f"p99 {ms(percentile(metrics.connect, 0.99))}, max {ms(percentile(metrics.connect, 1))}")
+    print(f"question fan-out      p50 {ms(percentile(metrics.fanout, 0.5))}, "
+          f"p99 {ms(percentile(metrics.fanout, 0.99))}, max {ms(percentile(metrics.fanout, 1))} "
+          f"({len(metrics.fanout)} deliveries)")
+    print(f"messages received     {metrics.messages} ({metrics.messages / elapsed:.0f}/s, "
+          f"{metrics.bytes / elapsed / 1024:.0f} KiB/s, protocol {options.protocol})")
+    print(f"answers sent          {metrics.answers}")
+    if cpu_before is not None and cpu_after is not None:
+        server_cpu = cpu_after - cpu_before
+        print(f"server CPU            {server_cpu:.1f} s ({server_cpu / elapsed:.0%} of a core)")
+    print(f"load generator CPU    {own_cpu:.1f} s ({own_cpu / elapsed:.0%} of a core)")
+    if metrics.errors:
+        print(f"errors                {metrics.errors}")
+
+
+async def main(options):
+    if options.url:
+        options.ws_url = 'ws' + options.url[len('http'):]
+        return await run(options, options.server_pid)
+
+    stub = await stub_api.start(port=options.stub_port)
+    server = start_server(options)
+    options.url = f'http://127.0.0.1:{options.port}'
+    options.ws_url = f'ws://127.0.0.1:{options.port}'
+    try:
+        await run(options, server.pid)
+    finally:
+        server.terminate()
+        server.wait()
+        await stub.cleanup()
+
+
+if __name__ == '__main__':
+    raise_open_files_limit()
+    asyncio.run(main(parse_args()))
@@ -0,0 +1,210 @@
+"""
+Bots playing the quiz through the HTTP API and the room WebSocket.
+"""
+import asyncio
+import json
+import math
+import random
+import time
+import zlib
+
+import aiohttp
+import msgpack
+
+from quiz.protocol import COMPACT_SUBPROTOCOL, DEFLATE_SUBPROTOCOL, MESSAGE_TYPES
+
+from .stub_api import CORRECT_PREFIX
+
+ACTIONS = {number: action for action, number in MESSAGE_TYPES.items()}
+SUBPROTOCOLS = {'json': (), 'compact': (COMPACT_SUBPROTOCOL,), 'deflate': (DEFLATE_SUBPROTOCOL,)}
+
+
+def constant(mean, spread):
+    return mean
+
+
+def uniform(mean, spread):
+    return random.uniform(max(0, mean - spread), mean + spread)
+
+
+def normal(mean, spread):
+    return max(0, random.gauss(mean, spread))
+
+
+def lognormal(mean, spread):
+    # ``spread`` is the shape: long tail of slow players for the same mean
+    return random.lognormvariate(math.log(mean) - spread ** 2 / 2, spread)
+
+
+def exponential(mean, spread):
+    return random.expovariate(1 / mean)
+
+
+# Answer delays (seconds) by name, from their mean and spread
+LATENCIES = {
+    'constant': constant,
+    'uniform': uniform,
+    'normal': normal,
+    'lognormal': lognormal,
+    'exponential': exponential,
+}
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p * len(values)))]
+
+
+class Metrics:
+    """Measures of all the bots of a run."""
+
+    def __init__(self):
+        self.register = []
+        self.connect = []
+        # Reception time of a question broadcast minus its server time, per bot (seconds)
+        self.fanout = []
+        self.messages = 0
+        self.bytes = 0
+        self.answers = 0
+        self.games = 0
+        self.errors = {}
+
+    def error(self, kind):
+        self.errors[kind] = self.errors.get(kind, 0) + 1
+
+
+class Bot:
+    def __init__(self, name, http, metrics, options):
+        self.name = name
+        self.http = http
+        self.metrics = metrics
+        self.options = options
+        self.token = None
+        self.ws = None
+        self.answering = set()
+
+    @property
+    def headers(self):
+        return {'Authorization': f'Token {self.token}'}
+
+    async def post(self, path, data, auth=True):
+        async with self.options.http_slots:
+            async with self.http.post(
+                f'{self.options.url}/api/{path}', json=data, headers=self.headers if auth else None
+            ) as resp:
+                body = await resp.json()
+                if resp.status >= 400:
+                    raise RuntimeError(f'POST {path}: {resp.status} {body}')
+                return body
+
+    async def register(self):
+        start = time.perf_counter()
+        body = await self.post('auth/register/', {
+            'username': self.name,
+            'password': 'loadtest-password',
+            'email': f'{self.name}@loadtest.invalid',
+        }, auth=False)
+        self.metrics.register.append(time.perf_counter() - start)
+        self.token = body['token']
+
+    async def create_room(self):
+        room = await self.post('rooms/', {'name': f'Salle {self.name}', 'is_active': True})
+        return room['id']
+
+    async def join(self, room_id):
+        await self.post(f'rooms/{room_id}/join/', {})
+
+    async def connect(self, room_id):
+        start = time.perf_counter()
+        self.ws = await self.http.ws_connect(
+            f'{self.options.ws_url}/ws/room/{room_id}/?token={self.token}',
+            protocols=SUBPROTOCOLS[self.options.protocol],
+            max_msg_size=0,
+        )
+        self.metrics.connect.append(time.perf_counter() - start)
+
+    async def start_game(self):
+        await self.ws.send_str(json.dumps({'action': 'start_game', 'options': {
+            'questionCount': self.options.questions,
+            'questionTime': self.options.question_time,
+        }}))
+
+    def decode(self, message):
+        if message.type == aiohttp.WSMsgType.TEXT:
+            return [json.loads(message.data)]
+        if self.options.protocol == 'deflate':
+            return [json.loads(zlib.decompress(message.data, -zlib.MAX_WBITS))]
+        data = msgpack.unpackb(message.data)
+        if 't' in data:
+            data['action'] = ACTIONS[data.pop('t')]
+        return [data]
+
+    def events(self, data):
+        if data.get('action') != 'batch':
+            yield data
+            return
+        for event in data['events']:
+            if 't' in event:
+                event['action'] = ACTIONS[event.pop('t')]
+            yield event
+
+    async def play(self):
+        """Receive the room events until the end of the game, answering the questions."""
+        async for message in self.ws:
+            if message.type not in (aiohttp.WSMsgType.TEXT, aiohttp.WSMsgType.BINARY):
+                break
+            received = time.time()
+            self.metrics.messages += 1
+            self.metrics.bytes += len(message.data)
+            for payload in self.decode(message):
+                for event in self.events(payload):
+                    action = event.get('action')
+                    if action == 'new_question':
+                        self.metrics.fanout.append(received - event['server_time'] / 1000)
+                        task = asyncio.create_task(self.answer(event['question']))
+                        self.answering.add(task)
+                        task.add_done_callback(self.answering.discard)
+                    elif action == 'game_over':
+                        self.metrics.games += 1
+                        return
+                    elif 'error' in event:
+                        self.metrics.error(event['error'])
+
+    async def answer(self, question):
+        latency = LATENCIES[self.options.latency](self.options.latency_mean, self.options.latency_spread)
+        await asyncio.sleep(latency)
+        options = question['options']
+        right = [index for index, option in enumerate(options) if option.startswith(CORRECT_PREFIX)]
+        wrong = [index for index, option in enumerate(options) if not option.startswith(CORRECT_PREFIX)]
+        choice = right if right and random.random() < self.options.accuracy else wrong or right
+        if self.ws is not None and not self.ws.closed:
+            await self.ws.send_str(json.dumps({
+                'action': 'submit_answer', 'question_id': question['id'], 'option': random.choice(choice)
+            }))
+            self.metrics.answers += 1
+
+    async def close(self):
+        for task in list(self.answering):
+            task.cancel()
+        if self.ws is not None:
+            await self.ws.close()
+
+
+async def play_room(bots, options, metrics):
+    """One game: the first bot creates the room, the others join it, then all play."""
+    admin, players = bots[0], bots[1:]
+    try:
+        room_id = await admin.create_room()
+        await asyncio.gather(*(bot.join(room_id) for bot in players))
+        await asyncio.gather(*(bot.connect(room_id) for bot in bots))
+        games = [asyncio.create_task(bot.play()) for bot in bots]
+        await admin.start_game()
+        await asyncio.wait_for(asyncio.gather(*games), options.game_timeout)
+    except asyncio.TimeoutError:
+        metrics.error('game timeout')
+    except (aiohttp.ClientError, RuntimeError) as e:
+        metrics.error(type(e).__name__)
+    finally:
+        await asyncio.gather(*(bot.close() for bot in bots), return_exceptions=True)
@@ -0,0 +1,51 @@
+"""
+Settings of the server under load: the project settings on a single Daphne
+process, with SQLite, the in-memory channel layer and the in-memory stores,
+and the quiz API stub of ``loadtest.stub_api``.
+"""
+import os
+
+for name, value in {
+    'SECRET_KEY': 'loadtest-insecure-secret-key',
+    'DEBUG': 'False',
+    'ALLOWED_HOSTS': '*',
+    'CORS_ALLOWED_ORIGINS': 'http://localhost',
+    'CSRF_TRUSTED_ORIGINS': 'http://localhost',
+    'DB_NAME': '', 'DB_USER': '', 'DB_PASSWORD': '', 'DB_HOST': '', 'DB_PORT': '',
+}.items():
+    os.environ.setdefault(name, value)
+
+from mindvswild.settings import *  # noqa: E402,F401,F403
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.environ.get('LOADTEST_DB', '/tmp/mindvswild-loadtest.sqlite3'),
+        'OPTIONS': {
+            # Thousands of registrations at once: wait for the write lock
+            'timeout': 30,
+            'transaction_mode': 'IMMEDIATE',
+            'init_command': 'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL;',
+        },
+    }
+}
+
+CHANNEL_LAYERS = {
+    'default': {
+        'BACKEND': 'channels.layers.InMemoryChannelLayer',
+        'CONFIG': {'capacity': 10000},
+    }
+}
+
+CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+}
+
+QUIZ_GAME_STORE = 'memory'
+ROOM_LOBBY_BACKEND = 'memory'
+LEADERBOARD_BACKEND = 'memory'
+
+QUIZ_API_URL = os.environ.get('LOADTEST_QUIZ_API_URL', 'http://127.0.0.1:8900/quiz')
+
+# The bots' passwords don't need a slow hash
+PASSWORD_HASHERS = ['django.contrib.auth.hashers.MD5PasswordHasher']
@@ -0,0 +1,56 @@
+"""
+Stub of the upstream quiz API, answering with generated questions.
+
+The right answer of every question starts with ``CORRECT_PREFIX`` so the bots
+can answer right or wrong on purpose.
+"""
+import argparse
+import uuid
+
+from aiohttp import web
+
+CORRECT_PREFIX = 'Bonne réponse'
+
+
+def make_quiz(category=None):
+    key = uuid.uuid4().hex
+    return {
+        '_id': key,
+        'question': f"Question {key[:8]} ?",
+        'answer': f"{CORRECT_PREFIX} {key[:4]}",
+        'badAnswers': [f"Mauvaise réponse {key[:4]}-{n}" for n in range(3)],
+        'category': category or 'loadtest',
+        'difficulty': 'facile',
+    }
+
+
+async def quizzes(request):
+    limit = min(int(request.query.get('limit', 10)), 1000)
+    category = request.query.get('category')
+    return web.json_response({'count': limit, 'quizzes': [make_quiz(category) for _ in range(limit)]})
+
+
+def make_app():
+    app = web.Application()
+    app.router.add_get('/quiz', quizzes)
+    return app
+
+
+async def start(host='127.0.0.1', port=8900):
+    """Serve the stub from the running event loop, return the runner to clean it up."""
+    runner = web.AppRunner(make_app())
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8900)
+    args = parser.parse_args()
+    web.run_app(make_app(), host=args.host, port=args.port)
+
+
+if __name__ == '__main__':
+    main()
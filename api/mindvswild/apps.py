@@ -1,6 +1,11 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
 
 class MindvswildConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'mindvswild'
+
+    def ready(self):
+        from .metrics import instrument_connection
+        connection_created.connect(instrument_connection)
     
\ No newline at end of file
@@ -1,4 +1,7 @@
+import asyncio
 import os
+import sys
+
 import django
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mindvswild.settings')
@@ -6,18 +9,35 @@ django.setup()
 
 from django.core.asgi import get_asgi_application
 from channels.routing import ProtocolTypeRouter, URLRouter
-from channels.auth import AuthMiddlewareStack
+from authentication.middleware import TokenAuthMiddleware
 
 def get_application():
     from quiz.routing import websocket_urlpatterns
     
     return ProtocolTypeRouter({
         "http": get_asgi_application(),
-        "websocket": AuthMiddlewareStack(
+        "websocket": TokenAuthMiddleware(
             URLRouter(
                 websocket_urlpatterns
             )
         ),
     })
 
+def close_clients_on_shutdown():
+    """Close the shared HTTP clients while Daphne's reactor shuts down.
+
+    Daphne doesn't implement the ASGI lifespan protocol, the clients are closed
+    from a reactor shutdown trigger instead, while the event loop still runs.
+    """
+    if 'twisted.internet.reactor' not in sys.modules:
+        return
+    from twisted.internet import defer, reactor
+    from quiz.upstream import quiz_api
+
+    reactor.addSystemEventTrigger(
+        'before', 'shutdown', lambda: defer.Deferred.fromFuture(asyncio.ensure_future(quiz_api.close()))
+    )
+
+
 application = get_application()
+close_clients_on_shutdown()
@@ -0,0 +1,11 @@
+"""
+Helpers of the database connection pool, kept free of Django imports so the
+settings can use them.
+"""
+
+
+def check_connection(connection):
+    """Check a pooled connection when it is borrowed, the pool replaces it if broken."""
+    # Imported here: psycopg_pool is only needed when the pool is enabled
+    from psycopg_pool import ConnectionPool
+    ConnectionPool.check_connection(connection)
@@ -0,0 +1,76 @@
+"""
+Bounded executor of the sync database code called from the event loop.
+
+``database_sync_to_async`` runs the calls of all the consumers of a process
+one after the other, on a single thread. The database code of the consumers
+and engines (membership, players, question bank, saved games) runs instead
+with ``run_sync`` on a dedicated pool of ``DB_EXECUTOR_THREADS`` threads.
+Like ``database_sync_to_async``, each call gives its connection back to the
+pool, which health checks and renews it; the bare async ORM would keep one
+checked out on its shared thread for the life of the process.
+
+Calls beyond the threads wait in the event loop: their number is the queue
+depth exported with the metrics, so a saturated executor shows up before the
+latency does.
+"""
+import asyncio
+import contextvars
+import functools
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from .metrics import Gauge, Histogram
+
+queue_depth = Gauge('db_executor_queue_depth', "Calls waiting for a thread of the database executor.")
+active_calls = Gauge('db_executor_active', "Calls running on the threads of the database executor.")
+wait_seconds = Histogram('db_executor_wait_seconds', "Time the calls waited for a thread of the database executor.")
+
+_executor = None
+# Free threads, per event loop (management commands run their own)
+_slots = weakref.WeakKeyDictionary()
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(settings.DB_EXECUTOR_THREADS, thread_name_prefix='db-executor')
+    return _executor
+
+
+def _call(func, args, kwargs):
+    # Like database_sync_to_async: connections past their age or broken are closed
+    # (given back to the pool) around each call
+    close_old_connections()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+async def run_sync(func, *args, **kwargs):
+    """Run ``func`` on the database executor, once one of its threads is free."""
+    loop = asyncio.get_running_loop()
+    slots = _slots.get(loop)
+    if slots is None:
+        slots = _slots[loop] = asyncio.Semaphore(settings.DB_EXECUTOR_THREADS)
+
+    start = time.perf_counter()
+    queue_depth.inc()
+    try:
+        await slots.acquire()
+    finally:
+        queue_depth.dec()
+    wait_seconds.observe(time.perf_counter() - start)
+
+    active_calls.inc()
+    try:
+        # The context carries the handler the queries are counted for
+        call = functools.partial(contextvars.copy_context().run, _call, func, args, kwargs)
+        return await loop.run_in_executor(get_executor(), call)
+    finally:
+        active_calls.dec()
+        slots.release()
@@ -0,0 +1,223 @@
+"""
+Process metrics in the Prometheus text format, served by ``/metrics``.
+
+A small registry rather than a client library: counters, gauges and
+histograms with labels are updated in place by the code they measure (a dict
+lookup and an addition), and collectors read the values other modules already
+count when the endpoint is scraped. Each worker process exposes its own.
+
+Database queries are counted per handler: ``track`` names the handler running
+in the current context, which ``sync_to_async`` (hence the async ORM) and
+``run_sync`` carry over to the thread executing the queries.
+"""
+import bisect
+import contextlib
+import contextvars
+import time
+
+from asgiref.sync import SyncToAsync
+
+# Metrics and collectors by name, in registration order
+registry = {}
+collectors = []
+
+# Handler the queries of the current context are counted for
+current_handler = contextvars.ContextVar('metrics_handler', default='other')
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ''
+    return '{%s}' % ','.join(f'{name}="{escape(value)}"' for name, value in pairs)
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = 'untyped'
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.values = {}
+        registry[name] = self
+
+    def remove(self, *labels):
+        self.values.pop(labels, None)
+
+    def samples(self):
+        # Copied: the executor threads may add series meanwhile
+        for labels, value in list(self.values.items()):
+            yield self.name, format_labels(self.labels, labels), value
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, *labels, amount=1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value, *labels):
+        self.values[labels] = value
+
+    def inc(self, *labels, amount=1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        series = self.values.get(labels)
+        if series is None:
+            # Per bucket counts (not cumulative), then the sum
+            series = self.values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    @contextlib.contextmanager
+    def time(self, *labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def samples(self):
+        for labels, series in list(self.values.items()):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float('inf')), series):
+                cumulative += count
+                yield (f'{self.name}_bucket',
+                       format_labels(self.labels, labels, [('le', format_value(bound))]), cumulative)
+            yield f'{self.name}_sum', format_labels(self.labels, labels), series[-1]
+            yield f'{self.name}_count', format_labels(self.labels, labels), cumulative
+
+
+def collector(function):
+    """Register a function returning ``(name, kind, help, {label pairs: value})`` tuples at scrape time."""
+    collectors.append(function)
+    return function
+
+
+@contextlib.contextmanager
+def track(histogram, handler):
+    """Time a handler into ``histogram`` and count the queries it makes for it."""
+    token = current_handler.set(handler)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.observe(time.perf_counter() - start, handler)
+        current_handler.reset(token)
+
+
+db_queries = Counter('django_db_queries_total', "Database queries, by handler.", ['handler'])
+db_query_seconds = Histogram('django_db_query_duration_seconds', "Duration of the database queries.", ['handler'])
+
+
+def count_queries(execute, sql, params, many, context):
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        handler = current_handler.get()
+        db_queries.inc(handler)
+        db_query_seconds.observe(time.perf_counter() - start, handler)
+
+
+def instrument_connection(sender, connection, **kwargs):
+    # Connected to connection_created: each thread has its own connection
+    if count_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_queries)
+
+
+@collector
+def sync_executors():
+    # Calls waiting for the threads running the sync code of database_sync_to_async
+    executors = [SyncToAsync.single_thread_executor, *list(SyncToAsync.context_to_thread_executor.values())]
+    return [
+        ('asgiref_sync_executors', 'gauge', "Thread executors of sync_to_async.", {(): len(executors)}),
+        ('asgiref_sync_queue_depth', 'gauge', "Calls queued behind the sync_to_async threads.",
+         {(): sum(executor._work_queue.qsize() for executor in executors)}),
+    ]
+
+
+@collector
+def database_pools():
+    # Imported here: settings are loaded when the endpoint is scraped
+    from django.db import connections
+
+    results = []
+    for alias in connections:
+        wrapper = connections[alias]
+        if not wrapper.settings_dict.get('OPTIONS', {}).get('pool'):
+            continue
+        stats = wrapper.pool.get_stats()
+        labels = (('alias', alias),)
+        results += [
+            ('django_db_pool_connections', 'gauge', "Connections of the pool, by state.", {
+                (*labels, ('state', 'open')): stats.get('pool_size', 0),
+                (*labels, ('state', 'available')): stats.get('pool_available', 0),
+            }),
+            ('django_db_pool_max_connections', 'gauge', "Maximum size of the pool.", {labels: stats.get('pool_max')}),
+            ('django_db_pool_requests_waiting', 'gauge', "Threads waiting for a connection.",
+             {labels: stats.get('requests_waiting', 0)}),
+            ('django_db_pool_requests_total', 'counter', "Connections borrowed from the pool.",
+             {labels: stats.get('requests_num', 0)}),
+            ('django_db_pool_requests_queued_total', 'counter', "Borrows that had to wait for a connection.",
+             {labels: stats.get('requests_queued', 0)}),
+            ('django_db_pool_wait_seconds_total', 'counter', "Time spent waiting for a connection.",
+             {labels: stats.get('requests_wait_ms', 0) / 1000}),
+            ('django_db_pool_timeouts_total', 'counter', "Borrows that timed out.",
+             {labels: stats.get('requests_errors', 0)}),
+            ('django_db_pool_connects_total', 'counter', "Connections opened by the pool, by outcome.", {
+                (*labels, ('outcome', 'ok')): stats.get('connections_num', 0),
+                (*labels, ('outcome', 'error')): stats.get('connections_errors', 0),
+            }),
+            ('django_db_pool_connections_lost_total', 'counter', "Broken connections found by the checks.",
+             {labels: stats.get('connections_lost', 0)}),
+        ]
+    return results
+
+
+def render():
+    """All the metrics of the process in the Prometheus text exposition format."""
+    lines = []
+    for metric in list(registry.values()):
+        lines.append(f'# HELP {metric.name} {metric.documentation}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        lines.extend(f'{name}{labels} {format_value(value)}' for name, labels, value in metric.samples())
+    for function in collectors:
+        for name, kind, documentation, values in function():
+            lines.append(f'# HELP {name} {documentation}')
+            lines.append(f'# TYPE {name} {kind}')
+            for labels, value in values.items():
+                if value is None:
+                    continue
+                labels = dict(labels)
+                lines.append(f'{name}{format_labels(labels.keys(), labels.values())} {format_value(value)}')
+    return '\n'.join(lines) + '\n'
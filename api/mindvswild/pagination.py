@@ -0,0 +1,21 @@
+"""
+Cursor pagination of the listing endpoints.
+
+DRF's ``CursorPagination`` keys the cursor on the first ordering field only:
+it holds the ``created_at`` of the last row of the page, plus an offset over
+the rows sharing that value. Pages are read with ``WHERE created_at < position
+ORDER BY created_at DESC, id DESC LIMIT offset + n`` on an index of the same
+order, so a page costs the same whatever the size of the table or the position
+of the page, unlike offset pagination (the offset only spans the ties, rows
+created in the same microsecond).
+"""
+from django.conf import settings
+from rest_framework.pagination import CursorPagination
+
+
+class CreatedAtCursorPagination(CursorPagination):
+    # id orders the ties the same way on every page, so the offset skips the same rows
+    ordering = ('-created_at', '-id')
+    page_size = settings.API_PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = settings.API_MAX_PAGE_SIZE
@@ -0,0 +1,22 @@
+from django.conf import settings
+import redis
+import redis.asyncio as aioredis
+
+_async_client = None
+_client = None
+
+
+def get_async_redis():
+    """Return the process-wide asyncio Redis client (lazily created)."""
+    global _async_client
+    if _async_client is None:
+        _async_client = aioredis.from_url(settings.REDIS_URL, decode_responses=True)
+    return _async_client
+
+
+def get_redis():
+    """Return the process-wide blocking Redis client (lazily created), for sync views and signals."""
+    global _client
+    if _client is None:
+        _client = redis.from_url(settings.REDIS_URL, decode_responses=True)
+    return _client
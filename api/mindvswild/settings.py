@@ -1,6 +1,7 @@
 from pathlib import Path
 import environ 
 import os
+from mindvswild.db import check_connection
 env = environ.Env()
 
 environ.Env.read_env()
@@ -55,7 +56,7 @@ CSRF_TRUSTED_ORIGINS = env.list('CSRF_TRUSTED_ORIGINS')
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework.authentication.TokenAuthentication',
+        'authentication.authentication.CachedTokenAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
@@ -64,21 +65,140 @@ REST_FRAMEWORK = {
     
 }
 
+# Default and maximum number of rows of a listing page
+API_PAGE_SIZE = env.int('API_PAGE_SIZE', default=20)
+API_MAX_PAGE_SIZE = env.int('API_MAX_PAGE_SIZE', default=100)
+
 # Channels configuration
 ASGI_APPLICATION = 'mindvswild.asgi.application'
 
 WSGI_APPLICATION = 'mindvswild.wsgi.application'    
 
+REDIS_HOST = env('REDIS_HOST', default='redis')
+REDIS_PORT = env.int('REDIS_PORT', default=6379)
+REDIS_URL = env('REDIS_URL', default=f'redis://{REDIS_HOST}:{REDIS_PORT}/0')
+# Database flushed by the tests of the Redis backends, which are skipped when it can't be reached
+TEST_REDIS_URL = env('TEST_REDIS_URL', default=f'redis://{REDIS_HOST}:{REDIS_PORT}/15')
+
 # Configuration Redis pour les channels en production
-CHANNEL_LAYERS = {
-    "default": {
-        "BACKEND": "channels_redis.core.RedisChannelLayer",
-        "CONFIG": {
-            "hosts": [(env('REDIS_HOST', default='redis'), env.int('REDIS_PORT', default=6379))],
+# Redis URLs of the channel layer, channels are sharded over them by name
+CHANNEL_LAYER_HOSTS = env.list('CHANNEL_LAYER_HOSTS', default=[f'redis://{REDIS_HOST}:{REDIS_PORT}/0'])
+# "core": a Redis list per channel, with capacities and expiry. "pubsub": Redis pub/sub,
+# fewer round trips for fan-out heavy rooms but nothing is kept for a worker that is away
+CHANNEL_LAYER_MODE = env('CHANNEL_LAYER_MODE', default='core')
+# Messages waiting in a channel beyond its capacity are dropped by group_send:
+# the sockets of big rooms and the engine channels get more room than the default
+CHANNEL_LAYER_CAPACITY = env.int('CHANNEL_LAYER_CAPACITY', default=100)
+CHANNEL_LAYER_SOCKET_CAPACITY = env.int('CHANNEL_LAYER_SOCKET_CAPACITY', default=500)
+CHANNEL_LAYER_ENGINE_CAPACITY = env.int('CHANNEL_LAYER_ENGINE_CAPACITY', default=5000)
+# Seconds an undelivered message, and a group membership, are kept
+CHANNEL_LAYER_EXPIRY = env.int('CHANNEL_LAYER_EXPIRY', default=60)
+CHANNEL_LAYER_GROUP_EXPIRY = env.int('CHANNEL_LAYER_GROUP_EXPIRY', default=86400)
+# Messages are encrypted with the first key (and decrypted with any) when keys are set
+CHANNEL_LAYER_ENCRYPTION_KEYS = env.list('CHANNEL_LAYER_ENCRYPTION_KEYS', default=[])
+
+if CHANNEL_LAYER_MODE == 'pubsub':
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "channels_redis.pubsub.RedisPubSubChannelLayer",
+            "CONFIG": {
+                "hosts": CHANNEL_LAYER_HOSTS,
+            },
+        },
+    }
+else:
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "channels_redis.core.RedisChannelLayer",
+            "CONFIG": {
+                "hosts": CHANNEL_LAYER_HOSTS,
+                "capacity": CHANNEL_LAYER_CAPACITY,
+                "channel_capacity": {
+                    # Consumers' channels, then the engines' (see quiz.engine.get_engine_channel)
+                    "specific.*": CHANNEL_LAYER_SOCKET_CAPACITY,
+                    "quiz.engine*": CHANNEL_LAYER_ENGINE_CAPACITY,
+                },
+                "expiry": CHANNEL_LAYER_EXPIRY,
+                "group_expiry": CHANNEL_LAYER_GROUP_EXPIRY,
+            },
         },
+    }
+if CHANNEL_LAYER_ENCRYPTION_KEYS:
+    CHANNEL_LAYERS["default"]["CONFIG"]["symmetric_encryption_keys"] = CHANNEL_LAYER_ENCRYPTION_KEYS
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": env('CACHE_URL', default=f'redis://{REDIS_HOST}:{REDIS_PORT}/1'),
     },
 }
 
+# Seconds a resolved authentication token stays cached
+AUTH_TOKEN_CACHE_TTL = env.int('AUTH_TOKEN_CACHE_TTL', default=60)
+
+# Seconds the participants and creator of a room stay cached
+ROOM_MEMBERSHIP_CACHE_TTL = env.int('ROOM_MEMBERSHIP_CACHE_TTL', default=300)
+
+# Live index of the joinable rooms ("redis" or "memory" for tests)
+ROOM_LOBBY_BACKEND = env('ROOM_LOBBY_BACKEND', default='redis')
+
+# Global and group leaderboards ("redis" or "memory" for tests)
+LEADERBOARD_BACKEND = env('LEADERBOARD_BACKEND', default='redis')
+# Weekly leaderboards are dropped this many seconds after their last game
+LEADERBOARD_WEEK_TTL = env.int('LEADERBOARD_WEEK_TTL', default=15 * 24 * 3600)
+
+# Live game state shared by every Daphne worker ("redis" or "memory" for tests)
+QUIZ_GAME_STORE = env('QUIZ_GAME_STORE', default='redis')
+# Running games are dropped from Redis after this many seconds without activity
+QUIZ_GAME_TTL = env.int('QUIZ_GAME_TTL', default=6 * 3600)
+# Lease (in seconds) of the worker running a room's game loop, renewed while it runs
+QUIZ_ENGINE_LEASE_TTL = env.int('QUIZ_ENGINE_LEASE_TTL', default=10)
+# Seconds between two sweeps for the running games whose leader died, resumed by the sweeping worker
+QUIZ_ENGINE_SWEEP_INTERVAL = env.float('QUIZ_ENGINE_SWEEP_INTERVAL', default=10)
+# Scoreboard updates requested within this window (seconds) are sent as one broadcast
+QUIZ_SCORE_BROADCAST_WINDOW = env.float('QUIZ_SCORE_BROADCAST_WINDOW', default=0.15)
+# Number of delta broadcasts between two full scoreboard snapshots
+QUIZ_SCORE_SNAPSHOT_EVERY = env.int('QUIZ_SCORE_SNAPSHOT_EVERY', default=10)
+# Room events kept for the clients reconnecting
+QUIZ_EVENT_BUFFER_SIZE = env.int('QUIZ_EVENT_BUFFER_SIZE', default=256)
+# Seconds a player whose socket closed stays in the room, waiting for a reconnection
+QUIZ_RECONNECT_GRACE = env.float('QUIZ_RECONNECT_GRACE', default=5)
+# Room affinity: each room runs on the worker its id hashes to, which relays the frames
+# once per worker instead of once per socket (see quiz.sharding)
+QUIZ_ROOM_AFFINITY = env.bool('QUIZ_ROOM_AFFINITY', default=False)
+# Seconds between the heartbeats of a worker in the routing table
+QUIZ_WORKER_HEARTBEAT = env.float('QUIZ_WORKER_HEARTBEAT', default=5)
+# Events reaching a socket within this many seconds are sent as one frame (0 disables batching)
+QUIZ_BATCH_WINDOW = env.float('QUIZ_BATCH_WINDOW', default=0.01)
+# Frames of at least this many bytes are compressed for the clients accepting it
+QUIZ_COMPRESS_MIN_SIZE = env.int('QUIZ_COMPRESS_MIN_SIZE', default=1024)
+QUIZ_COMPRESS_LEVEL = env.int('QUIZ_COMPRESS_LEVEL', default=6)
+# Messages a socket may send per second, and at once, before the next ones are dropped
+QUIZ_WS_RATE = env.float('QUIZ_WS_RATE', default=5)
+QUIZ_WS_RATE_BURST = env.int('QUIZ_WS_RATE_BURST', default=10)
+# Larger messages from the clients are dropped without being decoded
+QUIZ_WS_MAX_MESSAGE_SIZE = env.int('QUIZ_WS_MAX_MESSAGE_SIZE', default=4096)
+
+# Upstream quiz API, only used to fill the local question bank
+QUIZ_API_URL = env('QUIZ_API_URL', default='https://quizzapi.jomoreschi.fr/api/v1/quiz')
+# A category is refilled in the background when it holds fewer questions than this
+QUIZ_BANK_MIN_SIZE = env.int('QUIZ_BANK_MIN_SIZE', default=100)
+# Number of questions asked to the upstream API per refill
+QUIZ_BANK_REFILL_SIZE = env.int('QUIZ_BANK_REFILL_SIZE', default=50)
+# Upstream HTTP client: pool size, timeout (seconds), retries with backoff (seconds)
+QUIZ_API_POOL_SIZE = env.int('QUIZ_API_POOL_SIZE', default=10)
+QUIZ_API_TIMEOUT = env.float('QUIZ_API_TIMEOUT', default=5)
+QUIZ_API_RETRIES = env.int('QUIZ_API_RETRIES', default=2)
+QUIZ_API_BACKOFF = env.float('QUIZ_API_BACKOFF', default=0.2)
+# The circuit opens after this many consecutive failures and is retried after the reset delay (seconds)
+QUIZ_API_BREAKER_THRESHOLD = env.int('QUIZ_API_BREAKER_THRESHOLD', default=5)
+QUIZ_API_BREAKER_RESET = env.float('QUIZ_API_BREAKER_RESET', default=30)
+
+# /metrics requires "Authorization: Bearer <token>", it is disabled (404) while no token is set
+METRICS_TOKEN = env('METRICS_TOKEN', default='')
+# Serve /metrics without a token: only where the endpoint can't be reached from outside
+METRICS_PUBLIC = env.bool('METRICS_PUBLIC', default=False)
+
 CORS_ALLOW_HEADERS = [
     'authorization',
     'content-type',
@@ -115,6 +235,39 @@ DATABASES = {
     }
 }
 
+# Threads running the database code of the consumers and engines (see mindvswild.executor)
+DB_EXECUTOR_THREADS = env.int('DB_EXECUTOR_THREADS', default=4)
+
+# Pooled connections (psycopg 3): the threads running sync code borrow a connection
+# per run_sync or database_sync_to_async call, or per request, instead of opening their own
+DB_POOL = env.bool('DB_POOL', default=True)
+# At least the threads running queries at once: the database executor threads, plus the
+# sync_to_async thread shared by the sync views and the token lookups, plus one spare
+DB_POOL_MIN_SIZE = env.int('DB_POOL_MIN_SIZE', default=2)
+DB_POOL_MAX_SIZE = env.int('DB_POOL_MAX_SIZE', default=DB_EXECUTOR_THREADS + 2)
+# Seconds a thread waits for a connection before the query fails
+DB_POOL_TIMEOUT = env.float('DB_POOL_TIMEOUT', default=10)
+# Idle connections beyond the minimum are closed after this many seconds, all are renewed after the lifetime
+DB_POOL_MAX_IDLE = env.float('DB_POOL_MAX_IDLE', default=300)
+DB_POOL_MAX_LIFETIME = env.float('DB_POOL_MAX_LIFETIME', default=1800)
+# Seconds a connection is kept between requests without a pool
+DB_CONN_MAX_AGE = env.int('DB_CONN_MAX_AGE', default=60)
+
+if DB_POOL:
+    DATABASES['default']['OPTIONS'] = {
+        'pool': {
+            'min_size': DB_POOL_MIN_SIZE,
+            'max_size': DB_POOL_MAX_SIZE,
+            'timeout': DB_POOL_TIMEOUT,
+            'max_idle': DB_POOL_MAX_IDLE,
+            'max_lifetime': DB_POOL_MAX_LIFETIME,
+            'check': check_connection,
+        },
+    }
+else:
+    DATABASES['default']['CONN_MAX_AGE'] = DB_CONN_MAX_AGE
+    DATABASES['default']['CONN_HEALTH_CHECKS'] = True
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {
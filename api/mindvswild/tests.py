@@ -0,0 +1,34 @@
+import threading
+from unittest import mock
+
+from django.test import SimpleTestCase, override_settings
+
+from .executor import run_sync
+
+
+class MetricsEndpointTests(SimpleTestCase):
+    @override_settings(METRICS_TOKEN='', METRICS_PUBLIC=False)
+    def test_disabled_without_token(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 404)
+
+    @override_settings(METRICS_TOKEN='secret', METRICS_PUBLIC=False)
+    def test_token_required(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 401)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer wrong').status_code, 401)
+        response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'# TYPE quiz_ws_connections_total counter', response.content)
+
+    @override_settings(METRICS_TOKEN='', METRICS_PUBLIC=True)
+    def test_public(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 200)
+
+
+class ExecutorTests(SimpleTestCase):
+    async def test_connections_closed_around_calls(self):
+        calls = []
+        with mock.patch('mindvswild.executor.close_old_connections', side_effect=lambda: calls.append('close')):
+            thread = await run_sync(lambda: calls.append('call') or threading.current_thread().name)
+        # Like database_sync_to_async: a broken or old connection is given back to the pool
+        self.assertEqual(calls, ['close', 'call', 'close'])
+        self.assertTrue(thread.startswith('db-executor'))
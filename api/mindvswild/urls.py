@@ -21,15 +21,19 @@ from groups.views import GroupViewSet
 from invite.views import InviteViewSet
 from rooms.views import RoomViewSet
 from authentication.views import AuthenticationViewSet
+from quiz.views import LeaderboardViewSet
+from mindvswild.views import metrics
 
 router = DefaultRouter()
 router.register(r'groups', GroupViewSet, basename='group')
 router.register(r'groups/accept-invite', InviteViewSet, basename='group-invite')
 router.register(r'rooms', RoomViewSet, basename='room')
 router.register(r'auth', AuthenticationViewSet, basename='auth')
+router.register(r'leaderboards', LeaderboardViewSet, basename='leaderboard')
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('metrics', metrics),
     path('api/', include(router.urls)),
     path('api/', include("quiz.urls")),
 ]
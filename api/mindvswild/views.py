@@ -0,0 +1,17 @@
+import hmac
+
+from django.conf import settings
+from django.http import Http404, HttpResponse
+
+from .metrics import render
+
+
+def metrics(request):
+    """Metrics of this worker process for Prometheus, behind the METRICS_TOKEN bearer token"""
+    if not settings.METRICS_PUBLIC:
+        if not settings.METRICS_TOKEN:
+            raise Http404
+        expected = f'Bearer {settings.METRICS_TOKEN}'.encode()
+        if not hmac.compare_digest(request.headers.get('Authorization', '').encode(), expected):
+            return HttpResponse(status=401)
+    return HttpResponse(render(), content_type='text/plain; version=0.0.4; charset=utf-8')
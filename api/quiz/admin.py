@@ -1,3 +1,7 @@
 from django.contrib import admin
-
+from .models import AnswerRecord, GamePlayer, GameSession, QuizQuestion
 # Register your models here.
+admin.site.register(QuizQuestion)
+admin.site.register(GameSession)
+admin.site.register(GamePlayer)
+admin.site.register(AnswerRecord)
@@ -1,300 +1,269 @@
-import json
-import random
 import asyncio
-import aiohttp
-from channels.generic.websocket import AsyncWebsocketConsumer
-from channels.db import database_sync_to_async
+import math
 from urllib.parse import parse_qs
-from rest_framework.authtoken.models import Token
-from django.contrib.auth.models import User
-from rooms.models import Room, RoomUser
+import msgpack
+from channels.generic.websocket import AsyncWebsocketConsumer
+from django.conf import settings
+from mindvswild.metrics import track
+from rooms.cache import aget_membership
+from .engine import dispatch, format_question, get_engine_channel, scoreboard_rows
+from .events import get_room_events, room_event
+from .metrics import close_socket, connections, handler_seconds, rejected_messages, sockets
+from .players import directory, players_table
+from .protocol import (
+    COMPACT_SUBPROTOCOL, DEFLATE_SUBPROTOCOL, batch_binary, batch_text, deflate, dumps, loads, server_time, stats,
+    transcode,
+)
+from .ratelimit import TokenBucket
+from .scoreboard import ranked
+from .sharding import attach, detach, room_group_send
+from .state import get_game_store
+
+# Delayed leaves of the players whose socket closed
+_pending_leaves = set()
+
+# Actions of the clients, timed under their name
+ACTIONS = ('start_game', 'submit_answer', 'clock_sync')
+
+
+async def username(user_id):
+    # The user of the scope only has its id loaded, see authentication.cache
+    return (await directory.resolve([user_id]))[user_id]['username']
+
+
+async def leave_after_grace(room_id, user):
+    """Remove the player from the room unless they reconnected in the meantime."""
+    await asyncio.sleep(settings.QUIZ_RECONNECT_GRACE)
+    if await get_room_events().leave_if_gone(room_id, user.id):
+        await room_group_send(room_id, await room_event(room_id, {
+            "action": "participant_left",
+            "user_id": user.id,
+            "username": await username(user.id)
+        }))
+        await dispatch(room_id, {'type': 'leave', 'user_id': user.id})
 
-GAME_STATE = {}
 
 class RoomQuizConsumer(AsyncWebsocketConsumer):
     async def connect(self):
-        query_params = parse_qs(self.scope["query_string"].decode())
-        token = query_params.get('token', [None])[0]
-
-        if not token:
-            await self.close()
-            return
+        with track(handler_seconds, 'connect'):
+            await self.join_room()
 
-        try:
-            self.user = await self.get_user_from_token(token)
-        except Token.DoesNotExist:
+    async def join_room(self):
+        # Resolved from the token of the query string by TokenAuthMiddleware
+        if not self.scope['user'].is_authenticated:
             await self.close()
             return
+        self.user = self.scope['user']
 
         self.room_id = self.scope['url_route']['kwargs']['room_id']
+        self.store = get_game_store()
         self.room_group_name = f'room_{self.room_id}'
 
-        if not await self.user_in_room(self.room_id, self.user.id):
+        # Participants and creator of the room, cached between connections
+        membership = await aget_membership(self.room_id)
+        if membership is None or self.user.id not in membership['participants']:
             await self.close()
             return
 
-        self.is_admin = await self.is_room_admin(self.room_id, self.user.id)
-
-        await self.channel_layer.group_add(self.room_group_name, self.channel_name)
-        await self.accept()
-
-        await self.channel_layer.group_send(self.room_group_name, {
-            "type": "user_joined",
-            "user_id": self.user.id,
-            "username": self.user.username
-        })
-
-        state = GAME_STATE.get(self.room_id)
-        if state and state.get('game_started'):
+        self.is_admin = membership['creator_id'] == self.user.id
+        self.events = get_room_events()
+
+        # JSON unless the client asked for the compact protocol or for compression
+        subprotocols = self.scope.get('subprotocols', [])
+        self.compact = COMPACT_SUBPROTOCOL in subprotocols
+        self.deflate = not self.compact and DEFLATE_SUBPROTOCOL in subprotocols
+        # Encoded frames waiting for the end of the batching window
+        self.outbox = []
+        self.flush_handle = None
+        self.rate_limit = TokenBucket()
+        # Idempotency key of the last answer sent to the engine
+        self.answered_question = None
+
+        if settings.QUIZ_ROOM_AFFINITY:
+            # Frames are relayed by the worker, see quiz.sharding
+            self.worker_channel = await get_engine_channel()
+            await attach(self.room_id, self, self.worker_channel)
+        else:
+            await self.channel_layer.group_add(self.room_group_name, self.channel_name)
+        if self.compact:
+            await self.accept(subprotocol=COMPACT_SUBPROTOCOL)
+        elif self.deflate:
+            await self.accept(subprotocol=DEFLATE_SUBPROTOCOL)
+        else:
+            await self.accept()
+        connections.inc()
+
+        # A player reconnecting within the grace period is still in the room
+        joined = await self.events.connect(self.room_id, self.user.id)
+        self.present = True
+        sockets.inc(self.room_id)
+        if joined:
+            await room_group_send(self.room_id, await room_event(self.room_id, {
+                "action": "participant_joined",
+                "user_id": self.user.id,
+                "username": await username(self.user.id)
+            }))
+            await dispatch(self.room_id, {'type': 'join', 'user_id': self.user.id})
+
+        # Events broadcast from now on reach this socket through the group, the
+        # client ignores the ones it already got from the replay or the snapshot
+        last_seq = self.get_last_seq()
+        if last_seq is not None:
+            _, missed = await self.events.since(self.room_id, last_seq)
+            if missed is not None:
+                for text in missed:
+                    await self.send_encoded(text)
+                return
+        await self.send_game_state()
+
+    def get_last_seq(self):
+        """Sequence number of the last event received by a reconnecting client (?last_seq=)."""
+        values = parse_qs(self.scope.get('query_string', b'').decode()).get('last_seq')
+        if values and values[0].isdigit():
+            return int(values[0])
+        return None
+
+    async def send_game_state(self):
+        seq = await self.events.last_seq(self.room_id)
+        state = await self.store.get_game(self.room_id)
+        if state:
             current_q = None
+            now = server_time()
             if state['current_index'] >= 0:
-                current_q = self.format_question(state['questions'][state['current_index']])
-            await self.send(json.dumps({
+                current_q = format_question(state['questions'][state['current_index']])
+            await self.send_payload({
                 "action": "game_state",
+                "seq": seq,
+                "players": players_table(state['players']),
                 "state": {
                     "is_started": True,
                     "current_question": current_q,
-                    "time_remaining": state.get('time_remaining'),
-                    "scores": state.get('scores', {})
+                    "time_remaining": max(0, math.ceil((state['deadline'] - now) / 1000)),
+                    "deadline": state['deadline'],
+                    "server_time": now,
+                    # Ranked like the scoreboard broadcasts, which update these rows
+                    "scores": ranked(scoreboard_rows(state, state['players']))
                 }
-            }))
+            })
 
     async def disconnect(self, close_code):
+        if getattr(self, 'flush_handle', None):
+            self.flush_handle.cancel()
         if hasattr(self, 'room_group_name'):
-            if hasattr(self, 'user'):
-                await self.channel_layer.group_send(self.room_group_name, {
-                    "type": "user_left",
-                    "user_id": self.user.id,
-                    "username": self.user.username
-                })
-            await self.channel_layer.group_discard(self.room_group_name, self.channel_name)
-
-    async def receive(self, text_data):
+            if hasattr(self, 'worker_channel'):
+                await detach(self.room_id, self, self.worker_channel)
+            else:
+                await self.channel_layer.group_discard(self.room_group_name, self.channel_name)
+            if getattr(self, 'present', False):
+                close_socket(self.room_id)
+                await self.events.disconnect(self.room_id, self.user.id)
+                # Outlives the consumer
+                task = asyncio.create_task(leave_after_grace(self.room_id, self.user))
+                _pending_leaves.add(task)
+                task.add_done_callback(_pending_leaves.discard)
+
+    async def receive(self, text_data=None, bytes_data=None):
+        # Dropped before being decoded, abusive clients never reach the game logic
+        # In bytes, like the frames: a text frame has fewer characters when it isn't ASCII
+        size = len(bytes_data) if bytes_data is not None else len(text_data.encode())
+        if size > settings.QUIZ_WS_MAX_MESSAGE_SIZE:
+            return rejected_messages.inc('too_large')
+        if not self.rate_limit.allow():
+            return rejected_messages.inc('rate_limited')
         try:
-            data = json.loads(text_data)
-            action = data.get('action')
-            if action == 'start_game':
-                await self.handle_start_game(data)
-            elif action == 'submit_answer':
-                await self.handle_submit_answer(data)
+            data = msgpack.unpackb(bytes_data) if bytes_data is not None else loads(text_data)
+            action = data.get('action') if isinstance(data, dict) else None
+            if action not in ACTIONS:
+                return rejected_messages.inc('invalid')
+            with track(handler_seconds, action):
+                if action == 'start_game':
+                    await self.handle_start_game(data)
+                elif action == 'submit_answer':
+                    await self.handle_submit_answer(data)
+                elif action == 'clock_sync':
+                    await self.handle_clock_sync(data)
         except Exception as e:
-            await self.send(json.dumps({'error': str(e)}))
+            await self.send_payload({'error': str(e)})
 
     async def handle_start_game(self, data):
         if not self.is_admin:
-            return await self.send(json.dumps({'error': "Seul l'admin peut démarrer le jeu"}))
-
-        if self.room_id in GAME_STATE and GAME_STATE[self.room_id].get('game_started'):
-            return await self.send(json.dumps({'error': "Partie déjà en cours"}))
-
-        options = data.get('options', {})
-        qcount = max(1, min(30, int(options.get('questionCount', 5))))
-        qtime = max(10, min(60, int(options.get('questionTime', 30))))
-        elimination = bool(options.get('eliminationMode', False))
-        category = options.get("category")
-
-        users = await self.get_room_participants(self.room_id)
-        if elimination and len(users) < 2:
-            return await self.send(json.dumps({'error': "Le mode élimination nécessite au moins deux participants"}))
-
-        if not await self.load_questions(qcount, category):
-            return await self.send(json.dumps({'error': "Chargement des questions échoué"}))
-
-        users = await self.get_room_participants(self.room_id)
-        GAME_STATE[self.room_id] = {
-            'questions': self.questions,
-            'current_index': -1,
-            'scores': {uid: 0 for uid in users},
-            'answered': set(),
-            'timer_duration': qtime,
-            'time_remaining': qtime,
-            'elimination_mode': elimination,
-            'active_players': set(users),
-            'game_started': True,
-            'lock': asyncio.Lock()
-        }
-
-        await self.channel_layer.group_send(self.room_group_name, {
-            "type": "game_starting",
-            "options": {
-                "question_count": qcount,
-                "timer_duration": qtime,
-                "elimination_mode": elimination
-            }
-        })        
-        await self.broadcast_scores()
-        await self.send_next_question()
-
-    async def handle_submit_answer(self, data):
-        state = GAME_STATE.get(self.room_id)
-        if not state or self.user.id in state['answered']:
-            return
-
-        q = state['questions'][state['current_index']]
-        ans = data.get('answer')
-        correct = ans and ans.lower() == q['answer'].lower()
-
-        if correct:
-            state['scores'][self.user.id] += 10
-        elif state['elimination_mode']:
-            state['active_players'].discard(self.user.id)
-
-        state['answered'].add(self.user.id)
-
-        await self.send(json.dumps({
-            'action': 'answer_result',
-            'correct': correct,
-            'selected_option': ans,
-            'correct_option': q['answer'],
-            'points': state['scores'][self.user.id]
-        }))
-        await self.broadcast_scores()
-
-        if state['answered'].issuperset(state['active_players']):
-            await asyncio.sleep(2)
-            await self.send_next_question()
+            return await self.send_payload({'error': "Seul l'admin peut démarrer le jeu"})
 
-    async def send_next_question(self):
-        state = GAME_STATE.get(self.room_id)
-        if not state:
-            return
-
-        async with state['lock']:
-            state['current_index'] += 1
-            if (state['elimination_mode'] and len(state['active_players']) == 1 
-                or state['current_index'] >= len(state['questions'])):
-                return await self.end_game()
-
-            q = state['questions'][state['current_index']]
-            state['answered'] = set()
-            state['time_remaining'] = state['timer_duration']
-
-            await self.channel_layer.group_send(self.room_group_name, {
-                'type': 'broadcast_question',
-                'question': self.format_question(q),
-                'time_remaining': state['timer_duration']
-            })
-
-            asyncio.create_task(self.run_timer(state['current_index']))
-
-    async def run_timer(self, q_index):
-        state = GAME_STATE.get(self.room_id)
-        while state['time_remaining'] > 0:
-            await asyncio.sleep(1)
-            if state['current_index'] != q_index:
-                return
-            state['time_remaining'] -= 1
-            if state['time_remaining'] % 3 == 0:
-                await self.channel_layer.group_send(self.room_group_name, {
-                    'type': 'broadcast_timer',
-                    'time_remaining': state['time_remaining']
-                })
-
-        if state['current_index'] == q_index:
-            await asyncio.sleep(2)
-            if state['elimination_mode']:
-                unanswered_players = state['active_players'] - state['answered']
-                state['active_players'].difference_update(unanswered_players)
-                await self.broadcast_scores()
-                
-                if len(state['active_players']) <= 1:
-                     return await self.end_game()
-                 
-            await self.send_next_question()
-
-    async def broadcast_scores(self):
-        state = GAME_STATE.get(self.room_id)
-        scores = []
-        for uid in state['scores']:
-            username = await self.get_username(uid)
-            scores.append({
-                'user_id': uid,
-                'username': username,
-                'score': state['scores'][uid],
-                'is_active': uid in state['active_players']
-            })
-        await self.channel_layer.group_send(self.room_group_name, {
-            'type': 'broadcast_scores_update', 'scores': sorted(scores, key=lambda x: x['score'], reverse=True)
+        # The room's engine validates the options and runs the game
+        await dispatch(self.room_id, {
+            'type': 'start',
+            'options': data.get('options', {}),
+            'reply_channel': self.channel_name
         })
 
-    async def end_game(self):
-        state = GAME_STATE.get(self.room_id)
-        final = []
-        for uid in state['scores']:
-            username = await self.get_username(uid)
-            final.append({
-                'user_id': uid,
-                'username': username,
-                'score': state['scores'][uid],
-                'is_active': uid in state['active_players']
-            })
-        await self.channel_layer.group_send(self.room_group_name, {
-            'type': 'broadcast_game_over',
-            'scores': sorted(final, key=lambda x: x['score'], reverse=True)
+    async def handle_submit_answer(self, data):
+        # Index of the chosen option; older clients send its text under 'answer'
+        option = data.get('option')
+        if option is not None and (type(option) is not int or option < 0):
+            return rejected_messages.inc('invalid')
+        if option is None and not isinstance(data.get('answer'), str):
+            return rejected_messages.inc('invalid')
+        question_id = data.get('question_id')
+        if question_id is not None and question_id == self.answered_question:
+            return rejected_messages.inc('duplicate')
+        self.answered_question = question_id
+
+        await dispatch(self.room_id, {
+            'type': 'answer',
+            'user_id': self.user.id,
+            'question_id': question_id,
+            'option': option,
+            'answer': data.get('answer'),
+            'reply_channel': self.channel_name
         })
-        del GAME_STATE[self.room_id]
-
-    def format_question(self, question):
-        options = [question['answer']] + question['badAnswers']
-        random.shuffle(options)
-        return {'id': question['_id'], 'text': question['question'], 'options': options}
-
-    async def broadcast_question(self, event):
-        await self.send(json.dumps({'action': 'new_question', 'question': event['question'], 'time_remaining': event['time_remaining']}))
-
-    async def broadcast_timer(self, event):
-        await self.send(json.dumps({'action': 'timer_update', 'time_remaining': event['time_remaining']}))
 
-    async def broadcast_scores_update(self, event):
-        await self.send(json.dumps({'action': 'scores_update', 'scores': event['scores']}))
-
-    async def broadcast_game_over(self, event):
-        await self.send(json.dumps({'action': 'game_over', 'final_scores': event['scores']}))
-
-    async def game_starting(self, event):
-        await self.send(json.dumps({'action': 'game_starting', 'settings': event['options']}))
-
-    async def user_joined(self, event):
-        await self.send(json.dumps({'action': 'participant_joined', 'user_id': event['user_id'], 'username': event['username']}))
-
-    async def user_left(self, event):
-        await self.send(json.dumps({'action': 'participant_left', 'user_id': event['user_id'], 'username': event['username']}))
-
-    async def load_questions(self, limit, category):
-        url = f'https://quizzapi.jomoreschi.fr/api/v1/quiz?limit={limit}' + (f"&category={category}" if category else '')
-        try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url) as resp:
-                    if resp.status == 200:
-                        data = await resp.json()
-                        self.questions = data.get('quizzes', [])[:limit]
-                        return bool(self.questions)
-        except:
-            return False
-        return False
-
-    @database_sync_to_async
-    def get_user_from_token(self, token):
-        return Token.objects.get(key=token).user
-
-    @database_sync_to_async
-    def user_in_room(self, room_id, user_id):
-        return RoomUser.objects.filter(room_id=room_id, user_id=user_id).exists()
-
-    @database_sync_to_async
-    def is_room_admin(self, room_id, user_id):
-        try:
-            return Room.objects.get(id=room_id).created_by_id == user_id
-        except Room.DoesNotExist:
-            return False
-
-    @database_sync_to_async
-    def get_room_participants(self, room_id):
-        return list(RoomUser.objects.filter(room_id=room_id).values_list('user_id', flat=True))
-
-    @database_sync_to_async
-    def get_username(self, user_id):
-        try:
-            return User.objects.get(id=user_id).username
-        except User.DoesNotExist:
-            return "Utilisateur inconnu"
+    async def handle_clock_sync(self, data):
+        # The client estimates its offset to the server clock from the round trip,
+        # then counts down to the question deadlines by itself: not batched
+        await self.send_payload({
+            'action': 'clock_sync',
+            'client_time': data.get('client_time'),
+            'server_time': server_time()
+        }, immediate=True)
+
+    async def send_payload(self, payload, immediate=False):
+        await self.send_encoded(dumps(payload), immediate)
+
+    async def send_encoded(self, text, immediate=False):
+        """Send a payload encoded as JSON, in the next batch unless ``immediate``."""
+        window = settings.QUIZ_BATCH_WINDOW
+        self.outbox.append(text)
+        if immediate or not window:
+            return await self.flush()
+        if self.flush_handle is None:
+            self.flush_handle = asyncio.get_running_loop().call_later(window, self.schedule_flush)
+
+    def schedule_flush(self):
+        self.flush_handle = None
+        self.flush_task = asyncio.create_task(self.flush())
+
+    async def flush(self):
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        texts, self.outbox = self.outbox, []
+        if not texts:
+            return
+        stats['frames'] += 1
+        if len(texts) > 1:
+            stats['batches'] += 1
+            stats['batched_events'] += len(texts)
+
+        if self.compact:
+            frames = [transcode(text) for text in texts]
+            await self.send(bytes_data=frames[0] if len(frames) == 1 else batch_binary(frames))
+            return
+        text = texts[0] if len(texts) == 1 else batch_text(texts)
+        if self.deflate and len(text) >= settings.QUIZ_COMPRESS_MIN_SIZE:
+            await self.send(bytes_data=deflate(text))
+        else:
+            await self.send(text_data=text)
+
+    async def send_frame(self, event):
+        # Already encoded by the sender, once for the whole group
+        await self.send_encoded(event['text'])
@@ -0,0 +1,516 @@
+"""
+Authoritative game loop of a room.
+
+Exactly one ``RoomEngine`` drives a room at any time: the one running on the
+worker holding the room's lease in the game store. Consumers never advance the
+game themselves, they ``dispatch`` commands (start, join, answer, leave) which
+the engine executes one after the other together with its own timer commands
+(advance, expire), so no two sockets can race to move to the next question.
+The lease is renewed by a task of its own, however long a command takes, and
+the engine stops as soon as it can't renew it. Every worker sweeps the rooms
+whose game outlived its leader, so their game goes on without waiting for a
+player to act.
+
+Questions carry an absolute deadline and clients run the countdown themselves:
+the only timer of a question is the one firing when it ends, kept in the event
+loop's timer heap.
+"""
+import asyncio
+import logging
+import random
+import time
+
+from channels.layers import get_channel_layer
+from django.conf import settings
+
+from mindvswild.executor import run_sync
+from mindvswild.metrics import track
+from rooms.cache import aget_membership
+from rooms.lobby import set_room_in_game
+from .events import room_event
+from .history import save_game
+from .leaderboards import record_game
+from .metrics import engine_command_seconds, rejected_messages, running_games
+from .players import PLAYERS_GROUP, UNKNOWN_PLAYER, directory, players_table
+from .protocol import frame, server_time
+from .questions import question_bank
+from .scoreboard import Scoreboard
+from .sharding import deliver, get_router, room_group_send
+from .state import get_game_store
+
+logger = logging.getLogger(__name__)
+
+# Delay (ms) between the end of a question and the next one
+ANSWER_DISPLAY_TIME = 2000
+# Delay (seconds) before the next question once every active player answered
+ALL_ANSWERED_DELAY = 2
+
+# Commands the engine queues for itself, recreated by ``resume``
+TIMER_COMMANDS = ('idle', 'resume', 'advance', 'expire', 'flush_scores')
+
+# Engines running in this process, by room id
+_engines = {}
+# Channel receiving the commands other workers send to our engines, the task reading it
+# and the one resuming the games of dead leaders
+_engine_channel = None
+_relay_task = None
+_sweeper_task = None
+
+
+def prepare_question(question):
+    """Shuffle the options of a question once for the whole game, noting where the answer went."""
+    options = [question['answer']] + question['badAnswers']
+    random.shuffle(options)
+    return {**question, 'options': options, 'correct_index': options.index(question['answer'])}
+
+
+def format_question(question):
+    if 'options' not in question:
+        # Game started before the options were shuffled once for all
+        question = prepare_question(question)
+    return {'id': question['_id'], 'text': question['question'], 'options': question['options']}
+
+
+def scoreboard_rows(state, players):
+    """Score rows of the game, best score first."""
+    rows = [{
+        'user_id': uid,
+        'username': players.get(uid, UNKNOWN_PLAYER)['username'],
+        'score': score,
+        'is_active': uid in state['active_players']
+    } for uid, score in state['scores'].items()]
+    return sorted(rows, key=lambda x: x['score'], reverse=True)
+
+
+async def get_engine_channel():
+    """Return this worker's command channel, starting its relay task on first use."""
+    global _engine_channel, _relay_task, _sweeper_task
+    if _engine_channel is None:
+        layer = get_channel_layer()
+        _engine_channel = await layer.new_channel('quiz.engine')
+        # Referenced: the event loop only keeps weak references to its tasks
+        _relay_task = asyncio.create_task(_relay_commands(layer, _engine_channel))
+        _sweeper_task = asyncio.create_task(_sweep_orphans())
+        if settings.QUIZ_ROOM_AFFINITY:
+            await get_router().start(_engine_channel)
+    return _engine_channel
+
+
+async def _relay_commands(layer, channel):
+    while True:
+        message = await layer.receive(channel)
+        # A failing message must not stop the relay of the whole worker
+        try:
+            if message['type'] == 'room.frame':
+                await deliver(message['room_id'], message['text'])
+            elif message['type'] == 'player.changed':
+                directory.invalidate(message['user_id'])
+                for engine in list(_engines.values()):
+                    engine.put({'type': 'player_changed', 'user_id': message['user_id']})
+            else:
+                await dispatch(message['room_id'], message['command'], routed=message.get('routed', False))
+        except Exception:
+            logger.exception("Could not relay a %s message to room %s", message.get('type'), message.get('room_id'))
+
+
+async def _sweep_orphans():
+    while True:
+        await asyncio.sleep(settings.QUIZ_ENGINE_SWEEP_INTERVAL)
+        try:
+            await sweep_orphans()
+        except Exception:
+            logger.exception("Could not sweep the games without a leader")
+
+
+async def sweep_orphans():
+    """Resume the running games whose lease expired: their leader died with their timers."""
+    store = get_game_store()
+    for room_id in await store.running_rooms():
+        if room_id in _engines or await store.get_leader(room_id):
+            continue
+        if not await store.get_game(room_id):
+            # Expired meanwhile, forget it
+            await store.pop_game(room_id)
+            continue
+        logger.info("Resuming the game of room %s, its leader went away", room_id)
+        await dispatch(room_id, {'type': 'resume'})
+
+
+async def dispatch(room_id, command, routed=False):
+    """Send a command to the engine of the room, wherever it runs.
+
+    When no worker holds the room's lease, this one takes it (only to start a
+    game or to resume one whose leader died). In affinity mode only the room's
+    owner takes it: the command is forwarded to it, once (``routed``).
+    """
+    room_id = str(room_id)
+    store = get_game_store()
+    channel = await get_engine_channel()
+    for _ in range(3):
+        engine = _engines.get(room_id)
+        if engine:
+            return engine.put(command)
+
+        leader = await store.get_leader(room_id)
+        if leader == channel:
+            # Stale lease of an engine that stopped in this process
+            await store.release_leader(room_id, channel)
+            leader = None
+        if leader:
+            return await get_channel_layer().send(leader, {
+                'type': 'engine.command', 'room_id': room_id, 'command': command
+            })
+
+        if command['type'] != 'start' and not await store.get_game(room_id):
+            return
+        if settings.QUIZ_ROOM_AFFINITY and not routed:
+            owner = get_router().owner(room_id)
+            if owner != channel:
+                return await get_channel_layer().send(owner, {
+                    'type': 'engine.command', 'room_id': room_id, 'command': command, 'routed': True
+                })
+        if await store.claim_leader(room_id, channel, settings.QUIZ_ENGINE_LEASE_TTL):
+            # (Re)join the group notified of player changes, memberships expire
+            await get_channel_layer().group_add(PLAYERS_GROUP, channel)
+            engine = RoomEngine(room_id, channel)
+            _engines[room_id] = engine
+            engine.start()
+    logger.warning("No engine could take the command %s of room %s", command['type'], room_id)
+
+
+class RoomEngine:
+    def __init__(self, room_id, owner):
+        self.room_id = room_id
+        self.owner = owner
+        self.room_group_name = f'room_{room_id}'
+        self.store = get_game_store()
+        self.channel_layer = get_channel_layer()
+        self.commands = asyncio.Queue()
+        self.timers = set()
+        self.scoreboard = Scoreboard()
+        self.running = True
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+
+    def put(self, command):
+        self.commands.put_nowait(command)
+
+    def call_later(self, delay, command):
+        """Queue ``command`` after ``delay`` seconds, as long as the engine runs."""
+        def fire():
+            self.timers.discard(handle)
+            self.put(command)
+        handle = asyncio.get_running_loop().call_later(delay, fire)
+        self.timers.add(handle)
+
+    def call_at(self, when, command):
+        """Queue ``command`` at ``when`` (epoch milliseconds)."""
+        self.call_later(max(0, when / 1000 - time.time()), command)
+
+    def stop(self):
+        self.running = False
+        # Commands dispatched from now on go to the next engine of the room
+        if _engines.get(self.room_id) is self:
+            del _engines[self.room_id]
+
+    async def run(self):
+        self.lease_task = asyncio.create_task(self.keep_lease())
+        self.call_later(settings.QUIZ_ENGINE_LEASE_TTL / 3, {'type': 'idle'})
+        running_games.inc()
+        try:
+            await self.resume()
+            while self.running:
+                command = await self.commands.get()
+                try:
+                    with track(engine_command_seconds, command['type']):
+                        await getattr(self, f"handle_{command['type']}")(command)
+                except Exception:
+                    logger.exception("Command %s failed in room %s", command['type'], self.room_id)
+        finally:
+            running_games.dec()
+            self.lease_task.cancel()
+            for handle in self.timers:
+                handle.cancel()
+            self.stop()
+            # Unless the next engine of the room already runs here, under the same owner
+            if self.room_id not in _engines:
+                await self.store.release_leader(self.room_id, self.owner)
+            await self.redispatch()
+
+    async def redispatch(self):
+        """Hand the commands that were queued while the engine stopped to the next one."""
+        while not self.commands.empty():
+            command = self.commands.get_nowait()
+            if command['type'] in TIMER_COMMANDS:
+                continue
+            try:
+                await dispatch(self.room_id, command)
+            except Exception:
+                logger.exception("Could not dispatch the command %s of room %s again", command['type'], self.room_id)
+
+    async def resume(self):
+        """Pick up the timer of a game whose previous leader went away."""
+        state = await self.store.get_game(self.room_id)
+        if not state:
+            return
+        if state['current_index'] < 0:
+            self.put({'type': 'advance', 'index': -1})
+        else:
+            self.call_at(state['deadline'] + ANSWER_DISPLAY_TIME, {'type': 'expire', 'index': state['current_index']})
+
+    async def broadcast(self, payload):
+        # Encoded once here, forwarded as is by every consumer of the room
+        await room_group_send(self.room_id, await room_event(self.room_id, payload))
+
+    async def reply(self, command, payload):
+        if command.get('reply_channel'):
+            await self.channel_layer.send(command['reply_channel'], frame(payload))
+
+    async def keep_lease(self):
+        """Renew the room's lease until the engine stops, stop it when the lease is lost.
+
+        Out of the command queue: a command waiting on the upstream API must not
+        let the lease expire and another worker start a second engine of the room.
+        """
+        ttl = settings.QUIZ_ENGINE_LEASE_TTL
+        renewed_at = time.monotonic()
+        while self.running:
+            await asyncio.sleep(ttl / 3)
+            try:
+                if await self.store.claim_leader(self.room_id, self.owner, ttl):
+                    renewed_at = time.monotonic()
+                    continue
+                logger.warning("Lost the lease of room %s to another worker", self.room_id)
+            except Exception:
+                # Retried until the lease would have expired
+                if time.monotonic() - renewed_at < ttl * 2 / 3:
+                    logger.exception("Could not renew the lease of room %s", self.room_id)
+                    continue
+                logger.exception("Could not renew the lease of room %s in time", self.room_id)
+            # Whatever command runs, it may now race with the next leader
+            self.stop()
+            self.task.cancel()
+            return
+
+    async def handle_idle(self, command):
+        if not await self.store.get_game(self.room_id) and self.commands.empty():
+            # Nothing left to drive
+            return self.stop()
+        self.call_later(settings.QUIZ_ENGINE_LEASE_TTL / 3, {'type': 'idle'})
+
+    async def handle_resume(self, command):
+        # Sent by the sweeper, the timers of the game were recreated when the engine started
+        pass
+
+    async def handle_start(self, command):
+        if await self.store.get_game(self.room_id):
+            return await self.reply(command, {'error': "Partie déjà en cours"})
+
+        options = command.get('options', {})
+        qcount = max(1, min(30, int(options.get('questionCount', 5))))
+        qtime = max(10, min(60, int(options.get('questionTime', 30))))
+        elimination = bool(options.get('eliminationMode', False))
+        category = options.get("category")
+
+        users = await self.get_room_participants()
+        if elimination and len(users) < 2:
+            return await self.reply(command, {'error': "Le mode élimination nécessite au moins deux participants"})
+
+        questions = await self.load_questions(qcount, category)
+        if not questions:
+            return await self.reply(command, {'error': "Chargement des questions échoué"})
+        # Answers are option indices, checked against the index of the right one
+        questions = [prepare_question(question) for question in questions]
+
+        if not await self.store.create_game(self.room_id, questions, users, qtime, elimination):
+            return await self.reply(command, {'error': "Partie déjà en cours"})
+        players = await directory.resolve(users)
+        await self.store.set_players(self.room_id, players)
+        await set_room_in_game(self.room_id, True)
+
+        await self.broadcast({
+            "action": "game_starting",
+            "settings": {
+                "question_count": qcount,
+                "timer_duration": qtime,
+                "elimination_mode": elimination
+            },
+            # Sent once, score rows of the compact protocol only carry user ids
+            "players": players_table(players)
+        })
+        await self.broadcast_scores()
+        await self.handle_advance({'index': -1})
+
+    async def handle_join(self, command):
+        state = await self.store.get_game(self.room_id)
+        if state and not state['elimination_mode']:
+            await self.store.set_player_active(self.room_id, command['user_id'], True)
+
+    async def handle_leave(self, command):
+        state = await self.store.get_game(self.room_id)
+        if not state or state['current_index'] < 0:
+            return
+        result = await self.store.set_player_active(self.room_id, command['user_id'], False)
+        if result is None:
+            return
+        if result['active_count'] == 0 or state['elimination_mode'] and result['active_count'] == 1:
+            return await self.end_game()
+        if result['all_answered']:
+            # The player who left was the last one we were waiting for
+            self.call_later(ALL_ANSWERED_DELAY, {'type': 'advance', 'index': state['current_index']})
+
+    async def handle_player_changed(self, command):
+        state = await self.store.get_game(self.room_id)
+        if state and command['user_id'] in state['scores']:
+            await self.store.set_players(self.room_id, await directory.resolve([command['user_id']]))
+
+    async def handle_answer(self, command):
+        state = await self.store.get_game(self.room_id)
+        user_id = command['user_id']
+        if not state or state['current_index'] < 0:
+            return
+        if user_id in state['answered']:
+            return rejected_messages.inc('duplicate')
+
+        q_index = state['current_index']
+        q = state['questions'][q_index]
+        question_id = command.get('question_id')
+        if question_id is not None and question_id != q.get('_id'):
+            # Late answer to a previous question
+            return rejected_messages.inc('stale')
+        option = command.get('option')
+        if option is not None:
+            if option >= len(q.get('options', ())):
+                return rejected_messages.inc('invalid')
+            ans = q['options'][option]
+            correct = option == q['correct_index']
+        else:
+            ans = command.get('answer')
+            correct = bool(ans) and ans.lower() == q['answer'].lower()
+
+        # Saved with the game once it ends
+        now = server_time()
+        record = {
+            'user_id': user_id,
+            'question_index': q_index,
+            'question_id': q.get('_id'),
+            'answer': ans,
+            'correct': correct,
+            'points': 10 if correct else 0,
+            'response_ms': now - (state['deadline'] - state['timer_duration'] * 1000),
+            'answered_at': now,
+        }
+        result = await self.store.submit_answer(self.room_id, user_id, q_index, correct, record=record)
+        if result is None:
+            return
+
+        await self.reply(command, {
+            'action': 'answer_result',
+            'correct': correct,
+            'selected_option': ans,
+            'correct_option': q['answer'],
+            'points': result['score']
+        })
+        await self.broadcast_scores()
+
+        if result['all_answered']:
+            self.call_later(ALL_ANSWERED_DELAY, {'type': 'advance', 'index': q_index})
+
+    async def handle_advance(self, command):
+        # Only the first advance away from a given index gets a result,
+        # the one of the timer and the one of the last answer can't both win.
+        now = server_time()
+        result = await self.store.advance_question(self.room_id, command['index'], now)
+        if result is None:
+            return
+
+        state = await self.store.get_game(self.room_id)
+        if not state:
+            return
+        if (state['elimination_mode'] and result['active_count'] == 1
+                or result['index'] >= len(state['questions'])):
+            return await self.end_game()
+
+        q = state['questions'][result['index']]
+        await self.broadcast({
+            'action': 'new_question',
+            'question': format_question(q),
+            'time_remaining': state['timer_duration'],
+            'deadline': result['deadline'],
+            'server_time': now
+        })
+        # The question is closed once players saw the end of the countdown for a moment
+        self.call_at(result['deadline'] + ANSWER_DISPLAY_TIME, {'type': 'expire', 'index': result['index']})
+
+    async def handle_expire(self, command):
+        state = await self.store.get_game(self.room_id)
+        if not state or state['current_index'] != command['index']:
+            return
+        if state['elimination_mode']:
+            active_count = await self.store.eliminate_unanswered(self.room_id, command['index'])
+            if active_count is None:
+                return
+            await self.broadcast_scores()
+
+            if active_count <= 1:
+                return await self.end_game()
+
+        await self.handle_advance(command)
+
+    async def get_players(self, state):
+        """Display data of every player of the game, without touching the database
+        unless some ids are missing from the game state (then in one query)."""
+        players = state['players']
+        missing = [uid for uid in state['scores'] if uid not in players]
+        if missing:
+            resolved = await directory.resolve(missing)
+            await self.store.set_players(self.room_id, resolved)
+            players = {**players, **resolved}
+        return players
+
+    async def score_rows(self, state):
+        return scoreboard_rows(state, await self.get_players(state))
+
+    async def broadcast_scores(self):
+        # Requests made during the window end up in one broadcast
+        if self.scoreboard.request():
+            self.call_later(settings.QUIZ_SCORE_BROADCAST_WINDOW, {'type': 'flush_scores'})
+
+    async def handle_flush_scores(self, command):
+        state = await self.store.get_game(self.room_id)
+        if not state:
+            return
+        payload = self.scoreboard.flush(await self.score_rows(state))
+        if payload:
+            await self.broadcast(payload)
+
+    async def end_game(self):
+        self.stop()
+        # pop_game is atomic: a game can only be ended once
+        state = await self.store.pop_game(self.room_id)
+        if not state:
+            return
+        await set_room_in_game(self.room_id, False)
+        final_scores = await self.score_rows(state)
+        await self.broadcast({
+            'action': 'game_over',
+            'final_scores': final_scores
+        })
+        try:
+            session = await run_sync(save_game, self.room_id, state, final_scores, server_time())
+        except Exception:
+            logger.exception("Could not save the game of room %s", self.room_id)
+            return
+        await record_game(session, final_scores)
+
+    async def load_questions(self, limit, category):
+        try:
+            return await question_bank.take(limit, category)
+        except Exception:
+            logger.exception("Could not load questions")
+        return []
+
+    async def get_room_participants(self):
+        membership = await aget_membership(self.room_id)
+        return list(membership['participants']) if membership else []
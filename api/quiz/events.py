@@ -0,0 +1,182 @@
+"""
+Sequence-numbered room events and player presence.
+
+Every broadcast to a room gets the next sequence number of the room and is kept
+in a bounded ring buffer (``QUIZ_EVENT_BUFFER_SIZE`` events), so a client
+reconnecting with the last sequence number it saw is sent only the events it
+missed instead of a full game state. When the buffer doesn't reach back that
+far the consumer falls back to the ``game_state`` snapshot.
+
+Presence counts the open sockets of each player of a room across the workers.
+A player only leaves the room once their last socket has been closed for
+``QUIZ_RECONNECT_GRACE`` seconds, so a quick reconnect broadcasts nothing.
+
+Both use the backend of the game store (``QUIZ_GAME_STORE``).
+"""
+import collections
+
+from django.conf import settings
+
+from mindvswild.redis_client import get_async_redis
+from .protocol import dumps
+
+
+def with_seq(text, seq):
+    """Add the sequence number to an encoded payload (a JSON object)."""
+    return '{"seq":%d,%s' % (seq, text[1:])
+
+
+class InMemoryRoomEvents:
+    """Process-local backend. Methods never await, so every call is atomic."""
+
+    def __init__(self):
+        self.seqs = {}
+        self.buffers = {}
+        # Room id -> user id -> open sockets
+        self.presence = collections.defaultdict(dict)
+
+    async def append(self, room_id, payload):
+        """Number and keep the payload, return it encoded with its sequence number."""
+        room_id = str(room_id)
+        seq = self.seqs.get(room_id, 0) + 1
+        self.seqs[room_id] = seq
+        text = with_seq(dumps(payload), seq)
+        buffer = self.buffers.setdefault(room_id, collections.deque(maxlen=settings.QUIZ_EVENT_BUFFER_SIZE))
+        buffer.append(text)
+        return text
+
+    async def last_seq(self, room_id):
+        return self.seqs.get(str(room_id), 0)
+
+    async def since(self, room_id, seq):
+        """Return the last sequence number of the room and the encoded events
+        after ``seq``, None instead of the events if some are no longer kept."""
+        room_id = str(room_id)
+        last = self.seqs.get(room_id, 0)
+        buffer = self.buffers.get(room_id, ())
+        first = last - len(buffer) + 1
+        if seq > last or seq < first - 1:
+            return last, None
+        return last, list(buffer)[seq - first + 1:]
+
+    async def connect(self, room_id, user_id):
+        """Count a socket of the player, return True if they weren't in the room."""
+        room = self.presence[str(room_id)]
+        present = user_id in room
+        room[user_id] = room.get(user_id, 0) + 1
+        return not present
+
+    async def disconnect(self, room_id, user_id):
+        room = self.presence[str(room_id)]
+        if user_id in room:
+            room[user_id] -= 1
+
+    async def leave_if_gone(self, room_id, user_id):
+        """Remove the player if they have no socket left, return True if removed."""
+        room = self.presence[str(room_id)]
+        if room.get(user_id, 1) > 0:
+            return False
+        del room[user_id]
+        return True
+
+
+# KEYS = last seq, buffer; ARGV = ttl, buffer size, encoded payload
+_APPEND = """
+local seq = redis.call('INCR', KEYS[1])
+local text = '{"seq":' .. seq .. ',' .. string.sub(ARGV[3], 2)
+redis.call('RPUSH', KEYS[2], text)
+redis.call('LTRIM', KEYS[2], -tonumber(ARGV[2]), -1)
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+redis.call('EXPIRE', KEYS[2], ARGV[1])
+return text
+"""
+
+# KEYS = last seq, buffer; ARGV = seq. Returns {last seq, 1 if complete, events...}
+_SINCE = """
+local last = tonumber(redis.call('GET', KEYS[1]) or '0')
+local seq = tonumber(ARGV[1])
+local first = last - redis.call('LLEN', KEYS[2]) + 1
+if seq > last or seq < first - 1 then return {last, 0} end
+local result = {last, 1}
+for _, text in ipairs(redis.call('LRANGE', KEYS[2], seq - first + 1, -1)) do
+  table.insert(result, text)
+end
+return result
+"""
+
+# KEYS = presence; ARGV = ttl, user id. Returns 1 if the player wasn't present
+_CONNECT = """
+local present = redis.call('HEXISTS', KEYS[1], ARGV[2])
+redis.call('HINCRBY', KEYS[1], ARGV[2], 1)
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+return 1 - present
+"""
+
+_DISCONNECT = """
+if redis.call('HEXISTS', KEYS[1], ARGV[1]) == 1 then
+  redis.call('HINCRBY', KEYS[1], ARGV[1], -1)
+end
+return 1
+"""
+
+_LEAVE = """
+local count = redis.call('HGET', KEYS[1], ARGV[1])
+if not count or tonumber(count) > 0 then return 0 end
+redis.call('HDEL', KEYS[1], ARGV[1])
+return 1
+"""
+
+
+class RedisRoomEvents:
+    def __init__(self, client=None, ttl=None):
+        self.client = client or get_async_redis()
+        self.ttl = ttl or settings.QUIZ_GAME_TTL
+        self._append = self.client.register_script(_APPEND)
+        self._since = self.client.register_script(_SINCE)
+        self._connect = self.client.register_script(_CONNECT)
+        self._disconnect = self.client.register_script(_DISCONNECT)
+        self._leave = self.client.register_script(_LEAVE)
+
+    def keys(self, room_id):
+        return [f'quiz:events:{room_id}:seq', f'quiz:events:{room_id}']
+
+    async def append(self, room_id, payload):
+        return await self._append(keys=self.keys(room_id), args=[
+            self.ttl, settings.QUIZ_EVENT_BUFFER_SIZE, dumps(payload)
+        ])
+
+    async def last_seq(self, room_id):
+        return int(await self.client.get(self.keys(room_id)[0]) or 0)
+
+    async def since(self, room_id, seq):
+        last, complete, *events = await self._since(keys=self.keys(room_id), args=[seq])
+        return int(last), events if complete else None
+
+    async def connect(self, room_id, user_id):
+        return bool(await self._connect(keys=[f'quiz:presence:{room_id}'], args=[self.ttl, user_id]))
+
+    async def disconnect(self, room_id, user_id):
+        await self._disconnect(keys=[f'quiz:presence:{room_id}'], args=[user_id])
+
+    async def leave_if_gone(self, room_id, user_id):
+        return bool(await self._leave(keys=[f'quiz:presence:{room_id}'], args=[user_id]))
+
+
+_BACKENDS = {
+    'memory': InMemoryRoomEvents,
+    'redis': RedisRoomEvents,
+}
+_events = None
+
+
+def get_room_events():
+    """Return the room events backend matching ``settings.QUIZ_GAME_STORE``."""
+    global _events
+    if _events is None:
+        _events = _BACKENDS[settings.QUIZ_GAME_STORE]()
+    return _events
+
+
+async def room_event(room_id, payload):
+    """Channel layer event broadcasting ``payload`` to the room with its sequence number."""
+    return {'type': 'send_frame', 'text': await get_room_events().append(room_id, payload)}
@@ -0,0 +1,71 @@
+"""
+History of the finished games.
+
+Answers are not written to the database while a game is played: the store
+keeps them with the game state (see ``GameStore.submit_answer``) and the
+engine saves the whole game when it ends, with one ``bulk_create`` per table.
+"""
+from datetime import datetime, timezone
+
+from django.contrib.auth.models import User
+from django.db import transaction
+
+from rooms.models import Room
+from .models import AnswerRecord, GamePlayer, GameSession
+
+
+def from_epoch_ms(value):
+    return datetime.fromtimestamp(value / 1000, tz=timezone.utc)
+
+
+def save_game(room_id, state, final_scores, ended_at):
+    """Save a finished game.
+
+    ``state`` is the snapshot returned by ``GameStore.pop_game``,
+    ``final_scores`` the sorted score rows sent to the players and
+    ``ended_at`` the end of the game in epoch milliseconds.
+    """
+    room = Room.objects.filter(pk=room_id).values('group_id').first()
+    # Players who deleted their account during the game
+    user_ids = set(User.objects.filter(pk__in=state['scores']).values_list('pk', flat=True))
+    ended_at = from_epoch_ms(ended_at)
+
+    with transaction.atomic():
+        session = GameSession.objects.create(
+            room_id=room_id if room else None,
+            group_id=room['group_id'] if room else None,
+            started_at=from_epoch_ms(state['started_at']),
+            ended_at=ended_at,
+            question_count=len(state['questions']),
+            questions_played=min(state['current_index'] + 1, len(state['questions'])),
+            timer_duration=state['timer_duration'],
+            elimination_mode=state['elimination_mode'],
+        )
+        GamePlayer.objects.bulk_create([
+            GamePlayer(
+                session=session,
+                user_id=row['user_id'],
+                score=row['score'],
+                rank=rank,
+                is_active=row['is_active'],
+                ended_at=ended_at,
+            )
+            for rank, row in enumerate(final_scores, start=1)
+            if row['user_id'] in user_ids
+        ])
+        AnswerRecord.objects.bulk_create([
+            AnswerRecord(
+                session=session,
+                user_id=record['user_id'],
+                question_index=record['question_index'],
+                question_id=record['question_id'] or '',
+                answer=(record['answer'] or '')[:255],
+                correct=record['correct'],
+                points=record['points'],
+                response_ms=max(0, record['response_ms']),
+                answered_at=from_epoch_ms(record['answered_at']),
+            )
+            for record in state['answers']
+            if record['user_id'] in user_ids
+        ], batch_size=1000)
+    return session
@@ -0,0 +1,174 @@
+"""
+Global and per-group leaderboards, all-time and weekly.
+
+Each leaderboard is a Redis sorted set of user ids scored by the sum of their
+game scores, incremented once per finished game, so a top-N read is
+O(log n + N) and a rank lookup O(log n) instead of aggregating the game history
+on every request. Weekly boards expire once the week is over for long enough.
+Usernames are kept in a hash next to the boards so reads don't touch the
+database. ``manage.py rebuild_leaderboards`` rebuilds everything from
+``GamePlayer``. The in-memory backend has the same semantics and is meant for tests.
+"""
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+from django.conf import settings
+from redis.exceptions import RedisError
+
+from mindvswild.redis_client import get_async_redis, get_redis
+from .models import GamePlayer
+
+logger = logging.getLogger(__name__)
+
+PERIODS = ('all', 'week')
+
+
+def week_of(moment):
+    year, week, _ = moment.isocalendar()
+    return f'{year}-W{week:02d}'
+
+
+def board_key(group_id=None, period='all', moment=None):
+    """Name of the leaderboard of a group (global if None) for the period containing ``moment``."""
+    scope = f'group:{group_id}' if group_id else 'global'
+    if period == 'week':
+        return f'leaderboard:{scope}:week:{week_of(moment or datetime.now(timezone.utc))}'
+    return f'leaderboard:{scope}:all'
+
+
+def game_boards(group_id, ended_at):
+    """Leaderboards a game of the group ended at ``ended_at`` counts for."""
+    keys = [board_key(None, 'all'), board_key(None, 'week', ended_at)]
+    if group_id:
+        keys += [board_key(group_id, 'all'), board_key(group_id, 'week', ended_at)]
+    return keys
+
+
+class InMemoryLeaderboards:
+    def __init__(self):
+        self.boards = defaultdict(dict)
+        self.names = {}
+
+    async def add_game(self, keys, results):
+        for key in keys:
+            board = self.boards[key]
+            for user_id, _, score in results:
+                board[user_id] = board.get(user_id, 0) + score
+        self.names.update({user_id: username for user_id, username, _ in results})
+
+    def replace(self, boards, names):
+        self.boards = defaultdict(dict, {key: dict(scores) for key, scores in boards.items()})
+        self.names = dict(names)
+
+    def _ranked(self, key):
+        # Same order as ZREVRANGE: score, then member, descending
+        return sorted(self.boards.get(key, {}).items(), key=lambda item: (item[1], str(item[0])), reverse=True)
+
+    def top(self, key, limit):
+        return [
+            {'user_id': user_id, 'username': self.names.get(user_id, ''), 'score': score, 'rank': rank}
+            for rank, (user_id, score) in enumerate(self._ranked(key)[:limit], start=1)
+        ]
+
+    def rank(self, key, user_id):
+        for rank, (uid, score) in enumerate(self._ranked(key), start=1):
+            if uid == user_id:
+                return {'user_id': user_id, 'score': score, 'rank': rank}
+        return None
+
+
+class RedisLeaderboards:
+    NAMES = 'leaderboard:names'
+
+    def __init__(self, client=None, async_client=None):
+        self.client = client or get_redis()
+        self.async_client = async_client or get_async_redis()
+        self.week_ttl = settings.LEADERBOARD_WEEK_TTL
+
+    async def add_game(self, keys, results):
+        async with self.async_client.pipeline(transaction=True) as pipe:
+            for key in keys:
+                for user_id, _, score in results:
+                    pipe.zincrby(key, score, user_id)
+                if ':week:' in key:
+                    pipe.expire(key, self.week_ttl)
+            pipe.hset(self.NAMES, mapping={user_id: username for user_id, username, _ in results})
+            await pipe.execute()
+
+    def replace(self, boards, names):
+        stale = list(self.client.scan_iter('leaderboard:*:*', count=1000))
+        with self.client.pipeline(transaction=True) as pipe:
+            if stale:
+                pipe.delete(*stale)
+            for key, scores in boards.items():
+                if scores:
+                    pipe.zadd(key, scores)
+                    if ':week:' in key:
+                        pipe.expire(key, self.week_ttl)
+            if names:
+                pipe.hset(self.NAMES, mapping=names)
+            pipe.execute()
+
+    def top(self, key, limit):
+        entries = self.client.zrevrange(key, 0, limit - 1, withscores=True)
+        if not entries:
+            return []
+        names = self.client.hmget(self.NAMES, [user_id for user_id, _ in entries])
+        return [
+            {'user_id': int(user_id), 'username': name or '', 'score': int(score), 'rank': rank}
+            for rank, ((user_id, score), name) in enumerate(zip(entries, names), start=1)
+        ]
+
+    def rank(self, key, user_id):
+        with self.client.pipeline(transaction=False) as pipe:
+            pipe.zrevrank(key, user_id)
+            pipe.zscore(key, user_id)
+            rank, score = pipe.execute()
+        if rank is None:
+            return None
+        return {'user_id': user_id, 'score': int(score), 'rank': rank + 1}
+
+
+_BACKENDS = {
+    'memory': InMemoryLeaderboards,
+    'redis': RedisLeaderboards,
+}
+_leaderboards = None
+
+
+def get_leaderboards():
+    """Return the leaderboards backend configured by ``settings.LEADERBOARD_BACKEND``."""
+    global _leaderboards
+    if _leaderboards is None:
+        _leaderboards = _BACKENDS[settings.LEADERBOARD_BACKEND]()
+    return _leaderboards
+
+
+async def record_game(session, final_scores):
+    """Add the scores of a saved game (``quiz.history.save_game``) to its leaderboards."""
+    results = [(row['user_id'], row['username'], row['score']) for row in final_scores]
+    try:
+        await get_leaderboards().add_game(game_boards(session.group_id, session.ended_at), results)
+    except RedisError:
+        logger.warning("Could not update the leaderboards of game %s", session.pk, exc_info=True)
+
+
+def rebuild_leaderboards():
+    """Rebuild every leaderboard from the game history, return the number of results read."""
+    boards = defaultdict(lambda: defaultdict(int))
+    names = {}
+    # Older weeks would expire right away
+    weeks_after = datetime.now(timezone.utc) - timedelta(seconds=settings.LEADERBOARD_WEEK_TTL)
+    count = 0
+    results = GamePlayer.objects.values_list('user_id', 'user__username', 'session__group_id', 'ended_at', 'score')
+    for user_id, username, group_id, ended_at, score in results.iterator(chunk_size=5000):
+        count += 1
+        names[user_id] = username
+        keys = game_boards(group_id, ended_at)
+        if ended_at < weeks_after:
+            keys = [key for key in keys if ':week:' not in key]
+        for key in keys:
+            boards[key][user_id] += score
+    get_leaderboards().replace(boards, names)
+    return count
@@ -0,0 +1,78 @@
+import asyncio
+import json
+import time
+
+from channels.layers import InMemoryChannelLayer
+from django.core.management.base import BaseCommand
+
+from quiz.protocol import dumps, frame, orjson
+
+
+def scoreboard(size):
+    return [
+        {'user_id': uid, 'username': f'player{uid}', 'score': uid * 10, 'is_active': True, 'rank': uid + 1}
+        for uid in range(size)
+    ]
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure the CPU cost of a scoreboard broadcast, encoded per socket or once per group, "
+        "then the cost of the JSON encoders alone."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 500])
+        parser.add_argument('--broadcasts', type=int, default=20)
+
+    def handle(self, *args, **options):
+        # Both arms encode with the same backend: only where the encoding happens differs
+        self.stdout.write(f"JSON backend: {'orjson' if orjson else 'json'}")
+        self.stdout.write(f"{'players':>8} {'per socket (ms)':>16} {'once (ms)':>10} {'speedup':>8}")
+        for size in options['sizes']:
+            per_socket = asyncio.run(self.run(size, options['broadcasts'], pre_encoded=False))
+            once = asyncio.run(self.run(size, options['broadcasts'], pre_encoded=True))
+            self.stdout.write(
+                f"{size:>8} {per_socket * 1000:>16.2f} {once * 1000:>10.2f} {per_socket / once:>7.1f}x"
+            )
+
+        if orjson is None:
+            return
+        self.stdout.write("")
+        self.stdout.write(f"{'players':>8} {'json (ms)':>10} {'orjson (ms)':>12} {'speedup':>8}")
+        for size in options['sizes']:
+            payload = {'action': 'scores_update', 'scores': scoreboard(size)}
+            stdlib = self.encode(json.dumps, payload, options['broadcasts'])
+            fast = self.encode(dumps, payload, options['broadcasts'])
+            self.stdout.write(f"{size:>8} {stdlib * 1000:>10.3f} {fast * 1000:>12.3f} {stdlib / fast:>7.1f}x")
+
+    def encode(self, encoder, payload, count):
+        """Return the CPU time of encoding ``payload`` once."""
+        start = time.process_time()
+        for _ in range(count):
+            encoder(payload)
+        return (time.process_time() - start) / count
+
+    async def run(self, size, broadcasts, pre_encoded):
+        """Return the CPU time of one broadcast to ``size`` sockets, delivery included."""
+        layer = InMemoryChannelLayer(capacity=broadcasts + 1)
+        channels = [await layer.new_channel() for _ in range(size)]
+        for channel in channels:
+            await layer.group_add('bench', channel)
+        scores = scoreboard(size)
+        sent = []
+
+        start = time.process_time()
+        for _ in range(broadcasts):
+            if pre_encoded:
+                await layer.group_send('bench', frame({'action': 'scores_update', 'scores': scores}))
+            else:
+                await layer.group_send('bench', {'type': 'broadcast_scores_update', 'scores': scores})
+            for channel in channels:
+                event = await layer.receive(channel)
+                # What the consumer handler does before writing to its socket
+                if pre_encoded:
+                    sent.append(event['text'])
+                else:
+                    sent.append(dumps({'action': 'scores_update', 'scores': event['scores']}))
+        return (time.process_time() - start) / broadcasts
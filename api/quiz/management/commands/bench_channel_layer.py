@@ -0,0 +1,82 @@
+import asyncio
+import time
+
+from channels.layers import DEFAULT_CHANNEL_LAYER, InMemoryChannelLayer
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils.module_loading import import_string
+from redis.exceptions import RedisError
+
+from quiz.protocol import frame
+
+LAYERS = {
+    'memory': 'channels.layers.InMemoryChannelLayer',
+    'core': 'channels_redis.core.RedisChannelLayer',
+    'pubsub': 'channels_redis.pubsub.RedisPubSubChannelLayer',
+}
+
+
+class Command(BaseCommand):
+    help = "Compare the channel layers on the fan-out of a question broadcast to rooms of 10 to 1000 members."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000])
+        parser.add_argument('--broadcasts', type=int, default=20)
+        parser.add_argument('--layers', nargs='+', choices=list(LAYERS), default=list(LAYERS))
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{'layer':>7} {'members':>8} {'p50 ms':>8} {'max ms':>8} {'deliveries/s':>13}")
+        for name in options['layers']:
+            for size in options['sizes']:
+                try:
+                    timings = asyncio.run(asyncio.wait_for(self.run(name, size, options['broadcasts']), 120))
+                except (OSError, RedisError, asyncio.TimeoutError) as e:
+                    self.stdout.write(f"{name:>7} skipped, Redis unreachable: {e!r}")
+                    break
+                timings.sort()
+                self.stdout.write(
+                    f"{name:>7} {size:>8} {timings[len(timings) // 2] * 1000:>8.2f} {timings[-1] * 1000:>8.2f} "
+                    f"{size * len(timings) / sum(timings):>13.0f}"
+                )
+
+    def make_layer(self, name):
+        if name == 'memory':
+            return InMemoryChannelLayer()
+        # The configured hosts and tuning, whatever the mode of the settings
+        config = dict(settings.CHANNEL_LAYERS[DEFAULT_CHANNEL_LAYER].get('CONFIG', {}))
+        config.setdefault('hosts', settings.CHANNEL_LAYER_HOSTS)
+        if name == 'pubsub':
+            config = {key: config[key] for key in ('hosts', 'symmetric_encryption_keys') if key in config}
+        else:
+            config.setdefault('channel_capacity', {'specific.*': settings.CHANNEL_LAYER_SOCKET_CAPACITY})
+        return import_string(LAYERS[name])(**config)
+
+    async def run(self, name, size, broadcasts):
+        """Seconds from each group_send of a question to its reception by the last member."""
+        layer = self.make_layer(name)
+        group = f'bench_fanout_{size}'
+        channels = [await layer.new_channel() for _ in range(size)]
+        for channel in channels:
+            await layer.group_add(group, channel)
+        message = frame({
+            'action': 'new_question',
+            'question': {'id': 'q1', 'text': "Quelle est la capitale de l'Australie ?",
+                         'options': ['Canberra', 'Sydney', 'Melbourne', 'Perth']},
+            'time_remaining': 30, 'deadline': 1700000030000, 'server_time': 1700000000000,
+        })
+        timings = []
+        try:
+            for _ in range(broadcasts):
+                start = time.perf_counter()
+                await layer.group_send(group, message)
+                await asyncio.gather(*(layer.receive(channel) for channel in channels))
+                timings.append(time.perf_counter() - start)
+        finally:
+            for channel in channels:
+                await layer.group_discard(group, channel)
+            # Not flush() on the core layer: it empties the whole Redis of the layer
+            if name == 'core':
+                await layer.close_pools()
+            elif name == 'pubsub':
+                await layer.flush()
+        return timings
@@ -0,0 +1,84 @@
+import asyncio
+import collections
+import time
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+from mindvswild.db import check_connection
+from rooms.models import Room
+
+
+def membership_query(alias, room_id):
+    # What a connecting socket asks the database on a membership cache miss
+    return list(Room.objects.using(alias).filter(pk=room_id).values_list('created_by_id', 'participants__user_id'))
+
+
+class Command(BaseCommand):
+    help = "Measure the latency of a storm of sockets querying the database at once, without and with the pool."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sockets', type=int, nargs='+', default=[50, 200, 1000])
+        parser.add_argument('--room', type=int, default=1, help="Room whose membership is queried")
+
+    def handle(self, *args, **options):
+        if connections['default'].vendor != 'postgresql':
+            raise CommandError("The connection pool needs PostgreSQL (psycopg 3)")
+
+        default = connections.settings['default']
+        options_without_pool = {key: value for key, value in default.get('OPTIONS', {}).items() if key != 'pool'}
+        connections.settings['bench_direct'] = {**default, 'OPTIONS': options_without_pool, 'CONN_MAX_AGE': 0}
+        connections.settings['bench_pool'] = {**default, 'CONN_MAX_AGE': 0, 'OPTIONS': {
+            **options_without_pool,
+            'pool': {
+                'min_size': settings.DB_POOL_MIN_SIZE,
+                'max_size': settings.DB_POOL_MAX_SIZE,
+                'timeout': settings.DB_POOL_TIMEOUT,
+                'check': check_connection,
+            },
+        }}
+
+        # Also sent when a connection is borrowed from the pool
+        self.opened = collections.Counter()
+        connection_created.connect(self.count_connection)
+
+        self.stdout.write(f"{'mode':>7} {'sockets':>8} {'p50 ms':>8} {'p99 ms':>8} {'total s':>8} {'connects':>9}")
+        try:
+            for alias, mode in (('bench_direct', 'direct'), ('bench_pool', 'pool')):
+                for count in options['sockets']:
+                    latencies, elapsed, connects = asyncio.run(self.storm(alias, count, options['room']))
+                    latencies.sort()
+                    self.stdout.write(
+                        f"{mode:>7} {count:>8} {latencies[len(latencies) // 2] * 1000:>8.2f} "
+                        f"{latencies[min(len(latencies) - 1, int(0.99 * len(latencies)))] * 1000:>8.2f} "
+                        f"{elapsed:>8.2f} {connects:>9}"
+                    )
+        finally:
+            connection_created.disconnect(self.count_connection)
+            connections['bench_pool'].close_pool()
+
+    def count_connection(self, sender, connection, **kwargs):
+        self.opened[connection.alias] += 1
+
+    async def storm(self, alias, count, room_id):
+        """All the sockets query at once: latency of each, total time, connections opened."""
+        before = self.connects(alias)
+
+        async def query():
+            start = time.perf_counter()
+            # Closes the connection afterwards without a pool, gives it back to the pool otherwise
+            await database_sync_to_async(membership_query)(alias, room_id)
+            return time.perf_counter() - start
+
+        start = time.perf_counter()
+        latencies = await asyncio.gather(*(query() for _ in range(count)))
+        return list(latencies), time.perf_counter() - start, self.connects(alias) - before
+
+    def connects(self, alias):
+        wrapper = connections[alias]
+        if wrapper.settings_dict['OPTIONS'].get('pool'):
+            return wrapper.pool.get_stats().get('connections_num', 0)
+        return self.opened[alias]
@@ -0,0 +1,97 @@
+import random
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from quiz.protocol import deflate, dumps, pack, transcode
+from quiz.scoreboard import Scoreboard
+
+
+class Command(BaseCommand):
+    help = "Compare the bytes per game and the encoding time of the JSON, deflated JSON and compact protocols."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 500])
+        parser.add_argument('--questions', type=int, default=10)
+        parser.add_argument('--flushes', type=int, default=5, help="Scoreboard broadcasts per question")
+
+    def handle(self, *args, **options):
+        self.stdout.write(
+            f"{'players':>8} {'JSON B/client':>14} {'deflate B/client':>17} {'compact B/client':>17} "
+            f"{'JSON ms/game':>13} {'deflate ms/game':>16} {'compact ms/game':>16}"
+        )
+        for size in options['sizes']:
+            broadcasts, replies = self.game(size, options['questions'], options['flushes'])
+            (json_bytes, deflate_bytes, compact_bytes,
+             json_time, deflate_time, compact_time) = self.measure(broadcasts, replies)
+            self.stdout.write(
+                f"{size:>8} {json_bytes:>14} {deflate_bytes:>17} {compact_bytes:>17} "
+                f"{json_time * 1000:>13.2f} {deflate_time * 1000:>16.2f} {compact_time * 1000:>16.2f}"
+            )
+
+    def game(self, size, questions, flushes):
+        """Payloads of a simulated game: the broadcasts, and the replies to one player."""
+        players = [{'user_id': uid, 'username': f'joueur{uid}'} for uid in range(1, size + 1)]
+        scores = {player['user_id']: 0 for player in players}
+        scoreboard = Scoreboard()
+        broadcasts = [
+            {'action': 'participant_joined', **player} for player in players
+        ]
+        broadcasts.append({
+            'action': 'game_starting',
+            'settings': {'question_count': questions, 'timer_duration': 30, 'elimination_mode': False},
+            'players': players,
+        })
+        replies = []
+
+        def rows():
+            return sorted((
+                {'user_id': player['user_id'], 'username': player['username'],
+                 'score': scores[player['user_id']], 'is_active': True}
+                for player in players
+            ), key=lambda row: row['score'], reverse=True)
+
+        broadcasts.append(scoreboard.flush(rows()))
+        for index in range(questions):
+            broadcasts.append({
+                'action': 'new_question',
+                'question': {'id': f'q{index}', 'text': "Quelle est la capitale de l'Australie ?",
+                             'options': ['Canberra', 'Sydney', 'Melbourne', 'Perth']},
+                'time_remaining': 30, 'deadline': 1700000000000 + index * 32000, 'server_time': 1700000000000,
+            })
+            answering = random.sample(list(scores), len(scores))
+            for burst in range(flushes):
+                for uid in answering[burst::flushes]:
+                    if random.random() < 0.6:
+                        scores[uid] += 10
+                payload = scoreboard.flush(rows())
+                if payload:
+                    broadcasts.append(payload)
+            replies.append({'action': 'answer_result', 'correct': True, 'selected_option': 'Canberra',
+                            'correct_option': 'Canberra', 'points': scores[1]})
+        broadcasts.append({'action': 'game_over', 'final_scores': rows()})
+        # Sequence numbers as added by the room event log
+        broadcasts = [{'seq': seq, **payload} for seq, payload in enumerate(broadcasts, start=1)]
+        return broadcasts, replies
+
+    def measure(self, broadcasts, replies):
+        transcode.cache_clear()
+        deflate.cache_clear()
+        start = time.process_time()
+        texts = [dumps(payload) for payload in broadcasts + replies]
+        json_time = time.process_time() - start
+        # Broadcasts are encoded in JSON by their sender, then transcoded once per worker
+        start = time.process_time()
+        frames = [transcode(text) for text in texts[:len(broadcasts)]] + [pack(payload) for payload in replies]
+        compact_time = time.process_time() - start
+        # Only the frames above the threshold are compressed, once per worker as well
+        start = time.process_time()
+        deflated = [
+            deflate(text) if len(text) >= settings.QUIZ_COMPRESS_MIN_SIZE else text.encode() for text in texts
+        ]
+        deflate_time = time.process_time() - start
+        json_bytes = sum(len(text.encode()) for text in texts)
+        deflate_bytes = sum(len(frame) for frame in deflated)
+        compact_bytes = sum(len(frame) for frame in frames)
+        return json_bytes, deflate_bytes, compact_bytes, json_time, deflate_time, compact_time
@@ -0,0 +1,145 @@
+import asyncio
+import collections
+import multiprocessing
+import time
+import uuid
+
+from channels.layers import DEFAULT_CHANNEL_LAYER
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.module_loading import import_string
+
+from quiz.protocol import dumps
+
+
+def make_layer(capacity):
+    """A channel layer of its own for the process, with room for all the broadcasts (core layer)."""
+    config = settings.CHANNEL_LAYERS[DEFAULT_CHANNEL_LAYER]
+    if 'pubsub' in config['BACKEND']:
+        # Nothing waits in a pub/sub channel
+        return import_string(config['BACKEND'])(**config.get('CONFIG', {}))
+    return import_string(config['BACKEND'])(**{**config.get('CONFIG', {}), 'capacity': capacity})
+
+
+def local_sockets(index, workers, rooms, sockets):
+    """Rooms of the sockets of a worker: the sockets of each room are spread over the workers."""
+    return [room for room in range(rooms) for socket in range(sockets) if (room * sockets + socket) % workers == index]
+
+
+async def worker(layer, mode, prefix, sockets, broadcasts, ready):
+    """Receive the broadcasts like the consumers of a worker, return the frames written to its sockets."""
+    outbox = []
+    if mode == 'group':
+        # A channel per socket, in the group of its room
+        channels = []
+        for room in sockets:
+            channel = await layer.new_channel()
+            await layer.group_add(f'{prefix}room_{room}', channel)
+            channels.append(channel)
+
+        async def receive(channel):
+            for _ in range(broadcasts):
+                outbox.append((await layer.receive(channel))['text'])
+        receivers = [receive(channel) for channel in channels]
+    else:
+        # A channel for the worker, in the relay group of its rooms
+        channel = await layer.new_channel()
+        counts = collections.Counter(sockets)
+        for room in counts:
+            await layer.group_add(f'{prefix}relay_{room}', channel)
+
+        async def relay():
+            for _ in range(broadcasts * len(counts)):
+                message = await layer.receive(channel)
+                outbox.extend([message['text']] * counts[message['room_id']])
+        receivers = [relay()]
+
+    await ready()
+    await asyncio.gather(*receivers)
+    return len(outbox)
+
+
+def worker_process(mode, prefix, sockets, broadcasts, barrier, results):
+    async def run():
+        layer = make_layer(broadcasts * len(sockets) + 100)
+        ready = lambda: asyncio.get_running_loop().run_in_executor(None, barrier.wait)  # noqa: E731
+        delivered = await worker(layer, mode, prefix, sockets, broadcasts, ready)
+        results.put((delivered, time.time()))
+    asyncio.run(run())
+
+
+async def publish(layer, mode, prefix, rooms, broadcasts):
+    """Broadcast to every room like their engines, return when it started."""
+    text = dumps({'action': 'scores_update', 'scores': [
+        {'user_id': uid, 'username': f'joueur{uid}', 'score': uid * 10, 'is_active': True} for uid in range(20)
+    ]})
+    start = time.time()
+    for _ in range(broadcasts):
+        for room in range(rooms):
+            if mode == 'group':
+                await layer.group_send(f'{prefix}room_{room}', {'type': 'send_frame', 'text': text})
+            else:
+                await layer.group_send(f'{prefix}relay_{room}', {'type': 'room.frame', 'room_id': room, 'text': text})
+    return start
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure the frames delivered per second to the sockets of rooms spread over worker processes, "
+        "with a group per room (one message per socket) or with room affinity (one message per worker)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+        parser.add_argument('--rooms', type=int, default=20)
+        parser.add_argument('--sockets', type=int, default=50, help="Sockets per room")
+        parser.add_argument('--broadcasts', type=int, default=20, help="Broadcasts per room")
+        parser.add_argument('--modes', nargs='+', choices=['group', 'affinity'], default=['group', 'affinity'])
+
+    def handle(self, *args, **options):
+        if 'InMemory' in settings.CHANNEL_LAYERS[DEFAULT_CHANNEL_LAYER]['BACKEND']:
+            raise CommandError("The worker processes need a shared channel layer, e.g. channels_redis")
+
+        self.stdout.write(f"{'mode':>9} {'workers':>8} {'frames/s':>10} {'layer msgs':>11} {'seconds':>8}")
+        for mode in options['modes']:
+            for workers in options['workers']:
+                delivered, messages, elapsed = self.run(
+                    mode, workers, options['rooms'], options['sockets'], options['broadcasts']
+                )
+                self.stdout.write(
+                    f"{mode:>9} {workers:>8} {delivered / elapsed:>10.0f} {messages:>11} {elapsed:>8.2f}"
+                )
+
+    def run(self, mode, workers, rooms, sockets, broadcasts):
+        # Forked after setup: the children inherit the settings, each makes its own layer
+        context = multiprocessing.get_context('fork')
+        barrier = context.Barrier(workers + 1)
+        results = context.Queue()
+        prefix = f'bench{uuid.uuid4().hex[:8]}_'
+        processes = [
+            context.Process(target=worker_process, args=(
+                mode, prefix, local_sockets(index, workers, rooms, sockets), broadcasts, barrier, results
+            ))
+            for index in range(workers)
+        ]
+        for process in processes:
+            process.start()
+
+        async def run():
+            layer = make_layer(broadcasts * rooms + 100)
+            await asyncio.get_running_loop().run_in_executor(None, barrier.wait)
+            return await publish(layer, mode, prefix, rooms, broadcasts)
+        start = asyncio.run(run())
+
+        finished = [results.get(timeout=300) for _ in processes]
+        for process in processes:
+            process.join()
+        delivered = sum(count for count, _ in finished)
+        # Channel layer messages: one per socket per broadcast, or one per worker holding sockets of the room
+        if mode == 'group':
+            messages = rooms * sockets * broadcasts
+        else:
+            messages = sum(
+                len(set(local_sockets(index, workers, rooms, sockets))) for index in range(workers)
+            ) * broadcasts
+        return delivered, messages, max(end for _, end in finished) - start
@@ -0,0 +1,34 @@
+import asyncio
+
+from django.core.management.base import BaseCommand
+
+from quiz.questions import count_questions, question_bank
+from quiz.upstream import quiz_api
+
+
+class Command(BaseCommand):
+    help = "Fill the local question bank from the upstream quiz API."
+
+    def add_arguments(self, parser):
+        parser.add_argument('categories', nargs='*', help="Categories to fill (all questions if omitted)")
+        parser.add_argument('--rounds', type=int, default=1, help="Number of upstream fetches per category")
+
+    def handle(self, *args, **options):
+        categories = options['categories'] or [None]
+        fetched = asyncio.run(self.refill(categories, options['rounds']))
+        for category in categories:
+            self.stdout.write(
+                f"{category or 'all'}: {fetched[category]} questions fetched, "
+                f"{count_questions(category)} in the bank"
+            )
+
+    async def refill(self, categories, rounds):
+        fetched = {}
+        try:
+            for category in categories:
+                fetched[category] = 0
+                for _ in range(rounds):
+                    fetched[category] += await question_bank.refill(category)
+        finally:
+            await quiz_api.close()
+        return fetched
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from quiz.leaderboards import rebuild_leaderboards
+
+
+class Command(BaseCommand):
+    help = "Rebuild the global and group leaderboards from the game history."
+
+    def handle(self, *args, **options):
+        count = rebuild_leaderboards()
+        self.stdout.write(f"Leaderboards rebuilt from {count} game results")
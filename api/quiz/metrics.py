@@ -0,0 +1,58 @@
+"""
+Metrics of the quiz sockets and game engines, see ``mindvswild.metrics``.
+"""
+from mindvswild.metrics import Counter, Gauge, Histogram, collector
+
+handler_seconds = Histogram('quiz_ws_handler_seconds', "Duration of the WebSocket message handlers.", ['handler'])
+engine_command_seconds = Histogram(
+    'quiz_engine_command_seconds', "Duration of the commands run by the room engines.", ['handler']
+)
+group_send_seconds = Histogram('quiz_group_send_seconds', "Duration of the channel layer group sends.")
+question_fetch_seconds = Histogram('quiz_api_request_seconds', "Duration of the upstream quiz API requests.")
+sockets = Gauge('quiz_room_sockets', "Open WebSockets, by room.", ['room'])
+running_games = Gauge('quiz_engines_running', "Room engines running in this process.")
+connections = Counter('quiz_ws_connections_total', "Accepted WebSocket connections.")
+rejected_messages = Counter(
+    'quiz_ws_rejected_messages_total', "Client messages dropped before the game logic, by reason.", ['reason']
+)
+
+
+def close_socket(room_id):
+    sockets.dec(room_id)
+    if sockets.values.get((room_id,)) == 0:
+        sockets.remove(room_id)
+
+
+@collector
+def quiz_stats():
+    # Counted by the modules themselves, imported here to keep them free of metrics
+    from .protocol import stats as protocol_stats
+    from .scoreboard import stats as scoreboard_stats
+    from .upstream import quiz_api
+
+    api = quiz_api.metrics()
+    return [
+        ('quiz_frames_total', 'counter', "Frames sent to the sockets, by kind.", {
+            (('kind', 'all'),): protocol_stats['frames'],
+            (('kind', 'batch'),): protocol_stats['batches'],
+        }),
+        ('quiz_batched_events_total', 'counter', "Events sent in batch frames.",
+         {(): protocol_stats['batched_events']}),
+        ('quiz_compressed_frames_total', 'counter', "Frames compressed for the deflate protocol.",
+         {(): protocol_stats['compressed']}),
+        ('quiz_compression_bytes_total', 'counter', "Bytes before and after compression.", {
+            (('stage', 'in'),): protocol_stats['compress_bytes_in'],
+            (('stage', 'out'),): protocol_stats['compress_bytes_out'],
+        }),
+        ('quiz_compression_cpu_seconds_total', 'counter', "CPU time spent compressing frames.",
+         {(): protocol_stats['compress_cpu_seconds']}),
+        ('quiz_scoreboard_total', 'counter', "Scoreboard broadcast requests and outcomes.", {
+            (('outcome', outcome),): scoreboard_stats[outcome] for outcome in scoreboard_stats
+        }),
+        ('quiz_api_events_total', 'counter', "Upstream quiz API client events.", {
+            (('event', event),): api[event]
+            for event in ('requests', 'errors', 'retries', 'short_circuited', 'deduplicated')
+        }),
+        ('quiz_api_circuit_open', 'gauge', "1 while the upstream quiz API circuit is open.",
+         {(): int(api['circuit'] == 'open')}),
+    ]
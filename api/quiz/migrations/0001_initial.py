@@ -0,0 +1,32 @@
+# Generated by Django 5.1.5 on 2026-10-18 15:34
+
+import quiz.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QuizQuestion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('external_id', models.CharField(max_length=64, unique=True)),
+                ('category', models.CharField(blank=True, default='', max_length=100)),
+                ('difficulty', models.CharField(blank=True, default='', max_length=20)),
+                ('text', models.CharField(max_length=500)),
+                ('answer', models.CharField(max_length=255)),
+                ('bad_answers', models.JSONField()),
+                ('random_key', models.FloatField(default=quiz.models.random_key)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['category', 'random_key'], name='quiz_quizqu_categor_e79bf2_idx'), models.Index(fields=['random_key'], name='quiz_quizqu_random__5ff379_idx')],
+            },
+        ),
+    ]
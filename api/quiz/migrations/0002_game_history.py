@@ -0,0 +1,87 @@
+# Generated by Django 5.1.5 on 2026-10-18 15:46
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('groups', '0002_listing_indexes'),
+        ('quiz', '0001_initial'),
+        ('rooms', '0003_listing_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GameSession',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('started_at', models.DateTimeField()),
+                ('ended_at', models.DateTimeField()),
+                ('question_count', models.PositiveIntegerField()),
+                ('questions_played', models.PositiveIntegerField()),
+                ('timer_duration', models.PositiveIntegerField()),
+                ('elimination_mode', models.BooleanField(default=False)),
+                ('group', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='game_sessions', to='groups.group')),
+                ('room', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='game_sessions', to='rooms.room')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='GamePlayer',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.IntegerField()),
+                ('rank', models.PositiveIntegerField()),
+                ('is_active', models.BooleanField()),
+                ('ended_at', models.DateTimeField()),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='game_results', to=settings.AUTH_USER_MODEL)),
+                ('session', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='players', to='quiz.gamesession')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='AnswerRecord',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('question_index', models.PositiveIntegerField()),
+                ('question_id', models.CharField(blank=True, default='', max_length=64)),
+                ('answer', models.CharField(blank=True, default='', max_length=255)),
+                ('correct', models.BooleanField()),
+                ('points', models.IntegerField()),
+                ('response_ms', models.PositiveIntegerField()),
+                ('answered_at', models.DateTimeField()),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='answer_records', to=settings.AUTH_USER_MODEL)),
+                ('session', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='answers', to='quiz.gamesession')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='gamesession',
+            index=models.Index(fields=['room', '-ended_at'], name='quiz_gamese_room_id_0f8837_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='gamesession',
+            index=models.Index(fields=['group', '-ended_at'], name='quiz_gamese_group_i_8c33d4_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='gamesession',
+            index=models.Index(fields=['-ended_at'], name='quiz_gamese_ended_a_3271d6_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='gameplayer',
+            index=models.Index(fields=['user', '-ended_at'], name='quiz_gamepl_user_id_f126c9_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='gameplayer',
+            unique_together={('session', 'user')},
+        ),
+        migrations.AddIndex(
+            model_name='answerrecord',
+            index=models.Index(fields=['session', 'question_index'], name='quiz_answer_session_148c06_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='answerrecord',
+            index=models.Index(fields=['user', '-answered_at'], name='quiz_answer_user_id_c55dbc_idx'),
+        ),
+    ]
@@ -1,3 +1,110 @@
+import random
+
+from django.contrib.auth.models import User
 from django.db import models
 
-# Create your models here.
+
+def random_key():
+    return random.random()
+
+
+class QuizQuestion(models.Model):
+    """Question of the local question bank, filled from the upstream quiz API."""
+    external_id = models.CharField(max_length=64, unique=True)
+    category = models.CharField(max_length=100, blank=True, default='')
+    difficulty = models.CharField(max_length=20, blank=True, default='')
+    text = models.CharField(max_length=500)
+    answer = models.CharField(max_length=255)
+    bad_answers = models.JSONField()
+    # Uniform random value used to sample questions through an index
+    random_key = models.FloatField(default=random_key)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['category', 'random_key']),
+            models.Index(fields=['random_key']),
+        ]
+
+    def __str__(self):
+        return self.text
+
+    def to_quiz(self):
+        """Return the question in the format of the upstream API used by the game."""
+        return {
+            '_id': self.external_id,
+            'question': self.text,
+            'answer': self.answer,
+            'badAnswers': self.bad_answers,
+            'category': self.category,
+            'difficulty': self.difficulty,
+        }
+
+
+class GameSession(models.Model):
+    """A finished game, saved with its players and answers when it ends."""
+    # Kept when the room or its group is deleted
+    room = models.ForeignKey('rooms.Room', null=True, on_delete=models.SET_NULL, related_name='game_sessions')
+    group = models.ForeignKey('groups.Group', null=True, on_delete=models.SET_NULL, related_name='game_sessions')
+    started_at = models.DateTimeField()
+    ended_at = models.DateTimeField()
+    question_count = models.PositiveIntegerField()
+    # Fewer than question_count when an elimination game ended early
+    questions_played = models.PositiveIntegerField()
+    timer_duration = models.PositiveIntegerField()
+    elimination_mode = models.BooleanField(default=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['room', '-ended_at']),
+            models.Index(fields=['group', '-ended_at']),
+            models.Index(fields=['-ended_at']),
+        ]
+
+    def __str__(self):
+        return f"Game {self.pk} of room {self.room_id}"
+
+
+class GamePlayer(models.Model):
+    """Final result of a player in a game."""
+    session = models.ForeignKey(GameSession, on_delete=models.CASCADE, related_name='players')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='game_results')
+    score = models.IntegerField()
+    rank = models.PositiveIntegerField()
+    # False if eliminated or gone at the end of the game
+    is_active = models.BooleanField()
+    # Copy of the session's, for the per-user history index
+    ended_at = models.DateTimeField()
+
+    class Meta:
+        unique_together = ('session', 'user')
+        indexes = [
+            models.Index(fields=['user', '-ended_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} in game {self.session_id}: {self.score}"
+
+
+class AnswerRecord(models.Model):
+    """An answer given during a game."""
+    session = models.ForeignKey(GameSession, on_delete=models.CASCADE, related_name='answers')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='answer_records')
+    question_index = models.PositiveIntegerField()
+    # external_id of the QuizQuestion, which may be gone from the bank since
+    question_id = models.CharField(max_length=64, blank=True, default='')
+    answer = models.CharField(max_length=255, blank=True, default='')
+    correct = models.BooleanField()
+    points = models.IntegerField()
+    # Time between the question being sent and the answer, in milliseconds
+    response_ms = models.PositiveIntegerField()
+    answered_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['session', 'question_index']),
+            models.Index(fields=['user', '-answered_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} on question {self.question_index} of game {self.session_id}"
@@ -0,0 +1,103 @@
+"""
+Display data of the players (username, avatar type) used in game broadcasts.
+
+The data is loaded in one query when a game starts and stored with the game
+state, so leaderboard broadcasts don't hit the database. Ids missing from the
+game state are resolved in a single bulk query through the ``PlayerDirectory``
+of the process, whose entries are dropped by the signals below whenever the
+username or the avatar type of a player changes.
+"""
+import logging
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from authentication.models import Profile
+from mindvswild.executor import run_sync
+
+logger = logging.getLogger(__name__)
+
+UNKNOWN_PLAYER = {'username': "Utilisateur inconnu", 'avatar_type': 1}
+
+# Group joined by the command channel of every worker running engines
+PLAYERS_GROUP = 'quiz.players'
+
+
+def load_players(user_ids):
+    """Fetch the display data of ``user_ids`` with a single query."""
+    rows = User.objects.filter(id__in=user_ids).values_list(
+        'id', 'username', 'auth_profile__profile_picture_type'
+    )
+    return {uid: {'username': username, 'avatar_type': avatar_type or 1} for uid, username, avatar_type in rows}
+
+
+def players_table(players):
+    """Player table sent to the clients with the game, from user id -> display data."""
+    return [{'user_id': uid, 'username': data['username']} for uid, data in players.items()]
+
+
+class PlayerDirectory:
+    """Process-local cache of player display data."""
+
+    def __init__(self):
+        self.players = {}
+
+    async def resolve(self, user_ids):
+        """Return the display data of every id, querying only the unknown ones."""
+        missing = [uid for uid in user_ids if uid not in self.players]
+        if missing:
+            self.players.update(await run_sync(load_players, missing))
+        return {uid: self.players.get(uid, UNKNOWN_PLAYER) for uid in user_ids}
+
+    def invalidate(self, user_id):
+        self.players.pop(user_id, None)
+
+
+directory = PlayerDirectory()
+
+
+def _notify_player_changed(user_id):
+    directory.invalidate(user_id)
+    try:
+        async_to_sync(get_channel_layer().group_send)(PLAYERS_GROUP, {
+            'type': 'player.changed', 'user_id': user_id
+        })
+    except Exception:
+        logger.exception("Could not notify the game engines that user %s changed", user_id)
+
+
+# Field of each model that the games display
+DISPLAY_FIELDS = {User: 'username', Profile: 'profile_picture_type'}
+
+
+@receiver(pre_save, sender=User)
+@receiver(pre_save, sender=Profile)
+def check_display_changed(sender, instance, raw=False, update_fields=None, **kwargs):
+    """Flag the saves that change the display data, not every login or password change."""
+    field = DISPLAY_FIELDS[sender]
+    if raw or instance._state.adding:
+        # Nobody cached a new user, a new profile replaces the default avatar
+        instance._display_changed = sender is Profile
+    elif update_fields is not None:
+        instance._display_changed = field in update_fields
+    else:
+        previous = sender._default_manager.filter(pk=instance.pk).values_list(field, flat=True).first()
+        instance._display_changed = previous != getattr(instance, field)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def user_changed(sender, instance, signal, **kwargs):
+    if signal is post_delete or instance._display_changed:
+        transaction.on_commit(lambda: _notify_player_changed(instance.pk))
+
+
+@receiver(post_save, sender=Profile)
+@receiver(post_delete, sender=Profile)
+def profile_changed(sender, instance, signal, **kwargs):
+    if signal is post_delete or instance._display_changed:
+        transaction.on_commit(lambda: _notify_player_changed(instance.user_id))
@@ -0,0 +1,162 @@
+"""
+Encoding of the messages sent to the quiz WebSockets.
+
+A broadcast is encoded once by its sender and travels through the channel layer
+as a ready-made text frame, which every consumer of the group forwards as is
+instead of encoding the same payload again for its own socket. orjson is used
+when it is installed.
+
+JSON is the default protocol. Clients asking for the ``COMPACT_SUBPROTOCOL``
+WebSocket subprotocol get binary MessagePack frames instead: the action is an
+integer (``MESSAGE_TYPES``) and score rows are ``[user_id, score, rank,
+is_active]`` arrays without the username, which clients look up in the player
+table sent with ``game_starting`` and ``game_state``. Consumers transcode the
+JSON frames of the broadcasts with a process-wide cache, so a broadcast is
+transcoded once per worker rather than once per socket. Messages from the
+clients are the same objects as in JSON, MessagePack encoded.
+
+Consumers batch the events they receive within ``QUIZ_BATCH_WINDOW`` seconds
+into one frame: ``{"action": "batch", "events": [...]}`` in JSON, type
+``MESSAGE_TYPES['batch']`` with an ``events`` array in the compact protocol.
+JSON clients asking for ``DEFLATE_SUBPROTOCOL`` get the frames of at least
+``QUIZ_COMPRESS_MIN_SIZE`` bytes as binary raw deflate frames (Daphne has no
+permessage-deflate), compressed once per worker as well.
+"""
+import functools
+import json
+import time
+import zlib
+
+import msgpack
+from django.conf import settings
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+COMPACT_SUBPROTOCOL = 'mindvswild.msgpack.v1'
+DEFLATE_SUBPROTOCOL = 'mindvswild.json.deflate.v1'
+
+MESSAGE_TYPES = {
+    'error': 0,
+    'game_state': 1,
+    'game_starting': 2,
+    'participant_joined': 3,
+    'participant_left': 4,
+    'new_question': 5,
+    'answer_result': 6,
+    'scores_update': 7,
+    'scores_delta': 8,
+    'game_over': 9,
+    'clock_sync': 10,
+    'batch': 11,
+}
+
+# Counters of all the sockets of the process
+stats = {
+    'frames': 0,
+    'batches': 0,
+    'batched_events': 0,
+    'compressed': 0,
+    'compress_bytes_in': 0,
+    'compress_bytes_out': 0,
+    'compress_cpu_seconds': 0.0,
+}
+
+
+def dumps(payload):
+    """Encode a payload as a JSON text frame."""
+    if orjson is not None:
+        return orjson.dumps(payload, option=orjson.OPT_NON_STR_KEYS).decode()
+    return json.dumps(payload)
+
+
+def frame(payload):
+    """Channel layer event delivering ``payload`` to a consumer."""
+    return {'type': 'send_frame', 'text': dumps(payload)}
+
+
+def server_time():
+    """Server clock in epoch milliseconds, used for question deadlines and clock sync."""
+    return int(time.time() * 1000)
+
+
+def loads(text):
+    if orjson is not None:
+        return orjson.loads(text)
+    return json.loads(text)
+
+
+def compact_rows(rows):
+    return [
+        [row['user_id'], row['score'], row.get('rank', rank), row['is_active']]
+        for rank, row in enumerate(rows, start=1)
+    ]
+
+
+def compact(payload):
+    """Compact form of a payload: integer type under ``t``, score rows as arrays."""
+    if 'action' not in payload:
+        return {'t': MESSAGE_TYPES['error'], **payload}
+    message = {key: value for key, value in payload.items() if key != 'action'}
+    message['t'] = MESSAGE_TYPES[payload['action']]
+    if 'scores' in message and isinstance(message['scores'], list):
+        message['scores'] = compact_rows(message['scores'])
+    if isinstance(message.get('state'), dict) and isinstance(message['state'].get('scores'), list):
+        message['state'] = {**message['state'], 'scores': compact_rows(message['state']['scores'])}
+    if 'final_scores' in message:
+        message['final_scores'] = compact_rows(message['final_scores'])
+    if 'changes' in message:
+        message['changes'] = compact_rows(message['changes'])
+        message['ranks'] = [[row['user_id'], row['rank']] for row in message['ranks']]
+    if 'players' in message:
+        message['players'] = [[player['user_id'], player['username']] for player in message['players']]
+    return message
+
+
+def pack(payload):
+    """Encode a payload as a compact binary frame."""
+    return msgpack.packb(compact(payload), use_bin_type=True)
+
+
+@functools.lru_cache(maxsize=1024)
+def transcode(text):
+    """Compact binary frame of an encoded JSON frame, shared by the consumers of the process."""
+    return pack(loads(text))
+
+
+def batch_text(texts):
+    """JSON batch frame of encoded JSON frames, without decoding them."""
+    return '{"action":"batch","events":[%s]}' % ','.join(texts)
+
+
+def batch_binary(frames):
+    """Compact batch frame of compact frames, without decoding them."""
+    packer = msgpack.Packer()
+    return b''.join([
+        packer.pack_map_header(2),
+        packer.pack('t'), packer.pack(MESSAGE_TYPES['batch']),
+        packer.pack('events'), packer.pack_array_header(len(frames)),
+        *frames,
+    ])
+
+
+@functools.lru_cache(maxsize=1024)
+def deflate(text):
+    """Raw deflate of a JSON frame, shared by the consumers of the process."""
+    start = time.process_time()
+    data = text.encode()
+    compressor = zlib.compressobj(settings.QUIZ_COMPRESS_LEVEL, zlib.DEFLATED, -zlib.MAX_WBITS)
+    compressed = compressor.compress(data) + compressor.flush()
+    stats['compressed'] += 1
+    stats['compress_bytes_in'] += len(data)
+    stats['compress_bytes_out'] += len(compressed)
+    stats['compress_cpu_seconds'] += time.process_time() - start
+    return compressed
+
+
+def compression_metrics():
+    """Counters plus the compression ratio (compressed / original size) of the process."""
+    ratio = stats['compress_bytes_out'] / stats['compress_bytes_in'] if stats['compress_bytes_in'] else None
+    return {**stats, 'compression_ratio': ratio}
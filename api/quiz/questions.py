@@ -0,0 +1,101 @@
+"""
+Local question bank.
+
+Games draw their questions from ``QuizQuestion`` with a single indexed query on
+``(category, random_key)`` instead of calling the upstream quiz API at game
+start. The upstream API only refills the bank: in the background when a
+category runs low, or right away the first time a category is asked for.
+When the API is down the games are served from what the bank already holds.
+"""
+import asyncio
+import logging
+import random
+
+from django.conf import settings
+
+from mindvswild.executor import run_sync
+from .models import QuizQuestion
+from .upstream import CircuitOpenError, quiz_api
+
+logger = logging.getLogger(__name__)
+
+
+def sample_questions(count, category=None):
+    """Pick ``count`` random questions of the category from the bank."""
+    queryset = QuizQuestion.objects.all()
+    if category:
+        queryset = queryset.filter(category=category)
+    start = random.random()
+    questions = list(queryset.filter(random_key__gte=start).order_by('random_key')[:count])
+    if len(questions) < count:
+        # Wrap around the start of the key space
+        questions += queryset.filter(random_key__lt=start).order_by('random_key')[:count - len(questions)]
+    random.shuffle(questions)
+    return [question.to_quiz() for question in questions]
+
+
+def count_questions(category=None):
+    queryset = QuizQuestion.objects.all()
+    if category:
+        queryset = queryset.filter(category=category)
+    return queryset.count()
+
+
+def store_questions(quizzes, category=None):
+    """Add the questions returned by the upstream API to the bank, skipping known ones."""
+    questions = [
+        QuizQuestion(
+            external_id=quiz['_id'],
+            category=category or quiz.get('category', ''),
+            difficulty=quiz.get('difficulty', ''),
+            text=quiz['question'],
+            answer=quiz['answer'],
+            bad_answers=quiz['badAnswers'],
+        )
+        for quiz in quizzes
+        if quiz.get('_id') and quiz.get('question') and quiz.get('answer') and quiz.get('badAnswers')
+    ]
+    QuizQuestion.objects.bulk_create(questions, ignore_conflicts=True)
+    return len(questions)
+
+
+class QuestionBank:
+    def __init__(self):
+        # Background refills in progress, by category
+        self.refills = {}
+
+    async def take(self, count, category=None):
+        """Return ``count`` questions of the category (fewer if even the upstream API has no more)."""
+        questions = await run_sync(sample_questions, count, category)
+        if len(questions) < count:
+            # First game of the category: wait for the pool to be filled
+            await self.refill(category)
+            questions = await run_sync(sample_questions, count, category)
+        self.prefetch(category)
+        return questions
+
+    def prefetch(self, category=None):
+        """Refill the category in the background if it runs low."""
+        if category not in self.refills:
+            self.refills[category] = asyncio.create_task(self._prefetch(category))
+
+    async def _prefetch(self, category):
+        try:
+            if await run_sync(count_questions, category) < settings.QUIZ_BANK_MIN_SIZE:
+                await self.refill(category)
+        finally:
+            self.refills.pop(category, None)
+
+    async def refill(self, category=None):
+        try:
+            quizzes = await quiz_api.fetch_quizzes(settings.QUIZ_BANK_REFILL_SIZE, category)
+        except CircuitOpenError:
+            logger.info("Quiz API circuit open, question bank not refilled (category %s)", category)
+            return 0
+        except Exception:
+            logger.exception("Could not refill the question bank (category %s)", category)
+            return 0
+        return await run_sync(store_questions, quizzes, category)
+
+
+question_bank = QuestionBank()
@@ -0,0 +1,30 @@
+"""
+Per-connection rate limiting of the messages of the quiz WebSockets.
+
+A player sends a handful of messages per question (an answer, a clock sync).
+Each socket has a ``TokenBucket`` letting ``QUIZ_WS_RATE_BURST`` messages
+through at once and ``QUIZ_WS_RATE`` per second afterwards: the consumer drops
+the messages beyond that before decoding them, so a flooding client costs a
+clock read per message instead of a command to the room's engine.
+"""
+import time
+
+from django.conf import settings
+
+
+class TokenBucket:
+    def __init__(self, rate=None, burst=None):
+        self.rate = settings.QUIZ_WS_RATE if rate is None else rate
+        self.burst = settings.QUIZ_WS_RATE_BURST if burst is None else burst
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def allow(self, cost=1):
+        """Take ``cost`` tokens, return False (taking none) if there aren't enough."""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < cost:
+            return False
+        self.tokens -= cost
+        return True
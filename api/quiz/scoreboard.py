@@ -0,0 +1,69 @@
+"""
+Coalesced scoreboard broadcasting.
+
+Every answer used to broadcast the whole sorted scoreboard, so a burst of N
+answers meant N full scoreboards sent to N sockets. A room's ``Scoreboard``
+collects the requests made during ``QUIZ_SCORE_BROADCAST_WINDOW`` seconds into
+a single broadcast containing only the rows that changed and the rank moves,
+with a full snapshot every ``QUIZ_SCORE_SNAPSHOT_EVERY`` broadcasts so clients
+can resync.
+"""
+from django.conf import settings
+
+# Counters of all the rooms of the process
+stats = {
+    'requested': 0,
+    'suppressed': 0,
+    'full': 0,
+    'delta': 0,
+}
+
+
+def ranked(rows):
+    """Rows of a sorted scoreboard with their rank."""
+    return [{**row, 'rank': rank} for rank, row in enumerate(rows, start=1)]
+
+
+class Scoreboard:
+    def __init__(self, snapshot_every=None):
+        self.snapshot_every = snapshot_every or settings.QUIZ_SCORE_SNAPSHOT_EVERY
+        # user id -> row as last sent to the clients
+        self.sent = {}
+        self.pending = False
+        self.deltas_since_snapshot = 0
+
+    def request(self):
+        """Ask for a broadcast, return True if the caller must schedule the flush."""
+        stats['requested'] += 1
+        if self.pending:
+            stats['suppressed'] += 1
+            return False
+        self.pending = True
+        return True
+
+    def flush(self, rows, full=False):
+        """Build the message for ``rows`` (sorted scoreboard), None if nothing changed."""
+        self.pending = False
+        rows = ranked(rows)
+        previous, self.sent = self.sent, {row['user_id']: row for row in rows}
+
+        if full or not previous or self.deltas_since_snapshot >= self.snapshot_every:
+            self.deltas_since_snapshot = 0
+            stats['full'] += 1
+            return {'action': 'scores_update', 'scores': rows}
+
+        changes = []
+        ranks = []
+        for row in rows:
+            old = previous.get(row['user_id'])
+            if old is None or old['score'] != row['score'] or old['is_active'] != row['is_active']:
+                changes.append(row)
+            elif old['rank'] != row['rank']:
+                ranks.append({'user_id': row['user_id'], 'rank': row['rank']})
+        if not changes and not ranks:
+            stats['suppressed'] += 1
+            return None
+
+        self.deltas_since_snapshot += 1
+        stats['delta'] += 1
+        return {'action': 'scores_delta', 'changes': changes, 'ranks': ranks}
@@ -0,0 +1,166 @@
+"""
+Room affinity across the workers (``QUIZ_ROOM_AFFINITY``).
+
+Workers announce their command channel in a routing table, a Redis sorted set
+scored by their last heartbeat. A room id hashes to one of the live workers
+with rendezvous hashing, the room's owner: when no engine runs a room, its
+commands are forwarded to the owner, which starts the engine. The game logic
+of a room thus runs on its owner, unless the workers change in the middle of a
+game (a running engine keeps its lease until the game ends).
+
+Broadcasts travel once per worker instead of once per socket: the sockets of a
+room register in their own process, every worker holding sockets of the room
+joins the room's relay group with its command channel, and hands the frames
+it receives to its local sockets.
+"""
+import asyncio
+import collections
+import hashlib
+import logging
+import time
+
+from channels.layers import get_channel_layer
+from django.conf import settings
+
+from mindvswild.redis_client import get_async_redis
+from .metrics import group_send_seconds
+
+logger = logging.getLogger(__name__)
+
+# Consumers of this process, by room id
+_local_sockets = collections.defaultdict(set)
+
+
+def relay_group(room_id):
+    return f'relay_{room_id}'
+
+
+def weight(worker, room_id):
+    return hashlib.blake2b(f'{worker}:{room_id}'.encode(), digest_size=8).digest()
+
+
+def owner_of(room_id, workers):
+    """Rendezvous hashing: a worker leaving only moves the rooms it owned."""
+    return max(workers, key=lambda worker: weight(worker, room_id), default=None)
+
+
+class InMemoryRouting:
+    """Process-local routing table, for tests and single worker setups."""
+
+    def __init__(self):
+        self.workers = {}
+
+    async def heartbeat(self, worker, now):
+        self.workers[worker] = now
+
+    async def live_workers(self, since):
+        return sorted(worker for worker, seen in self.workers.items() if seen >= since)
+
+    async def remove(self, worker):
+        self.workers.pop(worker, None)
+
+
+class RedisRouting:
+    key = 'quiz:workers'
+
+    def __init__(self, client=None):
+        self.client = client or get_async_redis()
+
+    async def heartbeat(self, worker, now):
+        async with self.client.pipeline(transaction=False) as pipe:
+            pipe.zadd(self.key, {worker: now})
+            # Forget the workers gone for long
+            pipe.zremrangebyscore(self.key, '-inf', now - 100 * settings.QUIZ_WORKER_HEARTBEAT)
+            await pipe.execute()
+
+    async def live_workers(self, since):
+        return await self.client.zrangebyscore(self.key, since, '+inf')
+
+    async def remove(self, worker):
+        await self.client.zrem(self.key, worker)
+
+
+_BACKENDS = {
+    'memory': InMemoryRouting,
+    'redis': RedisRouting,
+}
+
+
+class Router:
+    """This worker's view of the routing table, refreshed with its heartbeat."""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.worker = None
+        self.workers = []
+        self.task = None
+
+    async def start(self, worker):
+        self.worker = worker
+        await self.beat()
+        self.task = asyncio.create_task(self.run())
+
+    async def beat(self):
+        now = time.time()
+        await self.backend.heartbeat(self.worker, now)
+        # Workers missing three heartbeats are considered gone
+        self.workers = await self.backend.live_workers(now - 3 * settings.QUIZ_WORKER_HEARTBEAT)
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(settings.QUIZ_WORKER_HEARTBEAT)
+            try:
+                await self.beat()
+            except Exception:
+                logger.exception("Could not refresh the worker routing table")
+
+    def owner(self, room_id):
+        return owner_of(str(room_id), self.workers) or self.worker
+
+
+_router = None
+
+
+def get_router():
+    """Return the router matching ``settings.QUIZ_GAME_STORE``."""
+    global _router
+    if _router is None:
+        _router = Router(_BACKENDS[settings.QUIZ_GAME_STORE]())
+    return _router
+
+
+async def attach(room_id, consumer, worker_channel):
+    """Register a socket of the room in this process."""
+    sockets = _local_sockets[str(room_id)]
+    if not sockets:
+        await get_channel_layer().group_add(relay_group(room_id), worker_channel)
+    sockets.add(consumer)
+
+
+async def detach(room_id, consumer, worker_channel):
+    room_id = str(room_id)
+    sockets = _local_sockets.get(room_id)
+    if sockets is None:
+        return
+    sockets.discard(consumer)
+    if not sockets:
+        del _local_sockets[room_id]
+        await get_channel_layer().group_discard(relay_group(room_id), worker_channel)
+
+
+async def deliver(room_id, text):
+    """Hand a frame relayed to this worker to its sockets of the room."""
+    for consumer in list(_local_sockets.get(str(room_id), ())):
+        await consumer.send_encoded(text)
+
+
+async def room_group_send(room_id, event):
+    """Send a room event to all the sockets of the room, through their workers in affinity mode."""
+    layer = get_channel_layer()
+    with group_send_seconds.time():
+        if settings.QUIZ_ROOM_AFFINITY:
+            await layer.group_send(relay_group(room_id), {
+                'type': 'room.frame', 'room_id': str(room_id), 'text': event['text']
+            })
+        else:
+            await layer.group_send(f'room_{room_id}', event)
@@ -0,0 +1,441 @@
+"""
+Live game state shared by every Daphne worker.
+
+The Redis backend keeps the running games next to the channel layer and applies
+every mutation (answer submission, score increment, question advance) with a Lua
+script, so any worker holding a socket of the room can act on the game atomically.
+The in-memory backend has the same semantics and is meant for tests.
+"""
+import json
+import time
+
+from django.conf import settings
+
+from mindvswild.redis_client import get_async_redis
+
+
+class GameStore:
+    """Interface of the game state backends.
+
+    A game snapshot is a dict with the keys ``questions``, ``current_index``,
+    ``timer_duration``, ``started_at`` and ``deadline`` (start of the game and
+    end of the current question, epoch milliseconds), ``elimination_mode``, ``scores``
+    (user id -> score), ``active_players`` and ``answered`` (sets of user ids)
+    and ``players`` (user id -> display data, see ``quiz.players``).
+    The snapshot returned by ``pop_game`` also has ``answers``, the records
+    given to ``submit_answer`` in order, which are persisted once the game ends.
+    """
+
+    async def create_game(self, room_id, questions, players, timer_duration, elimination_mode):
+        """Create the game, return False if one is already running in the room."""
+        raise NotImplementedError
+
+    async def get_game(self, room_id):
+        """Return a snapshot of the game or None."""
+        raise NotImplementedError
+
+    async def pop_game(self, room_id):
+        """Delete the game and return its last snapshot (None if already gone)."""
+        raise NotImplementedError
+
+    async def set_players(self, room_id, players):
+        """Store the display data of players (user id -> dict) with the game."""
+        raise NotImplementedError
+
+    async def submit_answer(self, room_id, user_id, question_index, correct, points=10, record=None):
+        """Record an answer to the question ``question_index``.
+
+        ``record`` (JSON serializable dict) is appended to the answers of the
+        game if the answer is accepted.
+        Return None if the answer is rejected (other question, already answered,
+        unknown player), else ``{'score': int, 'all_answered': bool}``.
+        """
+        raise NotImplementedError
+
+    async def advance_question(self, room_id, from_index, now):
+        """Move from ``from_index`` to the next question, which ends
+        ``timer_duration`` seconds after ``now`` (epoch milliseconds).
+
+        Only the first caller for a given index wins, the others get None.
+        Return ``{'index': int, 'active_count': int, 'deadline': int}``.
+        """
+        raise NotImplementedError
+
+    async def eliminate_unanswered(self, room_id, question_index):
+        """Remove the players who didn't answer, return the active player count."""
+        raise NotImplementedError
+
+    async def set_player_active(self, room_id, user_id, active):
+        """Add or remove a player of the game from the active players.
+
+        Return None if there is no such game or player, else
+        ``{'active_count': int, 'all_answered': bool}``.
+        """
+        raise NotImplementedError
+
+    async def claim_leader(self, room_id, owner, ttl):
+        """Take or renew the lease on the room's game loop for ``ttl`` seconds.
+
+        Return True if ``owner`` holds the lease afterwards.
+        """
+        raise NotImplementedError
+
+    async def get_leader(self, room_id):
+        """Return the owner of the room's lease or None."""
+        raise NotImplementedError
+
+    async def release_leader(self, room_id, owner):
+        """Drop the lease if it is still held by ``owner``."""
+        raise NotImplementedError
+
+    async def running_rooms(self):
+        """Return the ids of the rooms with a game, possibly some whose game expired since."""
+        raise NotImplementedError
+
+
+class InMemoryGameStore(GameStore):
+    """Process-local backend. Methods never await, so every call is atomic."""
+
+    def __init__(self):
+        self.games = {}
+        self.leaders = {}
+
+    async def create_game(self, room_id, questions, players, timer_duration, elimination_mode):
+        room_id = str(room_id)
+        if room_id in self.games:
+            return False
+        self.games[room_id] = {
+            'questions': list(questions),
+            'current_index': -1,
+            'timer_duration': timer_duration,
+            'started_at': int(time.time() * 1000),
+            'deadline': 0,
+            'elimination_mode': elimination_mode,
+            'scores': {int(uid): 0 for uid in players},
+            'active_players': {int(uid) for uid in players},
+            'answered': set(),
+            'players': {},
+            'answers': [],
+        }
+        return True
+
+    def _snapshot(self, game):
+        snapshot = {
+            **game,
+            'scores': dict(game['scores']),
+            'active_players': set(game['active_players']),
+            'answered': set(game['answered']),
+            'players': dict(game['players']),
+        }
+        del snapshot['answers']
+        return snapshot
+
+    async def get_game(self, room_id):
+        game = self.games.get(str(room_id))
+        return self._snapshot(game) if game else None
+
+    async def pop_game(self, room_id):
+        game = self.games.pop(str(room_id), None)
+        if not game:
+            return None
+        return {**self._snapshot(game), 'answers': game['answers']}
+
+    async def set_players(self, room_id, players):
+        game = self.games.get(str(room_id))
+        if game:
+            game['players'].update({int(uid): data for uid, data in players.items()})
+
+    async def submit_answer(self, room_id, user_id, question_index, correct, points=10, record=None):
+        game = self.games.get(str(room_id))
+        user_id = int(user_id)
+        if (not game or game['current_index'] != question_index
+                or user_id not in game['scores'] or user_id in game['answered']):
+            return None
+        game['answered'].add(user_id)
+        if record is not None:
+            game['answers'].append(record)
+        if correct:
+            game['scores'][user_id] += points
+        elif game['elimination_mode']:
+            game['active_players'].discard(user_id)
+        return {
+            'score': game['scores'][user_id],
+            'all_answered': game['answered'].issuperset(game['active_players']),
+        }
+
+    async def advance_question(self, room_id, from_index, now):
+        game = self.games.get(str(room_id))
+        if not game or game['current_index'] != from_index:
+            return None
+        game['current_index'] += 1
+        game['answered'] = set()
+        game['deadline'] = now + game['timer_duration'] * 1000
+        return {
+            'index': game['current_index'],
+            'active_count': len(game['active_players']),
+            'deadline': game['deadline'],
+        }
+
+    async def eliminate_unanswered(self, room_id, question_index):
+        game = self.games.get(str(room_id))
+        if not game or game['current_index'] != question_index:
+            return None
+        game['active_players'] &= game['answered']
+        return len(game['active_players'])
+
+    async def set_player_active(self, room_id, user_id, active):
+        game = self.games.get(str(room_id))
+        user_id = int(user_id)
+        if not game or user_id not in game['scores']:
+            return None
+        if active:
+            game['active_players'].add(user_id)
+        else:
+            game['active_players'].discard(user_id)
+        return {
+            'active_count': len(game['active_players']),
+            'all_answered': game['answered'].issuperset(game['active_players']),
+        }
+
+    async def claim_leader(self, room_id, owner, ttl):
+        room_id = str(room_id)
+        now = time.monotonic()
+        current = self.leaders.get(room_id)
+        if current and current[0] != owner and current[1] > now:
+            return False
+        self.leaders[room_id] = (owner, now + ttl)
+        return True
+
+    async def get_leader(self, room_id):
+        current = self.leaders.get(str(room_id))
+        if current and current[1] > time.monotonic():
+            return current[0]
+        return None
+
+    async def release_leader(self, room_id, owner):
+        room_id = str(room_id)
+        if self.leaders.get(room_id, (None,))[0] == owner:
+            del self.leaders[room_id]
+
+    async def running_rooms(self):
+        return list(self.games)
+
+
+# Every script receives KEYS = meta, scores, active, answered, players, answers and ARGV[1] = ttl.
+_TOUCH = """
+local function touch()
+  for i = 1, #KEYS do redis.call('EXPIRE', KEYS[i], ARGV[1]) end
+end
+"""
+
+_CREATE = _TOUCH + """
+if redis.call('EXISTS', KEYS[1]) == 1 then return 0 end
+redis.call('DEL', KEYS[2], KEYS[3], KEYS[4], KEYS[5], KEYS[6])
+local now = redis.call('TIME')
+redis.call('HSET', KEYS[1], 'questions', ARGV[2], 'current_index', -1, 'timer_duration', ARGV[3],
+           'started_at', string.format('%d', now[1] * 1000 + math.floor(now[2] / 1000)),
+           'deadline', 0, 'elimination_mode', ARGV[4])
+for i = 5, #ARGV do
+  redis.call('HSET', KEYS[2], ARGV[i], 0)
+  redis.call('SADD', KEYS[3], ARGV[i])
+end
+touch()
+return 1
+"""
+
+_SUBMIT = _TOUCH + """
+local idx = redis.call('HGET', KEYS[1], 'current_index')
+if not idx or tonumber(idx) ~= tonumber(ARGV[3]) then return nil end
+if redis.call('HEXISTS', KEYS[2], ARGV[2]) == 0 then return nil end
+if redis.call('SADD', KEYS[4], ARGV[2]) == 0 then return nil end
+if ARGV[6] ~= '' then redis.call('RPUSH', KEYS[6], ARGV[6]) end
+local score
+if ARGV[4] == '1' then
+  score = redis.call('HINCRBY', KEYS[2], ARGV[2], ARGV[5])
+else
+  score = tonumber(redis.call('HGET', KEYS[2], ARGV[2]))
+  if redis.call('HGET', KEYS[1], 'elimination_mode') == '1' then
+    redis.call('SREM', KEYS[3], ARGV[2])
+  end
+end
+touch()
+local pending = #redis.call('SDIFF', KEYS[3], KEYS[4])
+return {score, pending == 0 and 1 or 0}
+"""
+
+_ADVANCE = _TOUCH + """
+local idx = redis.call('HGET', KEYS[1], 'current_index')
+if not idx or tonumber(idx) ~= tonumber(ARGV[2]) then return nil end
+idx = redis.call('HINCRBY', KEYS[1], 'current_index', 1)
+redis.call('DEL', KEYS[4])
+local deadline = tonumber(ARGV[3]) + tonumber(redis.call('HGET', KEYS[1], 'timer_duration')) * 1000
+redis.call('HSET', KEYS[1], 'deadline', deadline)
+touch()
+return {idx, redis.call('SCARD', KEYS[3]), deadline}
+"""
+
+_ELIMINATE = _TOUCH + """
+local idx = redis.call('HGET', KEYS[1], 'current_index')
+if not idx or tonumber(idx) ~= tonumber(ARGV[2]) then return nil end
+redis.call('SINTERSTORE', KEYS[3], KEYS[3], KEYS[4])
+touch()
+return redis.call('SCARD', KEYS[3])
+"""
+
+_SET_ACTIVE = _TOUCH + """
+if redis.call('EXISTS', KEYS[1]) == 0 then return nil end
+if redis.call('HEXISTS', KEYS[2], ARGV[2]) == 0 then return nil end
+if ARGV[3] == '1' then
+  redis.call('SADD', KEYS[3], ARGV[2])
+else
+  redis.call('SREM', KEYS[3], ARGV[2])
+end
+touch()
+local pending = #redis.call('SDIFF', KEYS[3], KEYS[4])
+return {redis.call('SCARD', KEYS[3]), pending == 0 and 1 or 0}
+"""
+
+# Leases: KEYS = lease key, ARGV = owner, ttl in milliseconds
+_CLAIM = """
+local current = redis.call('GET', KEYS[1])
+if current and current ~= ARGV[1] then return 0 end
+redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2])
+return 1
+"""
+
+_RELEASE = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then redis.call('DEL', KEYS[1]) end
+return 1
+"""
+
+
+# Ids of the rooms with a game, for the sweeper of the engines (see quiz.engine)
+GAMES_KEY = 'quiz:games'
+
+
+class RedisGameStore(GameStore):
+    """Backend shared between processes and nodes through Redis."""
+
+    def __init__(self, client=None, ttl=None):
+        self.client = client or get_async_redis()
+        self.ttl = ttl or settings.QUIZ_GAME_TTL
+        self._create = self.client.register_script(_CREATE)
+        self._submit = self.client.register_script(_SUBMIT)
+        self._advance = self.client.register_script(_ADVANCE)
+        self._eliminate = self.client.register_script(_ELIMINATE)
+        self._set_active = self.client.register_script(_SET_ACTIVE)
+        self._claim = self.client.register_script(_CLAIM)
+        self._release = self.client.register_script(_RELEASE)
+
+    def keys(self, room_id):
+        base = f'quiz:game:{room_id}'
+        return [base, f'{base}:scores', f'{base}:active', f'{base}:answered', f'{base}:players', f'{base}:answers']
+
+    async def create_game(self, room_id, questions, players, timer_duration, elimination_mode):
+        created = await self._create(keys=self.keys(room_id), args=[
+            self.ttl, json.dumps(questions), timer_duration, int(elimination_mode), *players
+        ])
+        if created:
+            await self.client.sadd(GAMES_KEY, room_id)
+        return bool(created)
+
+    async def _read(self, room_id, delete):
+        keys = self.keys(room_id)
+        meta_key, scores_key, active_key, answered_key, players_key, answers_key = keys
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.hgetall(meta_key)
+            pipe.hgetall(scores_key)
+            pipe.smembers(active_key)
+            pipe.smembers(answered_key)
+            pipe.hgetall(players_key)
+            if delete:
+                # Only needed once the game ends
+                pipe.lrange(answers_key, 0, -1)
+                pipe.delete(*keys)
+                pipe.srem(GAMES_KEY, room_id)
+            meta, scores, active, answered, players, *rest = await pipe.execute()
+        if not meta:
+            return None
+        snapshot = {
+            'questions': json.loads(meta['questions']),
+            'current_index': int(meta['current_index']),
+            'timer_duration': int(meta['timer_duration']),
+            'started_at': int(meta['started_at']),
+            'deadline': int(meta['deadline']),
+            'elimination_mode': meta['elimination_mode'] == '1',
+            'scores': {int(uid): int(score) for uid, score in scores.items()},
+            'active_players': {int(uid) for uid in active},
+            'answered': {int(uid) for uid in answered},
+            'players': {int(uid): json.loads(data) for uid, data in players.items()},
+        }
+        if delete:
+            snapshot['answers'] = [json.loads(record) for record in rest[0]]
+        return snapshot
+
+    async def get_game(self, room_id):
+        return await self._read(room_id, delete=False)
+
+    async def pop_game(self, room_id):
+        return await self._read(room_id, delete=True)
+
+    async def set_players(self, room_id, players):
+        if not players:
+            return
+        players_key = self.keys(room_id)[4]
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.hset(players_key, mapping={uid: json.dumps(data) for uid, data in players.items()})
+            pipe.expire(players_key, self.ttl)
+            await pipe.execute()
+
+    async def submit_answer(self, room_id, user_id, question_index, correct, points=10, record=None):
+        result = await self._submit(keys=self.keys(room_id), args=[
+            self.ttl, user_id, question_index, int(bool(correct)), points,
+            json.dumps(record) if record is not None else ''
+        ])
+        if result is None:
+            return None
+        return {'score': int(result[0]), 'all_answered': bool(result[1])}
+
+    async def advance_question(self, room_id, from_index, now):
+        result = await self._advance(keys=self.keys(room_id), args=[self.ttl, from_index, now])
+        if result is None:
+            return None
+        return {'index': int(result[0]), 'active_count': int(result[1]), 'deadline': int(result[2])}
+
+    async def eliminate_unanswered(self, room_id, question_index):
+        result = await self._eliminate(keys=self.keys(room_id), args=[self.ttl, question_index])
+        return None if result is None else int(result)
+
+    async def set_player_active(self, room_id, user_id, active):
+        result = await self._set_active(keys=self.keys(room_id), args=[self.ttl, user_id, int(bool(active))])
+        if result is None:
+            return None
+        return {'active_count': int(result[0]), 'all_answered': bool(result[1])}
+
+    async def claim_leader(self, room_id, owner, ttl):
+        claimed = await self._claim(keys=[f'quiz:leader:{room_id}'], args=[owner, int(ttl * 1000)])
+        return bool(claimed)
+
+    async def get_leader(self, room_id):
+        return await self.client.get(f'quiz:leader:{room_id}')
+
+    async def release_leader(self, room_id, owner):
+        await self._release(keys=[f'quiz:leader:{room_id}'], args=[owner])
+
+    async def running_rooms(self):
+        return list(await self.client.smembers(GAMES_KEY))
+
+
+_BACKENDS = {
+    'memory': InMemoryGameStore,
+    'redis': RedisGameStore,
+}
+_store = None
+
+
+def get_game_store():
+    """Return the store configured by ``settings.QUIZ_GAME_STORE``."""
+    global _store
+    if _store is None:
+        _store = _BACKENDS[settings.QUIZ_GAME_STORE]()
+    return _store
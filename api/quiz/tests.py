@@ -1,3 +1,1009 @@
-from django.test import TestCase
+import asyncio
+import contextlib
+import json
+import time
+import zlib
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import aiohttp
+import msgpack
+import redis
+import redis.asyncio as aioredis
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.layers import get_channel_layer
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APITestCase
+
+from authentication.middleware import TokenAuthMiddleware
+from authentication.models import Profile
+from loadtest.stub_api import make_app
+from rooms.lobby import InMemoryLobby
+from rooms.models import Room, RoomUser
+from . import engine as engine_module
+from .engine import dispatch, get_engine_channel
+from .events import InMemoryRoomEvents
+from .history import save_game
+from .leaderboards import InMemoryLeaderboards, board_key
+from .metrics import rejected_messages
+from .models import GameSession, QuizQuestion
+from .players import UNKNOWN_PLAYER, PlayerDirectory, load_players
+from .protocol import (
+    COMPACT_SUBPROTOCOL, DEFLATE_SUBPROTOCOL, MESSAGE_TYPES, batch_binary, deflate, dumps, transcode
+)
+from .questions import QuestionBank
+from .ratelimit import TokenBucket
+from .routing import websocket_urlpatterns
+from .state import InMemoryGameStore, RedisGameStore, get_game_store
+from .upstream import CircuitBreaker, CircuitOpenError, InvalidResponseError, QuizApiClient
+
+QUESTIONS = [{'_id': str(i), 'question': f'q{i}', 'answer': 'A', 'badAnswers': ['B', 'C', 'D']} for i in range(3)]
+
+
+def redis_available():
+    try:
+        return redis.from_url(settings.TEST_REDIS_URL, socket_connect_timeout=0.5).ping()
+    except redis.RedisError:
+        return False
+
+
+@override_settings(QUIZ_GAME_STORE='memory')
+class GameStoreTests(SimpleTestCase):
+    """Semantics of the game store the engines rely on, on the in-memory backend."""
+
+    store_class = InMemoryGameStore
+
+    def setUp(self):
+        patcher = mock.patch('quiz.state._store', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.store = get_game_store()
+
+    async def create_game(self, players=(1, 2, 3), elimination=False):
+        self.assertTrue(await self.store.create_game('1', QUESTIONS, players, 10, elimination))
+        await self.store.advance_question('1', -1, 0)
+
+    def test_backend(self):
+        self.assertIsInstance(self.store, self.store_class)
+
+    async def test_create_once(self):
+        await self.create_game()
+        self.assertFalse(await self.store.create_game('1', QUESTIONS, [1], 10, False))
+
+    async def test_duplicate_answer(self):
+        await self.create_game()
+        result = await self.store.submit_answer('1', 1, 0, True, record={'user_id': 1})
+        self.assertEqual(result, {'score': 10, 'all_answered': False})
+        self.assertIsNone(await self.store.submit_answer('1', 1, 0, True, record={'user_id': 1}))
+        game = await self.store.pop_game('1')
+        self.assertEqual(game['scores'][1], 10)
+        self.assertEqual(game['answers'], [{'user_id': 1}])
+
+    async def test_stale_question_index(self):
+        await self.create_game()
+        await self.store.advance_question('1', 0, 0)
+        self.assertIsNone(await self.store.submit_answer('1', 1, 0, True))
+        self.assertEqual((await self.store.submit_answer('1', 1, 1, True))['score'], 10)
+
+    async def test_unknown_player(self):
+        await self.create_game()
+        self.assertIsNone(await self.store.submit_answer('1', 4, 0, True))
+
+    async def test_all_answered(self):
+        await self.create_game(players=(1, 2))
+        self.assertFalse((await self.store.submit_answer('1', 1, 0, False))['all_answered'])
+        self.assertTrue((await self.store.submit_answer('1', 2, 0, True))['all_answered'])
+
+    async def test_elimination_on_wrong_answer(self):
+        await self.create_game(elimination=True)
+        self.assertEqual(await self.store.submit_answer('1', 1, 0, False), {'score': 0, 'all_answered': False})
+        game = await self.store.get_game('1')
+        self.assertEqual(game['active_players'], {2, 3})
+        # The eliminated player is no longer waited for
+        await self.store.submit_answer('1', 2, 0, True)
+        self.assertTrue((await self.store.submit_answer('1', 3, 0, True))['all_answered'])
+
+    async def test_wrong_answer_without_elimination(self):
+        await self.create_game()
+        await self.store.submit_answer('1', 1, 0, False)
+        self.assertEqual((await self.store.get_game('1'))['active_players'], {1, 2, 3})
+
+    async def test_eliminate_unanswered(self):
+        await self.create_game(elimination=True)
+        await self.store.submit_answer('1', 1, 0, True)
+        self.assertIsNone(await self.store.eliminate_unanswered('1', 1))
+        self.assertEqual(await self.store.eliminate_unanswered('1', 0), 1)
+        self.assertEqual((await self.store.get_game('1'))['active_players'], {1})
+
+    async def test_concurrent_advance(self):
+        await self.create_game()
+        results = await asyncio.gather(*(self.store.advance_question('1', 0, 1000) for _ in range(5)))
+        winners = [result for result in results if result is not None]
+        # Only the first advance away from an index wins
+        self.assertEqual(winners, [{'index': 1, 'active_count': 3, 'deadline': 11000}])
+        self.assertEqual((await self.store.get_game('1'))['current_index'], 1)
+
+    async def test_advance_resets_answers(self):
+        await self.create_game()
+        await self.store.submit_answer('1', 1, 0, True)
+        await self.store.advance_question('1', 0, 0)
+        self.assertEqual((await self.store.get_game('1'))['answered'], set())
+
+    async def test_set_player_active(self):
+        await self.create_game(players=(1, 2))
+        await self.store.submit_answer('1', 1, 0, True)
+        self.assertEqual(await self.store.set_player_active('1', 2, False), {'active_count': 1, 'all_answered': True})
+        self.assertEqual(await self.store.set_player_active('1', 2, True), {'active_count': 2, 'all_answered': False})
+        self.assertIsNone(await self.store.set_player_active('1', 4, True))
+        self.assertIsNone(await self.store.set_player_active('2', 1, True))
+
+    async def test_pop_game(self):
+        await self.create_game()
+        self.assertIsNotNone(await self.store.pop_game('1'))
+        self.assertIsNone(await self.store.pop_game('1'))
+        self.assertIsNone(await self.store.get_game('1'))
+
+    async def test_running_rooms(self):
+        await self.create_game()
+        self.assertEqual(await self.store.running_rooms(), ['1'])
+        await self.store.pop_game('1')
+        self.assertEqual(await self.store.running_rooms(), [])
+
+    async def test_leader_lease(self):
+        self.assertTrue(await self.store.claim_leader('1', 'a', 10))
+        self.assertFalse(await self.store.claim_leader('1', 'b', 10))
+        self.assertEqual(await self.store.get_leader('1'), 'a')
+        await self.store.release_leader('1', 'b')
+        self.assertEqual(await self.store.get_leader('1'), 'a')
+        await self.store.release_leader('1', 'a')
+        self.assertTrue(await self.store.claim_leader('1', 'b', 10))
+
+
+@skipUnless(redis_available(), "No Redis server at TEST_REDIS_URL")
+@override_settings(QUIZ_GAME_STORE='redis')
+class RedisGameStoreTests(GameStoreTests):
+    """The same semantics on the Redis backend and its Lua scripts, against a real server."""
+
+    store_class = RedisGameStore
+
+    def setUp(self):
+        redis.from_url(settings.TEST_REDIS_URL).flushdb()
+        self.addCleanup(lambda: redis.from_url(settings.TEST_REDIS_URL).flushdb())
+        # A client per test: its connections belong to the event loop of the test
+        self.store = RedisGameStore(client=aioredis.from_url(settings.TEST_REDIS_URL, decode_responses=True))
+
+
+@override_settings(QUIZ_EVENT_BUFFER_SIZE=3)
+class RoomEventsTests(SimpleTestCase):
+    """Replay buffer and presence, on the in-memory backend."""
+
+    def setUp(self):
+        self.events = InMemoryRoomEvents()
+
+    async def append(self, count):
+        return [await self.events.append('1', {'action': 'event', 'n': n}) for n in range(count)]
+
+    async def test_sequence_numbers(self):
+        texts = await self.append(2)
+        self.assertEqual([json.loads(text) for text in texts],
+                         [{'seq': 1, 'action': 'event', 'n': 0}, {'seq': 2, 'action': 'event', 'n': 1}])
+        self.assertEqual(await self.events.last_seq('1'), 2)
+
+    async def test_since(self):
+        texts = await self.append(3)
+        self.assertEqual(await self.events.since('1', 1), (3, texts[1:]))
+        self.assertEqual(await self.events.since('1', 0), (3, texts))
+        self.assertEqual(await self.events.since('1', 3), (3, []))
+
+    async def test_since_evicted(self):
+        texts = await self.append(5)
+        self.assertEqual(await self.events.since('1', 2), (5, texts[2:]))
+        self.assertEqual(await self.events.since('1', 1), (5, None))
+
+    async def test_since_ahead(self):
+        await self.append(2)
+        self.assertEqual(await self.events.since('1', 3), (2, None))
+
+    async def test_presence(self):
+        self.assertTrue(await self.events.connect('1', 7))
+        # A second socket of the player
+        self.assertFalse(await self.events.connect('1', 7))
+        await self.events.disconnect('1', 7)
+        self.assertFalse(await self.events.leave_if_gone('1', 7))
+        await self.events.disconnect('1', 7)
+        # Reconnected before the grace period ended
+        self.assertFalse(await self.events.connect('1', 7))
+        await self.events.disconnect('1', 7)
+        self.assertTrue(await self.events.leave_if_gone('1', 7))
+        self.assertTrue(await self.events.connect('1', 7))
+
+
+@override_settings(
+    QUIZ_GAME_STORE='memory',
+    QUIZ_ROOM_AFFINITY=False,
+    QUIZ_RECONNECT_GRACE=0,
+    QUIZ_BATCH_WINDOW=0,
+    CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}},
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+)
+class RoomEngineTests(TransactionTestCase):
+    """Games driven through the room sockets, on the in-memory channel layer and stores."""
+
+    def setUp(self):
+        self.store = InMemoryGameStore()
+        self.directory = PlayerDirectory()
+        self.events = InMemoryRoomEvents()
+        for target, value in [
+            ('quiz.state._store', self.store),
+            ('quiz.events._events', self.events),
+            ('rooms.lobby._lobby', InMemoryLobby()),
+            ('quiz.leaderboards._leaderboards', InMemoryLeaderboards()),
+            ('quiz.engine.directory', self.directory),
+            ('quiz.consumers.directory', self.directory),
+            # Each test runs its own event loop: a new command channel and engines
+            ('quiz.engine._engine_channel', None),
+            ('quiz.engine._relay_task', None),
+            ('quiz.engine._sweeper_task', None),
+            ('quiz.engine._engines', {}),
+            ('quiz.engine.ALL_ANSWERED_DELAY', 0.01),
+        ]:
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch('quiz.engine.question_bank.take', side_effect=self.take_questions)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.engine_tasks = []
+        patcher = mock.patch('quiz.engine.RoomEngine.start', autospec=True, side_effect=self.start_engine)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.admin = User.objects.create_user('admin')
+        self.player = User.objects.create_user('player')
+        self.room = Room.objects.create(name='room', created_by=self.admin)
+        for user in (self.admin, self.player):
+            RoomUser.objects.create(room=self.room, user=user)
+        self.tokens = {user.id: Token.objects.create(user=user).key for user in (self.admin, self.player)}
+        self.application = TokenAuthMiddleware(URLRouter(websocket_urlpatterns))
+
+    def start_engine(self, engine):
+        engine.task = asyncio.create_task(engine.run())
+        self.engine_tasks.append(engine.task)
+
+    async def take_questions(self, count, category=None):
+        return [dict(question) for question in QUESTIONS[:count]]
+
+    async def connect(self, user, query='', subprotocols=None):
+        communicator = WebsocketCommunicator(
+            self.application, f'/ws/room/{self.room.id}/?token={self.tokens[user.id]}{query}', subprotocols=subprotocols
+        )
+        connected, subprotocol = await communicator.connect()
+        self.assertTrue(connected)
+        self.assertEqual(subprotocol, subprotocols[0] if subprotocols else None)
+        return communicator
+
+    async def receive(self, communicator, action, timeout=5):
+        """Events of the socket up to the next one of ``action``, which is returned."""
+        while True:
+            event = json.loads(await communicator.receive_from(timeout))
+            if event.get('action') == action:
+                return event
+
+    async def start(self, admin, **options):
+        await admin.send_json_to({'action': 'start_game', 'options': {'questionCount': 2, **options}})
+
+    async def answer(self, communicator, question, text):
+        await communicator.send_json_to({
+            'action': 'submit_answer', 'question_id': question['id'], 'option': question['options'].index(text)
+        })
+
+    async def play(self, admin, player, admin_answer='A', player_answer='B'):
+        """Answer the next question from both sockets, return the question."""
+        question = (await self.receive(admin, 'new_question'))['question']
+        await self.receive(player, 'new_question')
+        await self.answer(admin, question, admin_answer)
+        await self.answer(player, question, player_answer)
+        return question
+
+    async def leave(self, *communicators):
+        """Close the sockets and wait for the engines to end the game and save it."""
+        # Without waiting for the players to come back
+        with self.settings(QUIZ_RECONNECT_GRACE=0):
+            for communicator in communicators:
+                await communicator.disconnect()
+            await asyncio.wait_for(asyncio.gather(*self.engine_tasks), 5)
+
+    async def drain(self, communicator):
+        """Events received until the socket goes quiet."""
+        events = []
+        # Not receive_from: its timeout kills the consumer
+        while not await communicator.receive_nothing(0.3):
+            events.append(json.loads(await communicator.receive_from()))
+        return events
+
+    async def wait_for_game_end(self):
+        for _ in range(100):
+            if not await self.store.get_game(self.room.id):
+                return
+            await asyncio.sleep(0.05)
+        self.fail("The game did not end")
+
+    async def test_full_game(self):
+        started = time.monotonic()
+        admin, player = await self.connect(self.admin), await self.connect(self.player)
+        await self.start(admin)
+        for _ in range(2):
+            await self.play(admin, player)
+            result = await self.receive(player, 'answer_result')
+            self.assertEqual((result['correct'], result['selected_option'], result['correct_option']),
+                             (False, 'B', 'A'))
+        game_over = await self.receive(admin, 'game_over')
+        self.assertEqual([(row['user_id'], row['score']) for row in game_over['final_scores']],
+                         [(self.admin.id, 20), (self.player.id, 0)])
+        await self.leave(admin, player)
+        elapsed_ms = (time.monotonic() - started) * 1000
+
+        session = await GameSession.objects.aget()
+        self.assertEqual((session.room_id, session.question_count, session.questions_played), (self.room.id, 2, 2))
+        players = [(p.user_id, p.score, p.rank, p.is_active) async for p in session.players.order_by('rank')]
+        self.assertEqual(players, [(self.admin.id, 20, 1, True), (self.player.id, 0, 2, True)])
+        answers = [answer async for answer in session.answers.order_by('question_index', 'user_id')]
+        self.assertEqual(
+            [(a.question_index, a.question_id, a.user_id, a.answer, a.correct, a.points) for a in answers],
+            [(index, str(index), user.id, text, correct, points)
+             for index in range(2)
+             for user, text, correct, points in [(self.admin, 'A', True, 10), (self.player, 'B', False, 0)]]
+        )
+        for answer in answers:
+            self.assertLessEqual(0, answer.response_ms)
+            self.assertLessEqual(answer.response_ms, elapsed_ms)
+
+    async def test_game_state_scores(self):
+        admin, player = await self.connect(self.admin), await self.connect(self.player)
+        await self.start(admin)
+        await self.play(admin, player)
+        await self.receive(admin, 'answer_result')
+        await self.receive(player, 'answer_result')
+        # A second socket of the player gets the snapshot, ranked like the broadcasts
+        snapshot = await self.connect(self.player)
+        state = (await self.receive(snapshot, 'game_state'))['state']
+        self.assertEqual(state['scores'], [
+            {'user_id': self.admin.id, 'username': 'admin', 'score': 10, 'is_active': True, 'rank': 1},
+            {'user_id': self.player.id, 'username': 'player', 'score': 0, 'is_active': True, 'rank': 2},
+        ])
+        await self.leave(snapshot, admin, player)
+
+    async def test_elimination_ends_game(self):
+        admin, player = await self.connect(self.admin), await self.connect(self.player)
+        await self.start(admin, eliminationMode=True, questionCount=3)
+        await self.play(admin, player)
+        # The player answered wrong: a single active player is left after the first question
+        game_over = await self.receive(admin, 'game_over')
+        self.assertEqual([(row['user_id'], row['is_active']) for row in game_over['final_scores']],
+                         [(self.admin.id, True), (self.player.id, False)])
+        await self.leave(admin, player)
+
+    async def test_last_active_player_leaving(self):
+        admin, player = await self.connect(self.admin), await self.connect(self.player)
+        await self.start(admin, eliminationMode=True)
+        await self.receive(admin, 'new_question')
+        await player.disconnect()
+        await self.receive(admin, 'participant_left')
+        await self.receive(admin, 'game_over')
+        await self.leave(admin)
+
+    async def test_everyone_leaving(self):
+        admin, player = await self.connect(self.admin), await self.connect(self.player)
+        await self.start(admin)
+        await self.receive(admin, 'new_question')
+        await self.leave(admin, player)
+        await self.wait_for_game_end()
+
+    async def test_racing_advances(self):
+        admin, player = await self.connect(self.admin), await self.connect(self.player)
+        await self.start(admin)
+        question = (await self.receive(admin, 'new_question'))['question']
+        # Both last answers and the question timer race to move to the next question
+        await asyncio.gather(self.answer(admin, question, 'A'), self.answer(player, question, 'A'))
+        await dispatch(self.room.id, {'type': 'advance', 'index': 0})
+        await dispatch(self.room.id, {'type': 'expire', 'index': 0})
+        questions = []
+        # Not receive_from: its timeout kills the consumer
+        while not await player.receive_nothing(0.5):
+            event = json.loads(await player.receive_from())
+            if event.get('action') == 'new_question':
+                questions.append(event['question']['id'])
+        self.assertEqual(questions, [QUESTIONS[0]['_id'], QUESTIONS[1]['_id']])
+        await self.leave(admin, player)
+
+    async def test_relay_survives_failing_message(self):
+        channel = await get_engine_channel()
+        layer = get_channel_layer()
+        frames = [{'type': 'room.frame', 'room_id': str(self.room.id), 'text': text} for text in ('{}', '{"a": 1}')]
+        with mock.patch('quiz.engine.deliver', side_effect=[RuntimeError, None]) as deliver, \
+                self.assertLogs('quiz.engine', 'ERROR'):
+            for message in frames:
+                await layer.send(channel, message)
+            for _ in range(100):
+                if deliver.await_count == 2:
+                    break
+                await asyncio.sleep(0.01)
+        # The frame after the failing one is still relayed
+        deliver.assert_awaited_with(str(self.room.id), '{"a": 1}')
+        self.assertFalse(engine_module._relay_task.done())
+
+    async def wait_for_rejections(self, communicator, **expected):
+        """Wait for the socket to handle its messages, check the rejections counted meanwhile."""
+        await communicator.receive_nothing(0.2)
+        self.assertEqual({reason: rejected_messages.values.get((reason,), 0) - self.rejected.get(reason, 0)
+                          for reason in expected}, expected)
+
+    async def test_rejected_messages(self):
+        self.rejected = {labels[0]: value for labels, value in rejected_messages.values.items()}
+        admin, player = await self.connect(self.admin), await self.connect(self.player)
+        await self.start(admin)
+        question = (await self.receive(player, 'new_question'))['question']
+        await player.send_to(text_data='x' * (settings.QUIZ_WS_MAX_MESSAGE_SIZE + 1))
+        for message in [
+            'A', [], {'action': 'unknown'},
+            {'action': 'submit_answer', 'question_id': question['id'], 'option': -1},
+            {'action': 'submit_answer', 'question_id': question['id'], 'option': '0'},
+            {'action': 'submit_answer', 'question_id': question['id']},
+        ]:
+            await player.send_to(text_data=json.dumps(message))
+        # An answer to another question is dropped by the engine
+        await self.answer(player, {**question, 'id': 'other'}, 'A')
+        await self.answer(player, question, 'A')
+        await self.answer(player, question, 'B')
+        await self.wait_for_rejections(player, too_large=1, invalid=6, stale=1, duplicate=1)
+        # Only the first answer counted
+        result = await self.receive(player, 'answer_result')
+        self.assertEqual((result['correct'], result['selected_option']), (True, 'A'))
+        await self.leave(admin, player)
+
+    @override_settings(QUIZ_WS_MAX_MESSAGE_SIZE=100)
+    async def test_size_in_bytes(self):
+        self.rejected = {labels[0]: value for labels, value in rejected_messages.values.items()}
+        player = await self.connect(self.player)
+        prefix = '{"action": "clock_sync", "client_time": 0, "name": "'
+        # 2 bytes per character
+        padding = 'é' * ((100 - len(prefix) - 2) // 2)
+        padding += 'e' * (100 - len(prefix) - 2 - len(padding.encode()))
+        message = f'{prefix}{padding}"}}'
+        self.assertEqual(len(message.encode()), 100)
+        await player.send_to(text_data=message)
+        await self.receive(player, 'clock_sync')
+        # One byte over, but still fewer characters than the limit
+        message = f'{prefix}{padding[1:]}ée"}}'
+        self.assertLess(len(message), 100)
+        await player.send_to(text_data=message)
+        await self.wait_for_rejections(player, too_large=1)
+        await self.leave(player)
+
+    @override_settings(QUIZ_WS_RATE=0, QUIZ_WS_RATE_BURST=2)
+    async def test_rate_limited(self):
+        self.rejected = {labels[0]: value for labels, value in rejected_messages.values.items()}
+        player = await self.connect(self.player)
+        for _ in range(3):
+            await player.send_json_to({'action': 'clock_sync', 'client_time': 0})
+        await self.receive(player, 'clock_sync')
+        await self.receive(player, 'clock_sync')
+        await self.wait_for_rejections(player, rate_limited=1)
+        await self.leave(player)
+
+    async def kill_leader(self):
+        """Stop the engine like a dead worker: the lease expires, the game stays."""
+        room_id = str(self.room.id)
+        engine = engine_module._engines[room_id]
+        with mock.patch.object(self.store, 'release_leader'):
+            engine.task.cancel()
+            await asyncio.wait([engine.task])
+        self.engine_tasks.remove(engine.task)
+        self.store.leaders[room_id] = (engine.owner, 0)
+
+    @override_settings(QUIZ_ENGINE_SWEEP_INTERVAL=0.05)
+    async def test_dead_leader_resumed(self):
+        admin, player = await self.connect(self.admin), await self.connect(self.player)
+        await self.start(admin)
+        await self.receive(player, 'new_question')
+        await self.kill_leader()
+        # The question ends while no engine runs and nobody acts
+        self.store.games[str(self.room.id)]['deadline'] = 0
+        question = (await self.receive(player, 'new_question'))['question']
+        self.assertEqual(question['id'], QUESTIONS[1]['_id'])
+        await self.leave(admin, player)
+
+    @override_settings(QUIZ_ENGINE_LEASE_TTL=0.3)
+    async def test_slow_command_keeps_lease(self):
+        async def slow_take(count, category=None):
+            await asyncio.sleep(0.6)
+            return await self.take_questions(count, category)
+
+        admin, player = await self.connect(self.admin), await self.connect(self.player)
+        with mock.patch('quiz.engine.question_bank.take', side_effect=slow_take):
+            await self.start(admin)
+            await asyncio.sleep(0.45)
+            engine = engine_module._engines[str(self.room.id)]
+            self.assertEqual(await self.store.get_leader(self.room.id), engine.owner)
+            await self.receive(admin, 'new_question')
+        await self.leave(admin, player)
+
+    @override_settings(QUIZ_ENGINE_LEASE_TTL=0.3)
+    async def test_lease_lost(self):
+        admin = await self.connect(self.admin)
+        await self.start(admin)
+        await self.receive(admin, 'new_question')
+        engine = engine_module._engines[str(self.room.id)]
+        # Another worker took the room over
+        self.store.leaders[str(self.room.id)] = ('other', time.monotonic() + 60)
+        await asyncio.wait_for(asyncio.wait([engine.task]), 5)
+        self.assertTrue(engine.task.cancelled())
+        self.assertNotIn(str(self.room.id), engine_module._engines)
+        self.engine_tasks.remove(engine.task)
+        await self.leave(admin)
+
+    async def missed_events(self):
+        """Disconnect the player, broadcast scores meanwhile.
+
+        Return the sequence number of the player's last event and the admin's socket."""
+        admin, player = await self.connect(self.admin), await self.connect(self.player)
+        await self.start(admin)
+        question = (await self.receive(admin, 'new_question'))['question']
+        last_seq = (await self.receive(player, 'new_question'))['seq']
+        await player.disconnect()
+        await self.answer(admin, question, 'A')
+        await self.drain(admin)
+        return last_seq, admin
+
+    @override_settings(QUIZ_RECONNECT_GRACE=5)
+    async def test_replay_missed_events(self):
+        last_seq, admin = await self.missed_events()
+        player = await self.connect(self.player, f'&last_seq={last_seq}')
+        events = await self.drain(player)
+        # Every event since the last one the client got, in order
+        last = await self.events.last_seq(self.room.id)
+        self.assertGreater(last, last_seq)
+        self.assertEqual([event['seq'] for event in events], list(range(last_seq + 1, last + 1)))
+        self.assertNotIn('game_state', [event['action'] for event in events])
+        await self.leave(admin, player)
+
+    @override_settings(QUIZ_RECONNECT_GRACE=5, QUIZ_EVENT_BUFFER_SIZE=1)
+    async def test_replay_evicted(self):
+        _, admin = await self.missed_events()
+        # Only the last event is kept
+        player = await self.connect(self.player, '&last_seq=1')
+        self.assertEqual([event['action'] for event in await self.drain(player)], ['game_state'])
+        await self.leave(admin, player)
+
+    @override_settings(QUIZ_RECONNECT_GRACE=5)
+    async def test_replay_ahead(self):
+        _, admin = await self.missed_events()
+        player = await self.connect(self.player, '&last_seq=1000')
+        events = await self.drain(player)
+        self.assertEqual([event['action'] for event in events], ['game_state'])
+        self.assertEqual(events[0]['seq'], await self.events.last_seq(self.room.id))
+        await self.leave(admin, player)
+
+    @override_settings(QUIZ_RECONNECT_GRACE=0.3)
+    async def test_reconnect_within_grace(self):
+        admin, player = await self.connect(self.admin), await self.connect(self.player)
+        await self.start(admin)
+        await self.receive(player, 'new_question')
+        await self.drain(admin)
+        await player.disconnect()
+        player = await self.connect(self.player)
+        await asyncio.sleep(0.5)
+        actions = [event['action'] for event in await self.drain(admin)]
+        self.assertNotIn('participant_left', actions)
+        self.assertNotIn('participant_joined', actions)
+        self.assertIn(self.player.id, (await self.store.get_game(self.room.id))['active_players'])
+        await self.leave(admin, player)
+
+    @override_settings(QUIZ_RECONNECT_GRACE=0.1)
+    async def test_disconnect_past_grace(self):
+        admin, player = await self.connect(self.admin), await self.connect(self.player)
+        await self.start(admin)
+        await self.receive(player, 'new_question')
+        await player.disconnect()
+        left = await self.receive(admin, 'participant_left')
+        self.assertEqual((left['user_id'], left['username']), (self.player.id, 'player'))
+        await asyncio.sleep(0.1)
+        self.assertNotIn(self.player.id, (await self.store.get_game(self.room.id))['active_players'])
+        await self.leave(admin)
+
+    async def test_removed_player_refused(self):
+        player = await self.connect(self.player)
+        await player.disconnect()
+        await sync_to_async(RoomUser.objects.filter(room=self.room, user=self.player).delete)()
+        communicator = WebsocketCommunicator(
+            self.application, f'/ws/room/{self.room.id}/?token={self.tokens[self.player.id]}'
+        )
+        connected, _ = await communicator.connect()
+        self.assertFalse(connected)
+
+    async def test_compact_protocol(self):
+        admin = await self.connect(self.admin, subprotocols=[COMPACT_SUBPROTOCOL])
+        player = await self.connect(self.player)
+        # The messages of the client are MessagePack encoded too
+        await admin.send_to(bytes_data=msgpack.packb({'action': 'start_game', 'options': {'questionCount': 2}}))
+        question = (await self.receive(player, 'new_question'))['question']
+        messages = {}
+        while not await admin.receive_nothing(0.3):
+            message = msgpack.unpackb(await admin.receive_from())
+            messages[message.pop('t')] = message
+        self.assertCountEqual(messages[MESSAGE_TYPES['game_starting']]['players'],
+                              [[self.admin.id, 'admin'], [self.player.id, 'player']])
+        self.assertEqual(messages[MESSAGE_TYPES['scores_update']]['scores'],
+                         [[self.admin.id, 0, 1, True], [self.player.id, 0, 2, True]])
+        self.assertEqual(messages[MESSAGE_TYPES['new_question']]['question'], question)
+        await self.leave(admin, player)
+
+    @override_settings(QUIZ_COMPRESS_MIN_SIZE=100)
+    async def test_deflate_protocol(self):
+        admin = await self.connect(self.admin)
+        player = await self.connect(self.player, subprotocols=[DEFLATE_SUBPROTOCOL])
+        await self.drain(player)
+        await self.start(admin)
+        await player.send_json_to({'action': 'clock_sync', 'client_time': 1})
+        actions, compressed = [], []
+        while not await player.receive_nothing(0.3):
+            output = await player.receive_output()
+            if output.get('bytes') is not None:
+                text = zlib.decompressobj(-zlib.MAX_WBITS).decompress(output['bytes']).decode()
+                self.assertGreaterEqual(len(text), 100)
+                compressed.append(json.loads(text)['action'])
+            else:
+                text = output['text']
+                self.assertLess(len(text), 100)
+            actions.append(json.loads(text)['action'])
+        self.assertIn('clock_sync', actions)
+        self.assertNotIn('clock_sync', compressed)
+        self.assertIn('new_question', compressed)
+        await self.leave(admin, player)
+
+    @override_settings(QUIZ_BATCH_WINDOW=0.2)
+    async def test_batch_window(self):
+        admin = await self.connect(self.admin)
+        player = await self.connect(self.player)
+        await self.drain(admin)
+        await self.drain(player)
+        await self.start(admin)
+        batch = await player.receive_json_from()
+        self.assertEqual(batch['action'], 'batch')
+        self.assertEqual(batch['events'][0]['action'], 'game_starting')
+        self.assertGreater(len(batch['events']), 1)
+        await self.drain(player)
+        # Sent before the end of the window, on its own
+        await player.send_json_to({'action': 'clock_sync', 'client_time': 1})
+        self.assertFalse(await player.receive_nothing(0.1))
+        self.assertEqual((await player.receive_json_from())['action'], 'clock_sync')
+        await self.leave(admin, player)
+
+    async def test_start_while_engine_stops(self):
+        # Commands queued on an engine ending its game go to the next engine
+        def slow_save_game(*args):
+            time.sleep(0.5)
+            return save_game(*args)
+
+        admin, player = await self.connect(self.admin), await self.connect(self.player)
+        with mock.patch('quiz.engine.save_game', slow_save_game):
+            await self.start(admin, questionCount=1)
+            await self.play(admin, player)
+            await self.receive(admin, 'game_over')
+            await self.start(admin, questionCount=1)
+            await self.receive(admin, 'game_starting')
+            await self.receive(admin, 'new_question')
+        await self.leave(admin, player)
+
+
+class PlayerDirectoryTests(TransactionTestCase):
+    def setUp(self):
+        self.directory = PlayerDirectory()
+        patcher = mock.patch('quiz.players.directory', self.directory)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = User.objects.create_user('alice')
+        self.profile = Profile.objects.create(user=self.user, profile_picture_type=2)
+
+    def resolve(self):
+        return async_to_sync(self.directory.resolve)([self.user.id])[self.user.id]
+
+    def test_second_lookup_cached(self):
+        with mock.patch('quiz.players.load_players', wraps=load_players) as load:
+            self.assertEqual(self.resolve(), {'username': 'alice', 'avatar_type': 2})
+            self.assertEqual(self.resolve(), {'username': 'alice', 'avatar_type': 2})
+        load.assert_called_once_with([self.user.id])
+
+    def test_rename_invalidates(self):
+        self.resolve()
+        self.user.username = 'bob'
+        self.user.save()
+        self.assertEqual(self.resolve()['username'], 'bob')
+
+    def test_avatar_change_invalidates(self):
+        self.resolve()
+        self.profile.profile_picture_type = 3
+        self.profile.save(update_fields=['profile_picture_type'])
+        self.assertEqual(self.resolve()['avatar_type'], 3)
+
+    def test_other_changes_keep_entry(self):
+        self.resolve()
+        # Every login saves the user
+        self.user.last_login = timezone.now()
+        self.user.save(update_fields=['last_login'])
+        self.user.set_password('password123')
+        self.user.save()
+        self.profile.save()
+        self.assertIn(self.user.id, self.directory.players)
+
+    def test_deletion_invalidates(self):
+        self.resolve()
+        self.user.save(update_fields=['last_login'])
+        self.user.delete()
+        self.assertEqual(self.resolve(), UNKNOWN_PLAYER)
+
+
+@override_settings(QUIZ_BANK_MIN_SIZE=10, QUIZ_BANK_REFILL_SIZE=20, QUIZ_API_RETRIES=0)
+class QuestionBankTests(TransactionTestCase):
+    """Questions served from the bank, refilled from a stub of the upstream API."""
+
+    def setUp(self):
+        self.bank = QuestionBank()
+        self.api = QuizApiClient()
+        patcher = mock.patch('quiz.questions.quiz_api', self.api)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def add_questions(self, count, category):
+        QuizQuestion.objects.bulk_create(
+            QuizQuestion(external_id=f'{category}-{i}', category=category, text=f'q{i}', answer='A',
+                         bad_answers=['B', 'C', 'D'])
+            for i in range(count)
+        )
+
+    @contextlib.asynccontextmanager
+    async def upstream(self, down=False):
+        """Serve the stub of the upstream API at QUIZ_API_URL (closed port if ``down``)."""
+        async with TestServer(make_app()) as server:
+            url = str(server.make_url('/quiz'))
+            if down:
+                await server.close()
+            with self.settings(QUIZ_API_URL=url):
+                yield
+
+    async def take(self, count, category=None):
+        """Questions of the bank once its refills ended, and the upstream requests made so far."""
+        questions = await self.bank.take(count, category)
+        await asyncio.gather(*self.bank.refills.values())
+        await self.api.close()
+        return questions, self.api.stats['requests']
+
+    async def test_sampling(self):
+        await sync_to_async(self.add_questions)(15, 'histoire')
+        await sync_to_async(self.add_questions)(15, 'science')
+        async with self.upstream():
+            questions, requests = await self.take(5, 'histoire')
+        self.assertEqual(len({question['_id'] for question in questions}), 5)
+        self.assertEqual({question['category'] for question in questions}, {'histoire'})
+        # Enough questions in the bank, the upstream API isn't called
+        self.assertEqual(requests, 0)
+
+    async def test_first_use_refill(self):
+        async with self.upstream():
+            questions, requests = await self.take(3, 'science')
+        self.assertEqual(len(questions), 3)
+        self.assertEqual({question['category'] for question in questions}, {'science'})
+        self.assertEqual(requests, 1)
+        self.assertEqual(await QuizQuestion.objects.filter(category='science').acount(), 20)
+
+    async def test_low_bank_refilled_in_background(self):
+        await sync_to_async(self.add_questions)(5, 'science')
+        async with self.upstream():
+            questions, requests = await self.take(3, 'science')
+        self.assertEqual(len(questions), 3)
+        self.assertEqual(requests, 1)
+        self.assertEqual(await QuizQuestion.objects.filter(category='science').acount(), 25)
+
+    async def test_upstream_down(self):
+        await sync_to_async(self.add_questions)(5, 'science')
+        async with self.upstream(down=True):
+            questions, requests = await self.take(3, 'science')
+            self.assertEqual(len(questions), 3)
+            self.assertEqual(requests, 1)
+            # Nothing in the bank for this category
+            questions, _ = await self.take(3, 'histoire')
+            self.assertEqual(questions, [])
+        self.assertEqual(await QuizQuestion.objects.acount(), 5)
+
+
+@override_settings(QUIZ_API_RETRIES=2, QUIZ_API_BACKOFF=0, QUIZ_API_BREAKER_THRESHOLD=3)
+class QuizApiClientTests(SimpleTestCase):
+    """Which upstream replies are retried and held against the API."""
+
+    @contextlib.asynccontextmanager
+    async def upstream(self, status=200, body=None):
+        """Serve ``body`` with ``status`` at QUIZ_API_URL, yield the list of requests received."""
+        requests = []
+
+        async def quizzes(request):
+            requests.append(request.query)
+            return web.json_response({'quizzes': []} if body is None else body, status=status)
+
+        app = web.Application()
+        app.router.add_get('/quiz', quizzes)
+        async with TestServer(app) as server:
+            with self.settings(QUIZ_API_URL=str(server.make_url('/quiz'))):
+                api = QuizApiClient()
+                try:
+                    yield api, requests
+                finally:
+                    await api.close()
+
+    async def test_client_error_not_retried(self):
+        async with self.upstream(status=404) as (api, requests):
+            with self.assertRaises(aiohttp.ClientResponseError):
+                await api.fetch_quizzes(5, 'inconnue')
+            self.assertEqual(len(requests), 1)
+            self.assertEqual(api.breaker.failures, 0)
+
+    async def test_server_error_retried(self):
+        async with self.upstream(status=503) as (api, requests):
+            with self.assertRaises(aiohttp.ClientResponseError):
+                await api.fetch_quizzes(5)
+            self.assertEqual(len(requests), 3)
+            self.assertEqual(api.breaker.state, 'open')
+            with self.assertRaises(CircuitOpenError):
+                await api.fetch_quizzes(5)
+
+    async def test_body_not_an_object(self):
+        async with self.upstream(body=['q1', 'q2']) as (api, requests):
+            with self.assertRaises(InvalidResponseError):
+                await api.fetch_quizzes(5)
+            self.assertEqual(len(requests), 3)
+            self.assertEqual(api.breaker.failures, 3)
+
+    async def test_quizzes(self):
+        async with self.upstream(body={'quizzes': [{'_id': '1'}]}) as (api, requests):
+            self.assertEqual(await api.fetch_quizzes(5, 'histoire'), [{'_id': '1'}])
+            self.assertEqual(dict(requests[0]), {'limit': '5', 'category': 'histoire'})
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    def setUp(self):
+        self.breaker = CircuitBreaker(threshold=2, reset_timeout=30)
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+
+    def half_open(self):
+        self.breaker.opened_at -= 30
+
+    def test_opens_after_threshold(self):
+        self.assertEqual(self.breaker.state, 'open')
+        self.assertFalse(self.breaker.allow())
+
+    def test_single_probe_when_half_open(self):
+        self.half_open()
+        self.assertTrue(self.breaker.allow())
+        self.assertFalse(self.breaker.allow())
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.state, 'closed')
+        self.assertTrue(self.breaker.allow())
+        self.assertTrue(self.breaker.allow())
+
+    def test_failed_probe_opens_again(self):
+        self.half_open()
+        self.assertTrue(self.breaker.allow())
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, 'open')
+        self.assertFalse(self.breaker.allow())
+
+    def test_lost_probe(self):
+        self.half_open()
+        self.assertTrue(self.breaker.allow())
+        # The trial never reported back
+        self.breaker.probe_started -= 30
+        self.assertTrue(self.breaker.allow())
+
+
+class TokenBucketTests(SimpleTestCase):
+    def setUp(self):
+        self.bucket = TokenBucket(rate=2, burst=3)
+
+    def test_burst(self):
+        self.assertEqual([self.bucket.allow() for _ in range(4)], [True, True, True, False])
+
+    def test_refill(self):
+        for _ in range(3):
+            self.bucket.allow()
+        self.bucket.updated -= 1
+        self.assertEqual([self.bucket.allow() for _ in range(3)], [True, True, False])
+
+    def test_refill_capped_at_burst(self):
+        self.bucket.updated -= 60
+        self.assertEqual([self.bucket.allow() for _ in range(4)], [True, True, True, False])
+
+    def test_cost(self):
+        self.assertTrue(self.bucket.allow(cost=2))
+        # Not enough tokens left: none are taken
+        self.assertFalse(self.bucket.allow(cost=2))
+        self.assertTrue(self.bucket.allow())
+
+
+class ProtocolTests(SimpleTestCase):
+    ROWS = [
+        {'user_id': 1, 'username': 'a', 'score': 20, 'is_active': True, 'rank': 1},
+        {'user_id': 2, 'username': 'b', 'score': 10, 'is_active': False, 'rank': 2},
+    ]
+    COMPACT_ROWS = [[1, 20, 1, True], [2, 10, 2, False]]
+    PLAYERS = [{'user_id': 1, 'username': 'a'}, {'user_id': 2, 'username': 'b'}]
+    QUESTION = {'id': 'q', 'text': 'Question ?', 'options': ['A', 'B']}
+
+    # Payload of every message type, with the fields the compact protocol changes
+    PAYLOADS = [
+        ({'error': "Partie déjà en cours"}, {'t': 0, 'error': "Partie déjà en cours"}),
+        ({'action': 'game_state', 'seq': 4, 'players': PLAYERS, 'state': {'is_started': True, 'scores': ROWS}},
+         {'t': 1, 'seq': 4, 'players': [[1, 'a'], [2, 'b']], 'state': {'is_started': True, 'scores': COMPACT_ROWS}}),
+        ({'action': 'game_starting', 'settings': {'question_count': 2}, 'players': PLAYERS},
+         {'t': 2, 'settings': {'question_count': 2}, 'players': [[1, 'a'], [2, 'b']]}),
+        ({'action': 'participant_joined', 'user_id': 1, 'username': 'a'}, {'t': 3, 'user_id': 1, 'username': 'a'}),
+        ({'action': 'participant_left', 'user_id': 1, 'username': 'a'}, {'t': 4, 'user_id': 1, 'username': 'a'}),
+        ({'action': 'new_question', 'question': QUESTION, 'deadline': 1000},
+         {'t': 5, 'question': QUESTION, 'deadline': 1000}),
+        ({'action': 'answer_result', 'correct': True, 'selected_option': 'A'},
+         {'t': 6, 'correct': True, 'selected_option': 'A'}),
+        ({'action': 'scores_update', 'scores': ROWS}, {'t': 7, 'scores': COMPACT_ROWS}),
+        ({'action': 'scores_delta', 'changes': ROWS[:1], 'ranks': [{'user_id': 2, 'rank': 2}]},
+         {'t': 8, 'changes': COMPACT_ROWS[:1], 'ranks': [[2, 2]]}),
+        ({'action': 'game_over', 'final_scores': ROWS}, {'t': 9, 'final_scores': COMPACT_ROWS}),
+        ({'action': 'clock_sync', 'client_time': 1, 'server_time': 2}, {'t': 10, 'client_time': 1, 'server_time': 2}),
+        ({'action': 'batch', 'events': []}, {'t': 11, 'events': []}),
+    ]
+
+    def test_every_message_type(self):
+        self.assertEqual({compact['t'] for _, compact in self.PAYLOADS}, set(MESSAGE_TYPES.values()))
+
+    def test_transcode(self):
+        for payload, compact in self.PAYLOADS:
+            with self.subTest(payload.get('action', 'error')):
+                self.assertEqual(msgpack.unpackb(transcode(dumps(payload))), compact)
+
+    def test_deflate(self):
+        text = dumps({'action': 'scores_update', 'scores': self.ROWS * 50})
+        compressed = deflate(text)
+        self.assertLess(len(compressed), len(text))
+        self.assertEqual(zlib.decompressobj(-zlib.MAX_WBITS).decompress(compressed).decode(), text)
+
+    def test_batch_binary(self):
+        payloads = [payload for payload, _ in self.PAYLOADS[3:5]]
+        frames = [transcode(dumps(payload)) for payload in payloads]
+        self.assertEqual(msgpack.unpackb(batch_binary(frames)),
+                         {'t': 11, 'events': [compact for _, compact in self.PAYLOADS[3:5]]})
+
+
+class LeaderboardViewTests(APITestCase):
+    def setUp(self):
+        self.leaderboards = InMemoryLeaderboards()
+        patcher = mock.patch('quiz.leaderboards._leaderboards', self.leaderboards)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = User.objects.create_user('player')
+        self.client.force_authenticate(self.user)
+        async_to_sync(self.leaderboards.add_game)(
+            [board_key()], [(uid, f'joueur{uid}', uid * 10) for uid in range(1, 6)]
+        )
+
+    def test_top(self):
+        response = self.client.get('/api/leaderboards/?limit=2')
+        self.assertEqual([(row['user_id'], row['rank']) for row in response.data], [(5, 1), (4, 2)])
+
+    def test_limit_at_least_one(self):
+        # Not ZREVRANGE 0 -1: the whole leaderboard
+        response = self.client.get('/api/leaderboards/?limit=0')
+        self.assertEqual([row['user_id'] for row in response.data], [5])
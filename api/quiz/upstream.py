@@ -0,0 +1,199 @@
+"""
+Process-wide HTTP client of the upstream quiz API.
+
+One pooled, keep-alive ``aiohttp`` session is shared by every refill of the
+question bank. Requests have a timeout, failed ones are retried a bounded
+number of times with jittered exponential backoff, and a circuit breaker stops
+calling the API for a while after repeated failures (the bank then serves the
+questions it already holds). Only timeouts, connection errors, 5xx replies and
+bodies without quizzes are failures: a 4xx reply means the request itself is
+wrong, it is neither retried nor held against the API. Identical concurrent
+requests share one fetch.
+"""
+import asyncio
+import collections
+import logging
+import random
+import time
+
+import aiohttp
+from django.conf import settings
+
+from .metrics import question_fetch_seconds
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpenError(Exception):
+    """The upstream API failed too often recently, it isn't called."""
+
+
+class InvalidResponseError(Exception):
+    """The upstream API answered with something else than a list of quizzes."""
+
+
+class CircuitBreaker:
+    def __init__(self, threshold, reset_timeout):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        # Start of the trial request of the half-open circuit
+        self.probe_started = None
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    def allow(self):
+        # Once the reset timeout elapsed, a single trial request goes through: its
+        # success closes the circuit, its failure opens it for another period.
+        state = self.state
+        if state == 'closed':
+            return True
+        if state == 'open':
+            return False
+        now = time.monotonic()
+        # A trial that never reported back (cancelled) doesn't block the circuit forever
+        if self.probe_started is not None and now - self.probe_started < self.reset_timeout:
+            return False
+        self.probe_started = now
+        return True
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.probe_started = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == 'half-open' or self.failures >= self.threshold:
+            self.opened_at = time.monotonic()
+        self.probe_started = None
+
+
+class QuizApiClient:
+    def __init__(self):
+        self.session = None
+        self.session_loop = None
+        self.breaker = CircuitBreaker(settings.QUIZ_API_BREAKER_THRESHOLD, settings.QUIZ_API_BREAKER_RESET)
+        # Requests in progress, by (limit, category)
+        self.inflight = {}
+        self.latencies = collections.deque(maxlen=500)
+        self.stats = {
+            'requests': 0,
+            'errors': 0,
+            'retries': 0,
+            'short_circuited': 0,
+            'deduplicated': 0,
+        }
+
+    def get_session(self):
+        # A session is bound to its event loop, management commands run their own
+        loop = asyncio.get_running_loop()
+        if self.session is None or self.session.closed or self.session_loop is not loop:
+            self.session_loop = loop
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=settings.QUIZ_API_POOL_SIZE,
+                    keepalive_timeout=60,
+                    ttl_dns_cache=300,
+                ),
+                timeout=aiohttp.ClientTimeout(
+                    total=settings.QUIZ_API_TIMEOUT,
+                    connect=settings.QUIZ_API_TIMEOUT / 2,
+                ),
+            )
+        return self.session
+
+    async def fetch_quizzes(self, limit, category=None):
+        """Return up to ``limit`` questions of the category from the upstream API."""
+        key = (limit, category)
+        task = self.inflight.get(key)
+        if task is not None:
+            self.stats['deduplicated'] += 1
+        else:
+            task = asyncio.ensure_future(self._fetch(limit, category))
+            self.inflight[key] = task
+            task.add_done_callback(lambda _: self.inflight.pop(key, None))
+        # A cancelled caller must not cancel the fetch shared with the others
+        return await asyncio.shield(task)
+
+    async def _fetch(self, limit, category):
+        params = {'limit': limit}
+        if category:
+            params['category'] = category
+
+        for attempt in range(settings.QUIZ_API_RETRIES + 1):
+            if not self.breaker.allow():
+                self.stats['short_circuited'] += 1
+                raise CircuitOpenError("Quiz API circuit is open")
+            if attempt:
+                self.stats['retries'] += 1
+                # Full jitter backoff
+                await asyncio.sleep(random.uniform(0, settings.QUIZ_API_BACKOFF * 2 ** attempt))
+
+            self.stats['requests'] += 1
+            start = time.perf_counter()
+            try:
+                async with self.get_session().get(settings.QUIZ_API_URL, params=params) as resp:
+                    resp.raise_for_status()
+                    data = await resp.json()
+                quizzes = data.get('quizzes', []) if isinstance(data, dict) else None
+                if not isinstance(quizzes, list):
+                    raise InvalidResponseError(f"Unexpected quiz API response: {type(data).__name__}")
+            except aiohttp.ClientResponseError as e:
+                if not 400 <= e.status < 500:
+                    self.record_failure(attempt, e)
+                    if attempt == settings.QUIZ_API_RETRIES:
+                        raise
+                    continue
+                # The API answered: the request is wrong, not the API
+                self.stats['errors'] += 1
+                self.breaker.record_success()
+                raise
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError, InvalidResponseError) as e:
+                # ValueError: the body isn't JSON
+                self.record_failure(attempt, e)
+                if attempt == settings.QUIZ_API_RETRIES:
+                    raise
+                continue
+            finally:
+                self.latencies.append(time.perf_counter() - start)
+                question_fetch_seconds.observe(self.latencies[-1])
+
+            self.breaker.record_success()
+            return quizzes
+
+    def record_failure(self, attempt, error):
+        self.stats['errors'] += 1
+        self.breaker.record_failure()
+        logger.warning("Quiz API request failed (attempt %s): %r", attempt + 1, error)
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def metrics(self):
+        """Counters, circuit state and latency percentiles (seconds) of the client."""
+        latencies = sorted(self.latencies)
+
+        def percentile(p):
+            if not latencies:
+                return None
+            return latencies[min(len(latencies) - 1, int(p * len(latencies)))]
+
+        return {
+            **self.stats,
+            'circuit': self.breaker.state,
+            'latency_p50': percentile(0.5),
+            'latency_p99': percentile(0.99),
+        }
+
+
+quiz_api = QuizApiClient()
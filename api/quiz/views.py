@@ -0,0 +1,47 @@
+from rest_framework import viewsets, status
+from rest_framework.decorators import action
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from django.conf import settings
+
+from groups.models import GroupUser
+from .leaderboards import PERIODS, board_key, get_leaderboards
+
+
+class LeaderboardViewSet(viewsets.ViewSet):
+    """Leaderboards: global or of a group (?group=<id>), all-time or of the current week (?period=week)."""
+    permission_classes = [IsAuthenticated]
+
+    def get_board(self, request):
+        """Return the key of the requested leaderboard, or an error Response."""
+        period = request.query_params.get('period', 'all')
+        if period not in PERIODS:
+            return None, Response({"detail": "Période invalide."}, status=status.HTTP_400_BAD_REQUEST)
+        group_id = request.query_params.get('group')
+        if group_id:
+            if not group_id.isdigit():
+                return None, Response({"detail": "Groupe invalide."}, status=status.HTTP_400_BAD_REQUEST)
+            if not GroupUser.objects.filter(group_id=group_id, user=request.user).exists():
+                return None, Response({"detail": "Vous n'êtes pas membre du groupe."},
+                                      status=status.HTTP_403_FORBIDDEN)
+        return board_key(group_id, period), None
+
+    def list(self, request):
+        """Top players of the leaderboard (?limit=N)"""
+        key, error = self.get_board(request)
+        if error:
+            return error
+        limit = request.query_params.get('limit', '')
+        limit = max(1, min(int(limit), settings.API_MAX_PAGE_SIZE)) if limit.isdigit() else settings.API_PAGE_SIZE
+        return Response(get_leaderboards().top(key, limit), status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=['get'])
+    def me(self, request):
+        """Rank and score of the user in the leaderboard"""
+        key, error = self.get_board(request)
+        if error:
+            return error
+        entry = get_leaderboards().rank(key, request.user.id)
+        if entry is None:
+            entry = {'user_id': request.user.id, 'score': 0, 'rank': None}
+        return Response(entry, status=status.HTTP_200_OK)
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class RoomsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'rooms'
+
+    def ready(self):
+        # Membership cache and lobby index signals
+        from . import cache, lobby  # noqa: F401
@@ -0,0 +1,109 @@
+"""
+Cache of room membership: creator id and participant ids of each room.
+
+Loaded with a single query and read by the quiz consumers and engines instead
+of querying RoomUser/Room on every connection.
+
+Entries are versioned: the RoomUser and Room signals bump the version of the
+room whenever the membership changes, and an entry only counts if it was
+loaded at the current version. A reader that loaded the membership before a
+change committed, and stores it after the change was invalidated, stores it
+under a version nobody reads.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from mindvswild.executor import run_sync
+from .models import Room, RoomUser
+
+
+def _cache_key(room_id):
+    return f'rooms:membership:{room_id}'
+
+
+def _version_key(room_id):
+    return f'rooms:membership-version:{room_id}'
+
+
+def _cached(entries, room_id):
+    """Version of the room and the membership cached at that version, if any."""
+    version = entries.get(_version_key(room_id))
+    entry = entries.get(_cache_key(room_id))
+    if version is None or entry is None or entry['version'] != version:
+        return version, None
+    return version, entry['membership']
+
+
+def load_membership(room_id):
+    """Return ``{'creator_id': int, 'participants': set}`` or None if the room doesn't exist."""
+    rows = list(Room.objects.filter(pk=room_id).values_list('created_by_id', 'participants__user_id'))
+    if not rows:
+        return None
+    return {
+        'creator_id': rows[0][0],
+        'participants': {user_id for _, user_id in rows if user_id is not None},
+    }
+
+
+def refresh_membership(room_id, version=None):
+    if version is None:
+        # A new version after an eviction: the entries stored before it don't count
+        cache.add(_version_key(room_id), time.time_ns(), None)
+        version = cache.get(_version_key(room_id))
+    # Read before the query: a change committed meanwhile bumps it
+    membership = load_membership(room_id)
+    if membership is not None:
+        cache.set(_cache_key(room_id), {'version': version, 'membership': membership},
+                  settings.ROOM_MEMBERSHIP_CACHE_TTL)
+    return membership
+
+
+async def arefresh_membership(room_id, version=None):
+    if version is None:
+        await cache.aadd(_version_key(room_id), time.time_ns(), None)
+        version = await cache.aget(_version_key(room_id))
+    membership = await run_sync(load_membership, room_id)
+    if membership is not None:
+        await cache.aset(_cache_key(room_id), {'version': version, 'membership': membership},
+                         settings.ROOM_MEMBERSHIP_CACHE_TTL)
+    return membership
+
+
+def get_membership(room_id):
+    version, membership = _cached(cache.get_many([_version_key(room_id), _cache_key(room_id)]), room_id)
+    if membership is None:
+        membership = refresh_membership(room_id, version)
+    return membership
+
+
+async def aget_membership(room_id):
+    """Async version of ``get_membership``, the database is only hit on a cache miss."""
+    entries = await cache.aget_many([_version_key(room_id), _cache_key(room_id)])
+    version, membership = _cached(entries, room_id)
+    if membership is None:
+        membership = await arefresh_membership(room_id, version)
+    return membership
+
+
+def invalidate_membership(room_id):
+    try:
+        cache.incr(_version_key(room_id))
+    except ValueError:
+        # No version: the next refresh starts a new one
+        pass
+
+
+@receiver(post_save, sender=RoomUser)
+@receiver(post_delete, sender=RoomUser)
+def room_user_changed(sender, instance, **kwargs):
+    transaction.on_commit(lambda: invalidate_membership(instance.room_id))
+
+
+@receiver(post_delete, sender=Room)
+def room_deleted(sender, instance, **kwargs):
+    transaction.on_commit(lambda: invalidate_membership(instance.pk))
@@ -0,0 +1,234 @@
+"""
+Live index of the joinable rooms.
+
+The lobby lists the active public rooms with their number of participants and
+whether a game is running, without touching the database. The participants are
+the members of the room, connected or not: the players of a running game are
+only known to its engine. The index is kept in Redis sorted sets, updated by
+the Room/RoomUser signals (create, join, leave, deactivation, deletion) and by
+the quiz engines (game start and end). The in-memory backend has the same
+semantics and is meant for tests.
+
+The index is best-effort: a Redis failure doesn't fail the request that changed
+the room, and ``manage.py rebuild_lobby`` rebuilds it from the database.
+"""
+import json
+import logging
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from redis.exceptions import RedisError
+
+from mindvswild.redis_client import get_async_redis, get_redis
+from .models import Room, RoomUser
+
+logger = logging.getLogger(__name__)
+
+
+def room_entry(room):
+    """Display data of a room in the lobby."""
+    return {
+        'id': room.id,
+        'name': room.name,
+        'created_at': room.created_at.isoformat(),
+        'created_by': room.created_by.username,
+    }
+
+
+class InMemoryLobby:
+    def __init__(self):
+        self.rooms = {}
+        self.participants = {}
+        # Room id -> start of the running game (epoch seconds)
+        self.games = {}
+
+    def add_room(self, room, participant_count=0):
+        self.rooms[room.id] = (room.created_at.timestamp(), room_entry(room))
+        self.participants[room.id] = participant_count
+
+    def remove_room(self, room_id):
+        self.rooms.pop(room_id, None)
+        self.participants.pop(room_id, None)
+
+    def add_participants(self, room_id, delta):
+        if room_id in self.rooms:
+            self.participants[room_id] += delta
+
+    async def set_in_game(self, room_id, in_game):
+        if in_game:
+            self.games[int(room_id)] = time.time()
+        else:
+            self.games.pop(int(room_id), None)
+
+    def clear(self):
+        self.rooms.clear()
+        self.participants.clear()
+
+    def list_rooms(self, limit, order='recent'):
+        if order == 'participants':
+            ids = sorted(self.rooms, key=lambda room_id: self.participants[room_id], reverse=True)
+        else:
+            ids = sorted(self.rooms, key=lambda room_id: self.rooms[room_id][0], reverse=True)
+        started_after = time.time() - settings.QUIZ_GAME_TTL
+        return [
+            {
+                **self.rooms[room_id][1],
+                'participant_count': self.participants[room_id],
+                'in_game': self.games.get(room_id, 0) > started_after,
+            }
+            for room_id in ids[:limit]
+        ]
+
+
+# Only counts the participants of rooms that are in the lobby
+_ADD_PARTICIPANTS = """
+if redis.call('ZSCORE', KEYS[1], ARGV[1]) then
+    return redis.call('ZINCRBY', KEYS[2], ARGV[2], ARGV[1])
+end
+return nil
+"""
+
+
+class RedisLobby:
+    """Sorted sets of the lobby rooms, by creation time and by number of participants."""
+
+    ROOMS = 'lobby:rooms'
+    PARTICIPANTS = 'lobby:participants'
+    GAMES = 'lobby:games'
+    INFO = 'lobby:info'
+
+    def __init__(self, client=None, async_client=None):
+        self.client = client or get_redis()
+        self.async_client = async_client or get_async_redis()
+        self._add_participants = self.client.register_script(_ADD_PARTICIPANTS)
+
+    def add_room(self, room, participant_count=0):
+        with self.client.pipeline(transaction=True) as pipe:
+            pipe.zadd(self.ROOMS, {room.id: room.created_at.timestamp()})
+            pipe.zadd(self.PARTICIPANTS, {room.id: participant_count})
+            pipe.hset(self.INFO, room.id, json.dumps(room_entry(room)))
+            pipe.execute()
+
+    def remove_room(self, room_id):
+        with self.client.pipeline(transaction=True) as pipe:
+            pipe.zrem(self.ROOMS, room_id)
+            pipe.zrem(self.PARTICIPANTS, room_id)
+            pipe.hdel(self.INFO, room_id)
+            pipe.execute()
+
+    def add_participants(self, room_id, delta):
+        self._add_participants(keys=[self.ROOMS, self.PARTICIPANTS], args=[room_id, delta])
+
+    async def set_in_game(self, room_id, in_game):
+        # Game start time rather than a flag: a game whose engine died is
+        # ignored once it would have expired from the game store
+        if in_game:
+            await self.async_client.zadd(self.GAMES, {room_id: time.time()})
+        else:
+            await self.async_client.zrem(self.GAMES, room_id)
+
+    def clear(self):
+        self.client.delete(self.ROOMS, self.PARTICIPANTS, self.INFO)
+
+    def list_rooms(self, limit, order='recent'):
+        key = self.PARTICIPANTS if order == 'participants' else self.ROOMS
+        ids = self.client.zrevrange(key, 0, limit - 1)
+        if not ids:
+            return []
+        with self.client.pipeline(transaction=False) as pipe:
+            pipe.hmget(self.INFO, ids)
+            pipe.zmscore(self.PARTICIPANTS, ids)
+            pipe.zmscore(self.GAMES, ids)
+            infos, counts, games = pipe.execute()
+        started_after = time.time() - settings.QUIZ_GAME_TTL
+        return [
+            {
+                **json.loads(info),
+                'participant_count': int(count or 0),
+                'in_game': bool(started and started > started_after),
+            }
+            for info, count, started in zip(infos, counts, games)
+            # Removed between the two reads
+            if info is not None
+        ]
+
+
+_BACKENDS = {
+    'memory': InMemoryLobby,
+    'redis': RedisLobby,
+}
+_lobby = None
+
+
+def get_lobby():
+    """Return the lobby index configured by ``settings.ROOM_LOBBY_BACKEND``."""
+    global _lobby
+    if _lobby is None:
+        _lobby = _BACKENDS[settings.ROOM_LOBBY_BACKEND]()
+    return _lobby
+
+
+def in_lobby(room):
+    return room.group_id is None and room.is_active
+
+
+def _update(method, *args):
+    def update():
+        try:
+            getattr(get_lobby(), method)(*args)
+        except RedisError:
+            logger.warning("Could not update the lobby index (%s %s)", method, args, exc_info=True)
+    transaction.on_commit(update)
+
+
+async def set_room_in_game(room_id, in_game):
+    """Called by the quiz engine when a game of the room starts or ends."""
+    try:
+        await get_lobby().set_in_game(room_id, in_game)
+    except RedisError:
+        logger.warning("Could not update the lobby index (room %s in game: %s)", room_id, in_game, exc_info=True)
+
+
+def rebuild_lobby():
+    """Rebuild the index of the lobby rooms from the database, return their number."""
+    rooms = list(
+        Room.objects.filter(group__isnull=True, is_active=True)
+        .select_related('created_by').annotate(participant_count=Count('participants'))
+    )
+    lobby = get_lobby()
+    lobby.clear()
+    for room in rooms:
+        lobby.add_room(room, room.participant_count)
+    return len(rooms)
+
+
+@receiver(post_save, sender=Room)
+def room_saved(sender, instance, created, **kwargs):
+    if not in_lobby(instance):
+        if not created:
+            _update('remove_room', instance.id)
+    elif created:
+        _update('add_room', instance)
+    else:
+        # Renamed or reactivated
+        _update('add_room', instance, instance.participants.count())
+
+
+@receiver(post_delete, sender=Room)
+def room_deleted(sender, instance, **kwargs):
+    _update('remove_room', instance.id)
+
+
+@receiver(post_save, sender=RoomUser)
+def room_user_saved(sender, instance, created, **kwargs):
+    if created:
+        _update('add_participants', instance.room_id, 1)
+
+
+@receiver(post_delete, sender=RoomUser)
+def room_user_deleted(sender, instance, **kwargs):
+    _update('add_participants', instance.room_id, -1)
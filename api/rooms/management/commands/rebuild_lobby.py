@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from rooms.lobby import rebuild_lobby
+
+
+class Command(BaseCommand):
+    help = "Rebuild the live lobby index of the public rooms from the database."
+
+    def handle(self, *args, **options):
+        count = rebuild_lobby()
+        self.stdout.write(f"{count} rooms in the lobby")
@@ -0,0 +1,28 @@
+# Generated by Django 5.1.5 on 2026-10-18 15:42
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('groups', '0002_listing_indexes'),
+        ('rooms', '0002_remove_room_code'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='room',
+            index=models.Index(fields=['-created_at', '-id'], name='room_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='room',
+            index=models.Index(fields=['is_active', '-created_at', '-id'], name='room_active_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='room',
+            index=models.Index(fields=['group', '-created_at', '-id'], name='room_group_created_idx'),
+        ),
+    ]
@@ -12,6 +12,14 @@ class Room(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     is_active = models.BooleanField(default=True)
 
+    class Meta:
+        # Keyset pagination of the listings, see mindvswild.pagination
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='room_created_idx'),
+            models.Index(fields=['is_active', '-created_at', '-id'], name='room_active_created_idx'),
+            models.Index(fields=['group', '-created_at', '-id'], name='room_group_created_idx'),
+        ]
+
     def __str__(self):
         return f"Room {self.name}"
 
@@ -23,11 +23,28 @@ class RoomParticipantSerializer(serializers.ModelSerializer):
 
 class RoomSerializer(serializers.ModelSerializer):
     participants = RoomParticipantSerializer(many=True, read_only=True)
+    participant_count = serializers.SerializerMethodField()
     created_by = UserSerializer(read_only=True) 
     
     class Meta:
         model = Room
         fields = [
-            'id', 'name', 'group', 'created_by', 'created_at', 'participants', 'is_active'
+            'id', 'name', 'group', 'created_by', 'created_at', 'participants', 'participant_count', 'is_active'
         ]
-        read_only_fields = ['created_by', 'created_at', 'participants']
\ No newline at end of file
+        read_only_fields = ['created_by', 'created_at', 'participants']
+
+    def get_participant_count(self, obj):
+        # Uses the prefetched participants
+        return len(obj.participants.all())
+
+
+class RoomListSerializer(serializers.ModelSerializer):
+    """Room listing: the number of participants instead of the nested participants."""
+    created_by = UserSerializer(read_only=True)
+    # Annotated by the queryset
+    participant_count = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = Room
+        fields = ['id', 'name', 'group', 'created_by', 'created_at', 'participant_count', 'is_active']
+        read_only_fields = fields
\ No newline at end of file
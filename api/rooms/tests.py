@@ -1,3 +1,206 @@
-from django.test import TestCase
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from rest_framework.test import APITestCase
+
+from authentication.models import Profile
+from groups.models import Group, GroupUser
+from .cache import _version_key, get_membership, invalidate_membership, load_membership
+from .lobby import InMemoryLobby, set_room_in_game
+from .models import Room, RoomUser
+
+
+class RoomQueryCountTests(APITestCase):
+    """The room endpoints run a constant number of queries, whatever the number of rooms and participants."""
+
+    def setUp(self):
+        self.user = User.objects.create_user('owner', password='x')
+        Profile.objects.create(user=self.user, profile_picture_type=2)
+        self.group = Group.objects.create(name='group', created_by=self.user)
+        GroupUser.objects.create(group=self.group, user=self.user, is_admin=True)
+        self.client.force_authenticate(self.user)
+
+    def add_rooms(self, count, participants):
+        rooms = []
+        for i in range(count):
+            room = Room.objects.create(name=f'room {i}', created_by=self.user, group=self.group if i % 2 else None)
+            RoomUser.objects.create(room=room, user=self.user)
+            for j in range(participants):
+                user = User.objects.create_user(f'player {room.id}-{j}')
+                Profile.objects.create(user=user)
+                RoomUser.objects.create(room=room, user=user)
+            rooms.append(room)
+        return rooms
+
+    def test_list(self):
+        self.add_rooms(2, 1)
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/rooms/')
+        self.add_rooms(10, 5)
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/rooms/')
+        self.assertEqual(len(response.data['results']), 12)
+        self.assertEqual({room['participant_count'] for room in response.data['results']}, {2, 6})
+
+    def test_list_hides_rooms_of_other_groups(self):
+        other = User.objects.create_user('other')
+        group = Group.objects.create(name='other group', created_by=other)
+        Room.objects.create(name='hidden', created_by=other, group=group)
+        self.add_rooms(2, 0)
+        response = self.client.get('/api/rooms/')
+        self.assertEqual(len(response.data['results']), 2)
+
+    def test_retrieve(self):
+        small, large = self.add_rooms(1, 1) + self.add_rooms(1, 20)
+        with self.assertNumQueries(2):
+            self.client.get(f'/api/rooms/{small.id}/')
+        with self.assertNumQueries(2):
+            response = self.client.get(f'/api/rooms/{large.id}/')
+        self.assertEqual(len(response.data['participants']), 21)
+        self.assertEqual(response.data['participant_count'], 21)
+
+
+class RoomListingTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('owner', password='x')
+        self.client.force_authenticate(self.user)
+        self.rooms = [
+            Room.objects.create(name=f'room {i}', created_by=self.user, is_active=bool(i % 3))
+            for i in range(12)
+        ]
+
+    def test_cursor_pages(self):
+        ids, url = [], '/api/rooms/?page_size=5'
+        while url:
+            with self.assertNumQueries(1):
+                response = self.client.get(url)
+            ids += [room['id'] for room in response.data['results']]
+            url = response.data['next']
+        # Newest first, every room once
+        self.assertEqual(ids, [room.id for room in reversed(self.rooms)])
+
+    def test_is_active_filter(self):
+        response = self.client.get('/api/rooms/?is_active=true')
+        self.assertEqual({room['id'] for room in response.data['results']},
+                         {room.id for room in self.rooms if room.is_active})
+        response = self.client.get('/api/rooms/?is_active=false')
+        self.assertEqual({room['id'] for room in response.data['results']},
+                         {room.id for room in self.rooms if not room.is_active})
+
+
+class LobbyTests(APITestCase):
+    def setUp(self):
+        patcher = mock.patch('rooms.lobby._lobby', InMemoryLobby())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = User.objects.create_user('owner', password='x')
+        self.client.force_authenticate(self.user)
+
+    def create_room(self, **fields):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/rooms/', {'name': 'room', **fields}, format='json')
+        return Room.objects.get(pk=response.data['id'])
+
+    def lobby(self):
+        # Served from the index only
+        with self.assertNumQueries(0):
+            return self.client.get('/api/rooms/lobby/').data
+
+    def test_create_join_leave(self):
+        room = self.create_room()
+        self.assertEqual([(r['id'], r['participant_count'], r['in_game']) for r in self.lobby()], [(room.id, 1, False)])
+
+        player = User.objects.create_user('player')
+        self.client.force_authenticate(player)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/rooms/{room.id}/join/')
+        self.assertEqual(self.lobby()[0]['participant_count'], 2)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/rooms/{room.id}/leave/')
+        self.assertEqual(self.lobby()[0]['participant_count'], 1)
+
+    def test_limit(self):
+        rooms = [self.create_room() for _ in range(3)]
+        self.assertEqual(len(self.client.get('/api/rooms/lobby/?limit=2').data), 2)
+        # Not ZREVRANGE 0 -1: the whole index
+        self.assertEqual([r['id'] for r in self.client.get('/api/rooms/lobby/?limit=0').data], [rooms[-1].id])
+
+    def test_game_in_progress(self):
+        room = self.create_room()
+        async_to_sync(set_room_in_game)(str(room.id), True)
+        self.assertTrue(self.lobby()[0]['in_game'])
+        async_to_sync(set_room_in_game)(str(room.id), False)
+        self.assertFalse(self.lobby()[0]['in_game'])
+
+    def test_only_active_public_rooms(self):
+        group = Group.objects.create(name='group', created_by=self.user)
+        GroupUser.objects.create(group=group, user=self.user, is_admin=True)
+        self.create_room(group=group.id)
+        room = self.create_room()
+        self.assertEqual([r['id'] for r in self.lobby()], [room.id])
+        with self.captureOnCommitCallbacks(execute=True):
+            room.is_active = False
+            room.save()
+        self.assertEqual(self.lobby(), [])
+
+
+class MembershipCacheTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.owner = User.objects.create_user('owner')
+        self.player = User.objects.create_user('player')
+        self.room = Room.objects.create(name='room', created_by=self.owner)
+        RoomUser.objects.create(room=self.room, user=self.owner)
+        self.client.force_authenticate(self.player)
+
+    def test_miss_then_hit(self):
+        with self.assertNumQueries(1):
+            membership = get_membership(self.room.id)
+        self.assertEqual(membership, {'creator_id': self.owner.id, 'participants': {self.owner.id}})
+        with self.assertNumQueries(0):
+            get_membership(self.room.id)
+
+    def test_unknown_room(self):
+        self.assertIsNone(get_membership(0))
+
+    def test_join_invalidates(self):
+        get_membership(self.room.id)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/rooms/{self.room.id}/join/')
+        self.assertEqual(get_membership(self.room.id)['participants'], {self.owner.id, self.player.id})
+
+    def test_leave_invalidates(self):
+        RoomUser.objects.create(room=self.room, user=self.player)
+        self.assertIn(self.player.id, get_membership(self.room.id)['participants'])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/rooms/{self.room.id}/leave/')
+        self.assertEqual(get_membership(self.room.id)['participants'], {self.owner.id})
+
+    def test_room_deletion_invalidates(self):
+        get_membership(self.room.id)
+        self.client.force_authenticate(self.owner)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/rooms/{self.room.id}/leave/')
+        self.assertIsNone(get_membership(self.room.id))
+
+    def test_stale_load_not_served(self):
+        def load_then_join(room_id):
+            membership = load_membership(room_id)
+            # A join committed and invalidated between the query and the cache write
+            with self.captureOnCommitCallbacks(execute=True):
+                RoomUser.objects.create(room=self.room, user=self.player)
+            return membership
+
+        with mock.patch('rooms.cache.load_membership', side_effect=load_then_join):
+            self.assertEqual(get_membership(self.room.id)['participants'], {self.owner.id})
+        self.assertEqual(get_membership(self.room.id)['participants'], {self.owner.id, self.player.id})
+
+    def test_evicted_version(self):
+        get_membership(self.room.id)
+        cache.delete(_version_key(self.room.id))
+        # Without a version, the invalidation has nothing to bump
+        invalidate_membership(self.room.id)
+        with self.assertNumQueries(1):
+            get_membership(self.room.id)
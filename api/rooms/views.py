@@ -5,20 +5,60 @@ from django.shortcuts import get_object_or_404
 from rest_framework.permissions import IsAuthenticated
 from .models import Room, Group, RoomUser
 from django.db import transaction
-from .serializers import RoomSerializer
+from django.db.models import Count, OuterRef, Prefetch, Q, Subquery
+from django.db.models.functions import Coalesce
+from groups.models import GroupUser
+from mindvswild.pagination import CreatedAtCursorPagination
+from .serializers import RoomListSerializer, RoomSerializer
+from .cache import refresh_membership
+from .lobby import get_lobby
+from django.conf import settings
+
+def room_details_queryset():
+    """Rooms with their creator and participants fetched in two queries."""
+    return Room.objects.select_related('created_by__auth_profile').prefetch_related(
+        Prefetch('participants', queryset=RoomUser.objects.select_related('user__auth_profile'))
+    )
+
 
 ### Room ViewSet
 class RoomViewSet(viewsets.ModelViewSet):
     queryset = Room.objects.all()
     serializer_class = RoomSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = CreatedAtCursorPagination
 
     def get_queryset(self):
         """Limit to rooms of groups where the user is a member and public rooms."""
         user = self.request.user
-        return Room.objects.filter(
-            group__memberships__user=user
-        ) | Room.objects.filter(group__isnull=True)
+        # Subquery rather than a join on the memberships, which would skew the counts
+        visible = Q(group__isnull=True) | Q(group__in=GroupUser.objects.filter(user=user).values('group'))
+        if self.action == 'list':
+            return self.filter_listing(Room.objects.filter(visible)).select_related(
+                'created_by__auth_profile'
+            ).annotate(
+                # Correlated subquery: only computed for the rows of the page,
+                # where a GROUP BY would aggregate the whole table first
+                participant_count=Coalesce(Subquery(
+                    RoomUser.objects.filter(room=OuterRef('pk')).order_by().values('room')
+                    .annotate(count=Count('pk')).values('count')
+                ), 0)
+            )
+        return room_details_queryset().filter(visible)
+
+    def filter_listing(self, queryset):
+        """Filters of the listing: ?is_active=true|false and ?group=<id>."""
+        params = self.request.query_params
+        if 'is_active' in params:
+            queryset = queryset.filter(is_active=params['is_active'].lower() in ('1', 'true'))
+        if params.get('group', '').isdigit():
+            queryset = queryset.filter(group_id=params['group'])
+        return queryset
+
+    def get_serializer_class(self):
+        if self.action == 'list':
+            return RoomListSerializer
+        return RoomSerializer
         
     def perform_create(self, serializer):
         """Create a room linked to a group or as a public room"""
@@ -40,6 +80,14 @@ class RoomViewSet(viewsets.ModelViewSet):
         # Return the created room's details
         return Response(RoomSerializer(room).data, status=status.HTTP_201_CREATED)
 
+    @action(detail=False, methods=['get'], permission_classes=[IsAuthenticated])
+    def lobby(self, request):
+        """Active public rooms with their number of participants and running game, from the live index"""
+        order = 'participants' if request.query_params.get('order') == 'participants' else 'recent'
+        limit = request.query_params.get('limit', '')
+        limit = max(1, min(int(limit), settings.API_MAX_PAGE_SIZE)) if limit.isdigit() else settings.API_PAGE_SIZE
+        return Response(get_lobby().list_rooms(limit, order), status=status.HTTP_200_OK)
+
     @action(detail=True, methods=['post'], permission_classes=[IsAuthenticated])
     def join(self, request, pk=None):
         """Join a room by id"""
@@ -51,7 +99,11 @@ class RoomViewSet(viewsets.ModelViewSet):
         
         # Add the user to the room if not already a participant
         room_user, created = RoomUser.objects.get_or_create(room=room, user=request.user)
+        # Reloaded with its participants, the new one included
+        room = room_details_queryset().get(pk=room.pk)
         if created:
+            # The client opens the room WebSocket right after joining
+            refresh_membership(room.id)
             return Response({
                 "detail": "Vous avez rejoint la salle.",
                 "room": RoomSerializer(room).data
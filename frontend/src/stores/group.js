@@ -4,6 +4,8 @@ import axios from 'axios'
 export const useGroupStore = defineStore('group', {
   state: () => ({
     groups: [],
+    // URL of the next page of the listing, null on the last one
+    nextGroups: null,
     currentGroup: null,
   }),
   actions: {
@@ -12,7 +14,25 @@ export const useGroupStore = defineStore('group', {
       const response = await axios.get(`${import.meta.env.VITE_BACKEND_URL}/api/groups/`, {
         headers: { Authorization: `Token ${token}` },
       })
-      this.groups = response.data
+      this.groups = response.data.results
+      this.nextGroups = response.data.next
+    },
+    async fetchMoreGroups() {
+      if (!this.nextGroups) return
+      const token = localStorage.getItem('token')
+      const response = await axios.get(this.nextGroups, {
+        headers: { Authorization: `Token ${token}` },
+      })
+      this.groups.push(...response.data.results)
+      this.nextGroups = response.data.next
+    },
+    async fetchGroup(id) {
+      const token = localStorage.getItem('token')
+      const response = await axios.get(`${import.meta.env.VITE_BACKEND_URL}/api/groups/${id}/`, {
+        headers: { Authorization: `Token ${token}` },
+      })
+      this.currentGroup = response.data
+      return this.currentGroup
     },
     async createGroup(name, description) {
       const token = localStorage.getItem('token')
@@ -4,15 +4,41 @@ import axios from 'axios'
 export const useRoomStore = defineStore('room', {
   state: () => ({
     rooms: [],
+    // URL of the next page of the listing, null on the last one
+    nextRooms: null,
+    // Active public rooms with their players and running game
+    lobby: [],
     currentRoom: null,
   }),
   actions: {
-    async fetchRooms() {
+    async fetchRooms(params = {}) {
       const token = localStorage.getItem('token')
       const response = await axios.get(`${import.meta.env.VITE_BACKEND_URL}/api/rooms/`, {
         headers: { Authorization: `Token ${token}` },
+        params,
       })
-      this.rooms = response.data
+      this.rooms = response.data.results
+      this.nextRooms = response.data.next
+    },
+
+    async fetchMoreRooms() {
+      if (!this.nextRooms) return
+      const token = localStorage.getItem('token')
+      const response = await axios.get(this.nextRooms, {
+        headers: { Authorization: `Token ${token}` },
+      })
+      this.rooms.push(...response.data.results)
+      this.nextRooms = response.data.next
+    },
+
+    async fetchLobby(order = 'recent') {
+      const token = localStorage.getItem('token')
+      const response = await axios.get(`${import.meta.env.VITE_BACKEND_URL}/api/rooms/lobby/`, {
+        headers: { Authorization: `Token ${token}` },
+        params: { order },
+      })
+      this.lobby = response.data
+      return this.lobby
     },
 
     async fetchRoomDetails(id) {